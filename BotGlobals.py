@@ -10,27 +10,65 @@ import sys
 import os
 
 
+# Default values for every config key. Keys added after the first release may be missing from older Config.json
+# files, so we fill them in from here rather than making everyone re-generate their config.
+
+defaultConfig = {"userId": 0,
+                 "token": "SETME",
+                 "mongoServerString": "SETME",
+                 "version": "v1.0.0",
+                 "commandPrefix": "~",
+                 "useMongoDb": True,
+                 "mongoSchema": "perGuild",
+                 "mongoDatabaseName": "RoleProvider",
+                 "mongoMaxPoolSize": 100,
+                 "mongoServerSelectionTimeoutMs": 5000,
+                 "mongoConnectTimeoutMs": 5000,
+                 "mongoSocketTimeoutMs": 10000,
+                 "storageBreakerFailures": 5,
+                 "storageBreakerResetSeconds": 30,
+                 "storageBackend": "yaml",
+                 "sqlitePath": "./databases/RoleProvider.sqlite3",
+                 "storageWorkers": 4,
+                 "guildCacheSize": 10000,
+                 "guildCacheTtl": 3600,
+                 "preloadGuildDatabases": False,
+                 "writeBehindWindow": 0,
+                 "storageFsync": False,
+                 "roleMutationScheduler": False,
+                 "roleMutationRate": 5.0,
+                 "roleMutationBurst": 5,
+                 "fastAckRoleSelection": False,
+                 "logLevel": "INFO",
+                 "logJson": False,
+                 "logFile": None,
+                 "logMaxBytes": 10485760,
+                 "logBackupCount": 5,
+                 "logSampling": {"roleChanges": 1.0},
+                 "metricsHost": "127.0.0.1",
+                 "metricsPort": 0,
+                 "shardCount": 1,
+                 "shardsPerProcess": 4,
+                 "guildSnapshotFile": None,
+                 "guildSnapshotInterval": 300,
+                 "guildRefreshInterval": 0,
+                 "staleRoleSweepInterval": 3600}
+
+
 # We store our config values in a json file. If this file is missing, we generate a fresh one with default values.
 
 if os.path.exists("Config.json"):
     with open("Config.json", "r") as configFile:
-        config = json.load(configFile)
+        config = {**defaultConfig, **json.load(configFile)}
 else:
     print("ERROR: Config file is missing. A new one will be generated for you. Please re-configure the bot then try again.")
-    
-    defaultConfig = {"userId": 0,
-                     "token": "SETME",
-                     "mongoServerString": "SETME",
-                     "version": "v1.0.0",
-                     "commandPrefix": "~",
-                     "useMongoDb": True}
-    
+
     # Default values, which will need to be changed before running the bot again.
-    
+
     with open("Config.json", "w") as configFile:
         json.dump(defaultConfig, configFile, indent=4)
 
     sys.exit(1)
 
 
-globals().update(config) # This stores all of our config values as variables.
\ No newline at end of file
+globals().update(config) # This stores all of our config values as variables.
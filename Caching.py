@@ -0,0 +1,243 @@
+"""
+Caching
+~~~~~~~
+
+Caches used by the Extensions, so that we only load and keep what's actually being used.
+"""
+
+import Metrics
+
+from array import array
+import asyncio
+import bisect
+from collections import OrderedDict
+import time
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    # Storage imports us, so we only import it for type checking.
+    from Storage import GuildConfig
+
+
+class GuildCache:
+
+    # A bounded LRU cache of guild databases, loaded on first use. Entries are evicted once we hold more than
+    # maxSize guilds (least recently used first), or reloaded once they're older than ttl seconds (0 to never expire).
+
+    # Loads are single-flight, if several interactions ask for the same cold guild at once, only one fetch is made
+    # and every caller waits on it.
+
+
+    def __init__(self, loader, maxSize:int, ttl:float) -> None:
+        # The loader is a coroutine function taking a guildId and returning that guild's Storage.GuildConfig.
+        self.loader = loader
+        self.maxSize = maxSize
+        self.ttl = ttl
+        self.entries = OrderedDict() # guildId: (guildDb, loadedAt)
+        self.loading = {} # guildId: Future, for loads that are currently in flight.
+
+
+    def __contains__(self, guildId:int) -> bool:
+        return guildId in self.entries
+
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+    def isExpired(self, loadedAt:float) -> bool:
+        return self.ttl > 0 and time.monotonic() - loadedAt > self.ttl
+
+
+    def peek(self, guildId:int) -> "GuildConfig | None":
+        # Return the cached database without loading it or changing its place in the LRU order.
+        entry = self.entries.get(guildId)
+        return entry[0] if entry else None
+
+
+    async def get(self, guildId:int) -> "GuildConfig":
+        entry = self.entries.get(guildId)
+        if entry and not self.isExpired(entry[1]):
+            # Cache hit, mark it as the most recently used.
+            self.entries.move_to_end(guildId)
+            Metrics.cacheLookup("guild", True)
+            return entry[0]
+
+        Metrics.cacheLookup("guild", False)
+
+        if guildId in self.loading:
+            # Someone else is already loading this guild, wait for them instead of fetching it again.
+            return await asyncio.shield(self.loading[guildId])
+
+        future = asyncio.get_running_loop().create_future()
+        self.loading[guildId] = future
+        try:
+            guildDb = await self.loader(guildId)
+            self.put(guildId, guildDb)
+            future.set_result(guildDb)
+            return guildDb
+        except Exception as exception:
+            if entry:
+                # We couldn't reload an expired guild, so keep serving the copy we have until storage is back.
+                Metrics.increment("guild_cache_stale_served_total")
+                future.set_result(entry[0])
+                return entry[0]
+            # Don't cache failures, pass the exception on to anyone waiting and let the next caller try again.
+            future.set_exception(exception)
+            future.exception() # Mark the exception as retrieved, in case nobody else was waiting.
+            raise
+        finally:
+            del self.loading[guildId]
+            if not future.done():
+                # We were cancelled part way through, so cancel anyone waiting on us too.
+                future.cancel()
+
+
+    def put(self, guildId:int, guildDb:"GuildConfig") -> None:
+        self.entries[guildId] = (guildDb, time.monotonic())
+        self.entries.move_to_end(guildId)
+        while len(self.entries) > self.maxSize:
+            self.entries.popitem(last=False)
+
+
+    def evict(self, guildId:int) -> None:
+        self.entries.pop(guildId, None)
+
+
+class OrderedRoleSet:
+
+    # An ordered set of role IDs, used in place of a plain list for a guild's role selection list. The IDs are kept in a
+    # packed array of 64 bit integers in our display order, 8 bytes per role, as most cached guilds are never clicked.
+    # The first membership check builds a set alongside it, so membership checks are O(1) for guilds that are in use.
+    # Adding is O(1), removing is O(n), which is fine for an admin command.
+
+
+    __slots__ = ("roleIds", "index")
+
+
+    def __init__(self, roleIds=()) -> None:
+        self.roleIds = array("Q", dict.fromkeys(int(roleId) for roleId in roleIds)) # dict.fromkeys drops duplicates, keeping their order.
+        self.index = None # Built on the first membership check.
+
+
+    def __contains__(self, roleId:int) -> bool:
+        if self.index is None:
+            self.index = set(self.roleIds)
+        return roleId in self.index
+
+
+    def __iter__(self):
+        return iter(self.roleIds)
+
+
+    def __len__(self) -> int:
+        return len(self.roleIds)
+
+
+    def add(self, roleId:int) -> None:
+        roleId = int(roleId)
+        if roleId not in self:
+            self.roleIds.append(roleId)
+            self.index.add(roleId)
+
+
+    def discard(self, roleId:int) -> None:
+        roleId = int(roleId)
+        if roleId in self:
+            self.roleIds.remove(roleId)
+            self.index.discard(roleId)
+
+
+class RoleMenu:
+
+    # A guild's role selection list, resolved to Role objects and pre-chunked into pages of selection list options.
+    # Components derived from a RoleMenu are kept on it, so they're dropped along with it once the menu is rebuilt.
+
+
+    __slots__ = ("source", "roles", "pages", "pageRoleIds", "missingRoleIds", "rows", "pageButtonRows", "nameIndex")
+
+
+    def __init__(self, source:list, roles:list, missingRoleIds:list, pageSize:int) -> None:
+        self.source = source # The role selection list this was built from.
+        self.roles = roles
+        # Each page is a list of (label, value, roleId) option templates, the label is the role name, the value is the role ID as a string.
+        self.pages = [[(role.name, str(role.id), role.id) for role in roles[index:index + pageSize]] for index in range(0, len(roles), pageSize)]
+        self.pageRoleIds = [frozenset(role.id for role in roles[index:index + pageSize]) for index in range(0, len(roles), pageSize)]
+        # Roles in the list that no longer exist in the guild, so the Extension can clean them up.
+        self.missingRoleIds = missingRoleIds
+        # Components built from a page with nothing pre-selected, filled in by the Extension the first time they're needed.
+        self.rows = [None] * len(self.pages)
+        self.pageButtonRows = {} # The same for our previous and next page buttons, by the group of pages they're shown with.
+        # A sorted list of (name, wordNumber, roleIndex) for searching role names, built on the first search.
+        self.nameIndex = None
+
+
+    def search(self, text:str, limit:int) -> list:
+        # Return up to limit roles whose name, or any word in it, starts with text (case insensitive). Roles whose name
+        # starts with it come first, then in menu order. A binary search finds the first match, so a search only costs
+        # as much as the roles it matches.
+        if self.nameIndex is None:
+            self.nameIndex = []
+            for roleIndex, role in enumerate(self.roles):
+                words = role.name.lower().split()
+                # Every word is indexed with the rest of the name, so "red" and "red t" both find "Team Red Team".
+                self.nameIndex.extend((" ".join(words[wordNumber:]), wordNumber, roleIndex) for wordNumber in range(len(words)))
+            self.nameIndex.sort()
+
+        text = " ".join(text.lower().split())
+        matches = {} # roleIndex: (0 if the name starts with text, otherwise 1, roleIndex)
+        index = bisect.bisect_left(self.nameIndex, (text,))
+        while index < len(self.nameIndex) and self.nameIndex[index][0].startswith(text):
+            name, wordNumber, roleIndex = self.nameIndex[index]
+            matches[roleIndex] = min(matches.get(roleIndex, (1, roleIndex)), (min(wordNumber, 1), roleIndex))
+            index += 1
+        return [self.roles[roleIndex] for isWordMatch, roleIndex in sorted(matches.values())[:limit]]
+
+
+class RoleMenuCache:
+
+    # A bounded LRU cache of RoleMenus, so that a click only has to overlay the member's current roles onto
+    # templates we've already built. Entries must be invalidated whenever the guild's role selection list changes,
+    # or a role in the guild is created, updated or deleted.
+
+
+    def __init__(self, maxSize:int, pageSize:int=25) -> None:
+        self.maxSize = maxSize
+        self.pageSize = pageSize # Discord allows 25 options per selection list.
+        self.entries = OrderedDict() # guildId: RoleMenu
+
+
+    def get(self, guild, publicList:OrderedRoleSet) -> RoleMenu:
+        roleMenu = self.entries.get(guild.id)
+        if roleMenu and roleMenu.source is publicList:
+            self.entries.move_to_end(guild.id)
+            Metrics.cacheLookup("roleMenu", True)
+            return roleMenu
+        Metrics.cacheLookup("roleMenu", False)
+        # If the guild's database was reloaded, its role selection list is a new list, so we rebuild from that.
+
+        roles = []
+        missingRoleIds = []
+        for roleId in publicList:
+            role = guild.get_role(roleId)
+            if role:
+                roles.append(role)
+            else:
+                missingRoleIds.append(roleId)
+
+        roleMenu = RoleMenu(publicList, roles, missingRoleIds, self.pageSize)
+        self.entries[guild.id] = roleMenu
+        while len(self.entries) > self.maxSize:
+            self.entries.popitem(last=False)
+        return roleMenu
+
+
+    def invalidate(self, guildId:int) -> None:
+        self.entries.pop(guildId, None)
+
+
+    def invalidateRole(self, guildId:int, roleId:int) -> None:
+        # Only invalidate the guild's menu if the role is actually in it.
+        roleMenu = self.entries.get(guildId)
+        if roleMenu and roleId in roleMenu.source:
+            del self.entries[guildId]
@@ -0,0 +1,75 @@
+"""
+Components
+~~~~~~~~~~
+
+Routes component interactions (buttons, selection lists) to the Extension that owns them.\n
+Every custom ID starts with a namespace, followed by a dash, e.g. "roleSelection-{guildId}-{number}". Extensions register
+handlers for their namespace with the client's ComponentRouter, rather than each listening to every component event.
+"""
+
+import Utils
+
+import interactions
+
+
+class ComponentRoute:
+
+    # The handlers registered for one namespace, by component type, and the parser for its custom IDs.
+
+
+    __slots__ = ("parser", "handlers")
+
+
+    def __init__(self, parser) -> None:
+        self.parser = parser
+        self.handlers = {} # ComponentType: handler
+
+
+class ComponentRouter:
+
+    # Our client owns one of these, and calls dispatch for every component event. Looking up the handler is a dict
+    # lookup on the namespace then the component type, so it doesn't matter how many Extensions are registered.
+
+
+    log = Utils.Log("ComponentRouter")
+
+
+    def __init__(self) -> None:
+        self.routes = {} # namespace: ComponentRoute
+
+
+    def register(self, namespace:str, componentType:interactions.ComponentType, handler, parser=None) -> None:
+        # Handlers are coroutine functions taking (event, componentId), where componentId is whatever the parser returned
+        # for the custom ID. The parser takes the custom ID and returns None if it isn't valid, in which case the
+        # interaction is ignored. Without a parser, the handler is given the custom ID as-is.
+        route = self.routes.setdefault(namespace, ComponentRoute(parser))
+        if parser is not None:
+            route.parser = parser
+        route.handlers[componentType] = handler
+
+
+    def unregister(self, namespace:str) -> None:
+        # Usually called when the Extension that registered the namespace is dropped.
+        self.routes.pop(namespace, None)
+
+
+    async def dispatch(self, event:interactions.api.events.Component) -> None:
+        customId = event.ctx.custom_id
+        route = self.routes.get(customId.split("-", 1)[0])
+        if route is None:
+            # Nobody has registered this namespace, so it isn't ours to handle.
+            return
+
+        handler = route.handlers.get(event.ctx.component_type)
+        if handler is None:
+            self.log.print(f"Ignoring interaction from component with no handler for its type: {customId}")
+            return
+
+        componentId = customId
+        if route.parser is not None:
+            componentId = route.parser(customId)
+            if componentId is None:
+                self.log.print(f"Ignoring interaction from component with an invalid custom ID: {customId}")
+                return
+
+        await handler(event, componentId)
@@ -0,0 +1,158 @@
+"""
+Launcher
+~~~~~~~~
+
+Runs the bot as several processes, each connecting to its own group of shards, and restarts any process that stops.\n
+A crash then only takes down (and reconnects) the guilds in that one group, and the bot can use more than one core.\n
+Set shardCount (0 for Discord's recommendation) and shardsPerProcess in Config.json.\n
+Usage: python Launcher.py (or ./start.sh on Linux)
+"""
+
+import BotGlobals as config
+import Utils
+
+import json
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+
+
+log = Utils.Log("Launcher")
+
+MAIN_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Main.py")
+
+IDENTIFY_INTERVAL = 5.1 # Discord only lets us identify max_concurrency shards every 5 seconds.
+STABLE_UPTIME = 60 # A process that has run for this long before stopping is restarted straight away.
+MAX_RESTART_DELAY = 60
+STOP_TIMEOUT = 30 # How long a process gets to save and disconnect before we kill it.
+
+
+class ShardGroup:
+
+    # One of our bot processes, and the shards it runs.
+
+
+    def __init__(self, shardIds:range, totalShards:int) -> None:
+        self.shardIds = shardIds
+        self.totalShards = totalShards
+        self.process = None
+        self.startedAt = 0.0
+        self.failures = 0 # Quick failures in a row, which we back off from.
+        self.restartAt = None
+
+
+    @property
+    def name(self) -> str:
+        if len(self.shardIds) == 1:
+            return f"shard {self.shardIds[0]}"
+        return f"shards {self.shardIds[0]}-{self.shardIds[-1]}"
+
+
+    def start(self) -> None:
+        arguments = [sys.executable, MAIN_FILE]
+        if self.totalShards > 1:
+            arguments += ["--shard-ids", f"{self.shardIds[0]}-{self.shardIds[-1]}", "--total-shards", str(self.totalShards)]
+        self.process = subprocess.Popen(arguments)
+        self.startedAt = time.monotonic()
+        self.restartAt = None
+        log.print(f"Started {self.name} (pid {self.process.pid}).")
+
+
+    def checkStopped(self) -> bool:
+        # Schedule a restart if our process has stopped. Returns True when it's time to start it again.
+        if self.restartAt is None:
+            if self.process.poll() is None:
+                return False
+            if time.monotonic() - self.startedAt >= STABLE_UPTIME:
+                self.failures = 0
+            delay = min(MAX_RESTART_DELAY, 2 ** self.failures) if self.failures else 0
+            self.failures += 1
+            self.restartAt = time.monotonic() + delay
+            log.warning(f"{self.name} stopped with exit code {self.process.returncode}, restarting in {delay} seconds.")
+        return time.monotonic() >= self.restartAt
+
+
+    def stop(self) -> None:
+        # Ask the bot to stop the same way Ctrl+C would, so it saves anything it's holding before disconnecting.
+        if self.process and self.process.poll() is None:
+            self.process.send_signal(signal.SIGINT)
+
+
+    def wait(self, timeout:float) -> None:
+        if not self.process:
+            return
+        try:
+            self.process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            log.warning(f"{self.name} didn't stop in time, killing it.")
+            self.process.kill()
+            self.process.wait()
+
+
+def getGatewayInfo() -> dict:
+
+    # Ask Discord how many shards it recommends for us, and how many can identify at once.
+
+    request = urllib.request.Request("https://discord.com/api/v10/gateway/bot", headers={"Authorization": f"Bot {config.token}",
+                                                                                       "User-Agent": "DiscordBot (role-provider, 1.0)"})
+    with urllib.request.urlopen(request, timeout=30) as response:
+        return json.load(response)
+
+
+def createShardGroups(totalShards:int, shardsPerProcess:int) -> list[ShardGroup]:
+    return [ShardGroup(range(first, min(first + shardsPerProcess, totalShards)), totalShards)
+            for first in range(0, totalShards, max(1, shardsPerProcess))]
+
+
+def main() -> int:
+    Utils.configureLogging(config.logLevel, config.logJson, None, config.logMaxBytes, config.logBackupCount, config.logSampling)
+
+    totalShards = config.shardCount
+    maxConcurrency = 1
+    if totalShards == 0:
+        # Every process must agree on the shard count, so we fetch it once here rather than letting each one decide.
+        try:
+            gatewayInfo = getGatewayInfo()
+        except Exception:
+            log.exception("Could not get the recommended shard count from Discord. Please check the configured token.")
+            return 1
+        totalShards = gatewayInfo["shards"]
+        maxConcurrency = gatewayInfo["session_start_limit"]["max_concurrency"]
+        log.print(f"Discord recommends {totalShards} shards.")
+
+    groups = createShardGroups(totalShards, config.shardsPerProcess)
+    log.print(f"Running {totalShards} shards in {len(groups)} processes.")
+
+    stopping = threading.Event()
+    def requestStop(signalNumber, frame) -> None:
+        stopping.set()
+    signal.signal(signal.SIGINT, requestStop)
+    signal.signal(signal.SIGTERM, requestStop)
+
+    # Each process identifies its shards one after another, so we wait for a group to have had time to identify before
+    # starting the next, rather than having them all compete for the same identify limit.
+    for index, group in enumerate(groups):
+        if index and stopping.wait(len(groups[index - 1].shardIds) * IDENTIFY_INTERVAL / maxConcurrency):
+            break
+        group.start()
+
+    while not stopping.wait(1):
+        for group in groups:
+            if group.process and group.checkStopped():
+                group.start()
+
+    log.print("Stopping.")
+    for group in groups:
+        group.stop()
+    deadline = time.monotonic() + STOP_TIMEOUT
+    for group in groups:
+        group.wait(max(0, deadline - time.monotonic()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
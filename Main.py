@@ -9,12 +9,19 @@ We create a Client instance here, as this is the main program file.
 """
 
 import BotGlobals as config
+import Components
+import Metrics
 import Utils
 
 import interactions
 
+import argparse
+import asyncio
 import os
-import traceback
+
+
+# Found from this file rather than the working directory, so the bot can be started from anywhere.
+EXTENSIONS_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "extensions")
 
 
 class RPBotClient(interactions.Client):
@@ -25,12 +32,15 @@ class RPBotClient(interactions.Client):
     log = Utils.Log("RPBotClient") # Initialising our Log instance, just to make the console more readable.
 
 
-    def __init__(self, command_prefix=None, intents=None) -> None:
+    def __init__(self, command_prefix=None, intents=None, **kwargs) -> None:
 
         # Not much yet, just log that we're starting up, and pass the arguments to our super class.
 
         self.log.print("Starting...")
-        super().__init__(command_prefix=command_prefix, intents=intents, application_id=config.userId)
+        super().__init__(command_prefix=command_prefix, intents=intents, application_id=config.userId, **kwargs)
+
+        # Extensions register handlers for their components with this, see Components.ComponentRouter.
+        self.componentRouter = Components.ComponentRouter()
 
 
     @interactions.listen()
@@ -43,24 +53,50 @@ class RPBotClient(interactions.Client):
         # We're setting up still, so we'll let users know in our Activity that we're unavailable.
         await self.change_presence(activity=interactions.Activity(name="Starting"), status=interactions.Status.DND)
         
-        if not config.useMongoDb:
-            self.log.print("WARNING: It's highly recommended to use MongoDB over YAML in a production environment.")
+        if not config.useMongoDb and config.storageBackend != "sqlite":
+            self.log.warning("It's highly recommended to use MongoDB or SQLite over YAML in a production environment.")
         
         self.log.print("Loading Extensions.")
         # Now, we load our Extensions, this checks the extentions folder and loads any python files as extensions.
         # This bot isn't multi-purpose, so there's only the RoleSelection and Management extensions, but this would
         # add anything you put into the folder, so the bot is easily expandable.
-        for file in os.listdir(f"./extensions"):
+        for file in os.listdir(EXTENSIONS_DIRECTORY):
             if file.endswith(".py"):
                 try:
                     self.load_extension(f"extensions.{file[:-3]}")
                 except interactions.client.errors.ExtensionLoadException:
                     # We'll just silently fail here for this specific Extension, and output the traceback to the console.
-                    self.log.print(f"ERROR: Extension {file[:-3]} could not be loaded.")
-                    print(traceback.format_exc())
+                    self.log.exception(f"Extension {file[:-3]} could not be loaded.")
 
         self.log.print("Finished loading Extensions.")
 
+        # Extensions with slower setup to do (reading their snapshot, for example) do it in a startup coroutine, which
+        # we run for every Extension at the same time rather than one after another.
+        await asyncio.gather(*[self.startExtension(extension) for extension in list(self.ext.values()) if hasattr(extension, "startup")])
+
+        if config.metricsPort:
+            # Optionally serve our metrics locally for Prometheus to scrape. When the launcher runs us as one of several
+            # processes, each one serves on its own port, offset by its first shard ID.
+            shardIds = getattr(self, "shard_ids", None) or [0]
+            self.metricsExporter = Metrics.PrometheusExporter(config.metricsHost, config.metricsPort + shardIds[0])
+            await self.metricsExporter.start()
+
+
+    async def startExtension(self, extension:interactions.Extension) -> None:
+        try:
+            await extension.startup()
+        except:
+            # As with loading, one Extension failing to start shouldn't stop the others.
+            self.log.exception(f"Extension {extension.extension_name} could not be started.")
+
+
+    @interactions.listen(interactions.api.events.Component)
+    async def on_component(self, event: interactions.api.events.Component) -> None:
+
+        # Every component interaction goes through our router, which passes it to the Extension that owns it.
+
+        await self.componentRouter.dispatch(event)
+
 
     @interactions.listen()
     async def on_ready(self) -> None:
@@ -73,11 +109,73 @@ class RPBotClient(interactions.Client):
         await self.change_presence(activity=interactions.Activity(name=config.version), status=interactions.Status.ONLINE)
 
 
+    async def stop(self) -> None:
+
+        # Give our Extensions a chance to finish up (saving any queued database changes, for example) before we
+        # disconnect. The launcher stops us this way whenever it restarts us, so nothing should be lost.
+
+        for extension in list(self.ext.values()):
+            if hasattr(extension, "shutdown"):
+                try:
+                    await extension.shutdown()
+                except:
+                    self.log.exception(f"Extension {extension.extension_name} could not be shut down cleanly.")
+        await super().stop()
+
+
+class RPShardedBotClient(RPBotClient, interactions.AutoShardedClient):
+
+    # The same client, split into shards. Without total_shards, Discord's recommended shard count is used, and without
+    # shard_ids, we run every shard in this process. The launcher (see Launcher.py) passes both, so that each of its
+    # processes only connects to its own group of shards, and so only ever sees and loads its own guilds.
+
+    pass
+
+
+def parseShardIds(shardIds:str) -> list[int]:
+
+    # Shard IDs are given as a comma separated list of IDs and ranges, e.g. "0-3" or "0,2,5-7".
+
+    parsedIds = []
+    for part in shardIds.split(","):
+        first, _, last = part.strip().partition("-")
+        parsedIds.extend(range(int(first), int(last or first) + 1))
+    return parsedIds
+
+
+def createClient(shardIds:list[int]=None, totalShards:int=None) -> RPBotClient:
+
+    # A shardCount of 1 in our config (the default) runs a single unsharded client, 0 runs every shard Discord
+    # recommends, and anything else runs that many shards. The launcher overrides these with our command line.
+
+    if shardIds is None and totalShards is None and config.shardCount == 1:
+        return RPBotClient(command_prefix=config.commandPrefix, intents=interactions.Intents.DEFAULT)
+
+    shardingArguments = {}
+    totalShards = totalShards or config.shardCount
+    if totalShards:
+        shardingArguments["total_shards"] = totalShards
+    if shardIds is not None:
+        shardingArguments["shard_ids"] = shardIds
+    return RPShardedBotClient(command_prefix=config.commandPrefix, intents=interactions.Intents.DEFAULT, **shardingArguments)
+
+
 if __name__ == "__main__":
-    # Check if this file is being run directly (not imported), then create our Client instance!
-    roleSelectionBot = RPBotClient(command_prefix=config.commandPrefix, intents=interactions.Intents.DEFAULT)
+    # Check if this file is being run directly (not imported), then set up our logging and create our Client instance!
+    parser = argparse.ArgumentParser(description="Run the bot, or just some of its shards.")
+    parser.add_argument("--shard-ids", help="the shards to run in this process, e.g. 0-3 (requires --total-shards)")
+    parser.add_argument("--total-shards", type=int, help="the total number of shards across every process")
+    arguments = parser.parse_args()
+    if arguments.shard_ids and not arguments.total_shards:
+        parser.error("--shard-ids requires --total-shards")
+
+    shardIds = parseShardIds(arguments.shard_ids) if arguments.shard_ids else None
+    # Log rotation doesn't work with several processes writing to one file, so each process gets its own.
+    logFile = Utils.getShardedPath(config.logFile, shardIds) if config.logFile else None
+    Utils.configureLogging(config.logLevel, config.logJson, logFile, config.logMaxBytes, config.logBackupCount, config.logSampling)
+    roleSelectionBot = createClient(shardIds, arguments.total_shards)
     try:
         roleSelectionBot.start(config.token)
     except interactions.client.errors.LoginError:
         # Usually this should only happen if the bot hasn't been configured yet.
-        print(f"There was an issue when using the configured token to log in. Please ensure the bot is properly configured.\n\nAttempted token: {config.token}")
\ No newline at end of file
+        RPBotClient.log.error(f"There was an issue when using the configured token to log in. Please ensure the bot is properly configured.\n\nAttempted token: {config.token}")
\ No newline at end of file
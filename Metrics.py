@@ -0,0 +1,223 @@
+"""
+Metrics
+~~~~~~~
+
+In-process metrics: counters, gauges and latency histograms, shown by the /stats command (see the Management Extension)
+and optionally served in the Prometheus text format on a local HTTP port.
+"""
+
+import Utils
+
+import asyncio
+from bisect import bisect_left
+import functools
+import time
+
+
+# Histogram bucket upper bounds, in seconds.
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float("inf"))
+
+
+class Histogram:
+
+    # Counts observations into fixed buckets, so memory use is constant no matter how many we record. Quantiles are
+    # estimated by interpolating within the bucket they fall in, the same way Prometheus does.
+
+
+    __slots__ = ("counts", "total", "count")
+
+
+    def __init__(self) -> None:
+        self.counts = [0] * len(BUCKETS)
+        self.total = 0.0
+        self.count = 0
+
+
+    def observe(self, value:float) -> None:
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.total += value
+        self.count += 1
+
+
+    def quantile(self, q:float) -> float:
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for index, bucketCount in enumerate(self.counts):
+            if cumulative + bucketCount >= rank and bucketCount > 0:
+                lower = BUCKETS[index - 1] if index > 0 else 0.0
+                upper = BUCKETS[index]
+                if upper == float("inf"):
+                    # We can't interpolate into the last bucket, so the best we can say is it's above the one before.
+                    return lower
+                return lower + (upper - lower) * (rank - cumulative) / bucketCount
+            cumulative += bucketCount
+        return BUCKETS[-2]
+
+
+class Registry:
+
+    # Every metric is identified by its name and its labels, e.g. ("handler_seconds", (("handler", "button"),)).
+
+
+    def __init__(self) -> None:
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+
+    def getKey(self, name:str, labels:dict) -> tuple:
+        return (name, tuple(sorted(labels.items())))
+
+
+    def increment(self, name:str, amount:int=1, **labels) -> None:
+        key = self.getKey(name, labels)
+        self.counters[key] = self.counters.get(key, 0) + amount
+
+
+    def setGauge(self, name:str, value:float, **labels) -> None:
+        self.gauges[self.getKey(name, labels)] = value
+
+
+    def observe(self, name:str, value:float, **labels) -> None:
+        key = self.getKey(name, labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.observe(value)
+
+
+    def getCounter(self, name:str, **labels) -> int:
+        return self.counters.get(self.getKey(name, labels), 0)
+
+
+    def getCounters(self, name:str) -> list:
+        # [(labels dict, value)] for every counter with this name.
+        return [(dict(labels), value) for (counterName, labels), value in sorted(self.counters.items()) if counterName == name]
+
+
+    def getHistograms(self, name:str) -> list:
+        # [(labels dict, Histogram)] for every histogram with this name.
+        return [(dict(labels), histogram) for (histogramName, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0]) if histogramName == name]
+
+
+    def formatLabels(self, labels:tuple, extra:str="") -> str:
+        parts = [f"{key}=\"{value}\"" for key, value in labels]
+        if extra:
+            parts.append(extra)
+        return "{" + ",".join(parts) + "}" if parts else ""
+
+
+    def toPrometheus(self) -> str:
+        # Render every metric in the Prometheus text exposition format.
+        lines = []
+        for (name, labels), value in sorted(self.counters.items()):
+            lines.append(f"rp_{name}{self.formatLabels(labels)} {value}")
+        for (name, labels), value in sorted(self.gauges.items()):
+            lines.append(f"rp_{name}{self.formatLabels(labels)} {value}")
+        for (name, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0]):
+            cumulative = 0
+            for bound, bucketCount in zip(BUCKETS, histogram.counts):
+                cumulative += bucketCount
+                upper = "+Inf" if bound == float("inf") else repr(bound)
+                bucketLabels = self.formatLabels(labels, "le=\"" + upper + "\"")
+                lines.append(f"rp_{name}_bucket{bucketLabels} {cumulative}")
+            lines.append(f"rp_{name}_sum{self.formatLabels(labels)} {histogram.total}")
+            lines.append(f"rp_{name}_count{self.formatLabels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry() # The registry used by the whole bot.
+
+
+def increment(name:str, amount:int=1, **labels) -> None:
+    registry.increment(name, amount, **labels)
+
+
+def setGauge(name:str, value:float, **labels) -> None:
+    registry.setGauge(name, value, **labels)
+
+
+def observe(name:str, value:float, **labels) -> None:
+    registry.observe(name, value, **labels)
+
+
+def cacheLookup(cache:str, hit:bool) -> None:
+    registry.increment("cache_hits_total" if hit else "cache_misses_total", cache=cache)
+
+
+class timer:
+
+    # Times the block it wraps into a histogram, e.g. "with Metrics.timer("storage_seconds", operation="load"):"
+    # If the block raises, an errors_total counter with the same labels is incremented too.
+
+
+    def __init__(self, name:str, **labels) -> None:
+        self.name = name
+        self.labels = labels
+
+
+    def __enter__(self) -> "timer":
+        self.startedAt = time.perf_counter()
+        return self
+
+
+    def __exit__(self, exceptionType, exception, traceback) -> None:
+        registry.observe(self.name, time.perf_counter() - self.startedAt, **self.labels)
+        if exceptionType is not None and not issubclass(exceptionType, asyncio.CancelledError):
+            registry.increment("errors_total", **self.labels)
+
+
+def timed(name:str, **labels):
+
+    # Decorator version of timer for coroutine functions. Put it below any interactions decorators.
+
+    def decorator(function):
+        @functools.wraps(function)
+        async def wrapper(*args, **kwargs):
+            with timer(name, **labels):
+                return await function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class PrometheusExporter:
+
+    # A tiny HTTP server that answers every request with our metrics in the Prometheus text format. It's meant to be
+    # bound to localhost and scraped by a local Prometheus agent, so it doesn't bother with routing or keep-alive.
+
+
+    log = Utils.Log("PrometheusExporter")
+
+
+    def __init__(self, host:str, port:int) -> None:
+        self.host = host
+        self.port = port
+        self.server = None
+
+
+    async def handleRequest(self, reader:asyncio.StreamReader, writer:asyncio.StreamWriter) -> None:
+        try:
+            # Read and discard the request headers, we serve the same thing whatever was asked for.
+            while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b"\r\n", b"\n", b""):
+                pass
+            body = registry.toPrometheus().encode()
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                         + f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+    async def start(self) -> None:
+        self.server = await asyncio.start_server(self.handleRequest, self.host, self.port)
+        self.log.print(f"Serving metrics on http://{self.host}:{self.port}/metrics")
+
+
+    async def stop(self) -> None:
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
@@ -0,0 +1,79 @@
+"""
+Migrate
+~~~~~~~
+
+Command line tool for converting guild databases between storage formats. Run this with the bot stopped.\n
+Usage: python Migrate.py mongo-consolidate | yaml-to-sqlite
+"""
+
+import BotGlobals as config
+import Storage
+import Utils
+
+import argparse
+import asyncio
+
+
+log = Utils.Log("Migrate")
+
+
+async def consolidateMongo(batchSize:int) -> None:
+
+    # Copy every per-guild Mongo database (one database per guild, one collection per section) into the consolidated
+    # schema (one document per guild). The per-guild databases are left untouched, so they can be removed by hand once
+    # the bot has been checked with mongoSchema set to "consolidated".
+
+    source = Storage.MongoStorage(config.mongoServerString)
+    destination = Storage.ConsolidatedMongoStorage(config.mongoServerString, config.mongoDatabaseName)
+    try:
+        guildIds = await source.listGuildIds()
+        log.print(f"Found {len(guildIds)} guild databases to migrate.")
+
+        for index in range(0, len(guildIds), batchSize):
+            # Load a batch of guilds, then write them all in one bulk write.
+            guildId2Db = await source.loadGuilds(guildIds[index:index + batchSize])
+            await destination.saveGuilds(guildId2Db)
+            log.print(f"Migrated {min(index + batchSize, len(guildIds))} of {len(guildIds)} guilds.")
+
+        log.print("Finished. Set \"mongoSchema\" to \"consolidated\" in Config.json to use the migrated databases.")
+    finally:
+        await source.close()
+        await destination.close()
+
+
+async def yamlToSqlite(batchSize:int) -> None:
+
+    # Copy every YAML guild database in ./databases into our SQLite database. The YAML files are left untouched, so they
+    # can be removed by hand once the bot has been checked with storageBackend set to "sqlite".
+
+    source = Storage.YamlStorage(workers=config.storageWorkers)
+    destination = Storage.SqliteStorage(config.sqlitePath, workers=config.storageWorkers)
+    try:
+        guildIds = await source.listGuildIds()
+        log.print(f"Found {len(guildIds)} guild databases to migrate.")
+
+        for index in range(0, len(guildIds), batchSize):
+            # Load a batch of guilds, then write them all in one transaction.
+            guildId2Db = await source.loadGuilds(guildIds[index:index + batchSize])
+            await destination.saveGuilds(guildId2Db)
+            log.print(f"Migrated {min(index + batchSize, len(guildIds))} of {len(guildIds)} guilds.")
+
+        log.print("Finished. Set \"storageBackend\" to \"sqlite\" in Config.json to use the migrated databases.")
+    finally:
+        await source.close()
+        await destination.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert Role Provider guild databases between storage formats.")
+    parser.add_argument("command", choices=["mongo-consolidate", "yaml-to-sqlite"],
+                        help="mongo-consolidate: copy per-guild Mongo databases into the consolidated schema. "
+                             "yaml-to-sqlite: copy YAML guild databases into the SQLite database.")
+    parser.add_argument("--batch-size", type=int, default=500, help="How many guilds to load and write at a time.")
+    arguments = parser.parse_args()
+    Utils.configureLogging(config.logLevel, config.logJson, config.logFile, config.logMaxBytes, config.logBackupCount, config.logSampling)
+
+    if arguments.command == "mongo-consolidate":
+        asyncio.run(consolidateMongo(arguments.batch_size))
+    elif arguments.command == "yaml-to-sqlite":
+        asyncio.run(yamlToSqlite(arguments.batch_size))
@@ -0,0 +1,246 @@
+"""
+Scheduler
+~~~~~~~~~
+
+Queues and paces member role changes per guild, so a burst of role selections (after an announcement, for example)
+runs at the rate Discord allows rather than racing each other into rate limits.
+"""
+
+import Metrics
+import Utils
+
+import asyncio
+from collections import OrderedDict
+import time
+
+
+class SchedulerClosedError(Exception):
+
+    # Set on every change that was queued or running when the scheduler was closed, so its submitter knows it wasn't applied.
+
+
+    def __init__(self) -> None:
+        super().__init__("The role mutation scheduler was closed before this change could be applied.")
+
+
+class TokenBucket:
+
+    # Paces requests to a rate of tokens per second, allowing short bursts of up to capacity requests. The rate and
+    # capacity are tuned from the rate limit headers Discord sends back with each request.
+
+
+    def __init__(self, rate:float, capacity:int) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updatedAt = time.monotonic()
+        self.pausedUntil = 0.0
+
+
+    def refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updatedAt) * self.rate)
+        self.updatedAt = now
+
+
+    async def acquire(self) -> None:
+        # Wait until we're allowed to make another request, then take a token for it.
+        while True:
+            now = time.monotonic()
+            if now < self.pausedUntil:
+                await asyncio.sleep(self.pausedUntil - now)
+                continue
+            self.refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+    def observe(self, limit:int, remaining:int, resetAfter:float) -> None:
+        # Discord told us how many requests we have left before the bucket resets. We pace ourselves to spread those
+        # remaining requests evenly until the reset, and stop completely if there are none left.
+        self.refill()
+        self.capacity = max(limit, 1)
+        if remaining <= 0:
+            self.pause(resetAfter)
+        else:
+            self.tokens = min(self.tokens, remaining)
+            if resetAfter > 0:
+                self.rate = remaining / resetAfter
+
+
+    def pause(self, seconds:float) -> None:
+        # We've been rate limited (or are about to be), so make no more requests until it's lifted.
+        self.tokens = 0.0
+        self.pausedUntil = max(self.pausedUntil, time.monotonic() + seconds)
+
+
+class RoleMutation:
+
+    # A queued role change for a single member. The apply coroutine function works out and applies the change when it's
+    # run. It only adds and removes the roles being changed (see RoleSelection.applyRoleChanges), so any roles the member
+    # was given or lost while it was queued are left alone.
+
+    # apply is called with a pace coroutine function, which it awaits with the route of each request before making it,
+    # so a change costs one token per request and we follow the rate limits of the routes it actually uses.
+
+
+    __slots__ = ("apply", "future")
+
+
+    def __init__(self, apply, future:asyncio.Future) -> None:
+        self.apply = apply
+        self.future = future
+
+
+class RequestPacer:
+
+    # Paces the requests of a single RoleMutation. Its worker takes a token before starting the change, which pays for
+    # the first request, and every request after that takes one more. Before each request, we tune the bucket from the
+    # rate limit of the one before it, as its headers have arrived by then.
+
+
+    __slots__ = ("scheduler", "bucket", "requests", "lastRoute")
+
+
+    def __init__(self, scheduler:"RoleMutationScheduler", bucket:TokenBucket) -> None:
+        self.scheduler = scheduler
+        self.bucket = bucket
+        self.requests = 0
+        self.lastRoute = None
+
+
+    async def pace(self, route) -> None:
+        self.observe()
+        if self.requests:
+            await self.bucket.acquire()
+        self.requests += 1
+        self.lastRoute = route
+
+
+    def observe(self) -> None:
+        self.scheduler.observeRateLimit(self.lastRoute, self.bucket)
+
+
+class RoleMutationScheduler:
+
+    # Keeps a queue of role changes for every guild, each worked through in order by its own worker, paced by its own
+    # TokenBucket (Discord's member edit rate limits are per guild).
+
+    # Each member can only have one change waiting per guild. If they select again before it runs, the newer selection
+    # replaces it (the last selection wins), and the replaced one resolves as superseded.
+
+
+    log = Utils.Log("RoleMutationScheduler")
+
+    SUPERSEDED = object() # The result of a mutation that was replaced before it could run.
+
+
+    def __init__(self, rate:float, burst:int, rateLimitObserver=None) -> None:
+        # rateLimitObserver is an optional function taking a route passed to pace and returning (limit, remaining, resetAfter)
+        # from the latest rate limit headers for that route, or None if we haven't seen any yet.
+        self.rate = rate
+        self.burst = burst
+        self.rateLimitObserver = rateLimitObserver
+        self.queues = {} # guildId: OrderedDict of memberId: RoleMutation
+        self.buckets = {} # guildId: TokenBucket
+        self.workers = {} # guildId: Task
+        self.queued = 0 # How many changes are waiting across every guild.
+
+
+    def queueDepth(self, guildId:int=None) -> int:
+        # How many role changes are waiting, for one guild or across every guild.
+        if guildId is not None:
+            return len(self.queues.get(guildId, ()))
+        return self.queued
+
+
+    def queueDepths(self) -> dict:
+        return {guildId: len(queue) for guildId, queue in self.queues.items() if queue}
+
+
+    async def submit(self, guildId:int, memberId:int, apply):
+        # Queue a role change and wait for it to run, returning the result of apply, or SUPERSEDED if it was replaced.
+        # See RoleMutation for how apply is called.
+        queue = self.queues.setdefault(guildId, OrderedDict())
+        previous = queue.pop(memberId, None)
+        if previous:
+            previous.future.set_result(self.SUPERSEDED)
+
+        future = asyncio.get_running_loop().create_future()
+        queue[memberId] = RoleMutation(apply, future)
+        self.queued += 0 if previous else 1
+        Metrics.setGauge("role_mutation_queue_depth", self.queued)
+
+        if guildId not in self.workers or self.workers[guildId].done():
+            self.workers[guildId] = asyncio.create_task(self.runQueue(guildId))
+
+        return await future
+
+
+    async def runQueue(self, guildId:int) -> None:
+        queue = self.queues[guildId]
+        bucket = self.buckets.setdefault(guildId, TokenBucket(self.rate, self.burst))
+        try:
+            while queue:
+                await bucket.acquire()
+                if not queue:
+                    # Everything left was superseded or cancelled while we waited.
+                    break
+                memberId, mutation = queue.popitem(last=False)
+                self.queued -= 1
+                Metrics.setGauge("role_mutation_queue_depth", self.queued)
+                pacer = RequestPacer(self, bucket)
+                try:
+                    result = await mutation.apply(pacer.pace)
+                    if not mutation.future.done():
+                        mutation.future.set_result(result)
+                except asyncio.CancelledError:
+                    # We're being closed while this change runs, so its submitter isn't left waiting forever.
+                    if not mutation.future.done():
+                        mutation.future.set_exception(SchedulerClosedError())
+                    raise
+                except Exception as exception:
+                    if getattr(exception, "status", None) == 429:
+                        # We hit a rate limit anyway, so back off before trying anything else.
+                        Metrics.increment("rate_limited_total", operation="roleMutation")
+                        bucket.pause(1.0)
+                    if not mutation.future.done():
+                        mutation.future.set_exception(exception)
+                pacer.observe()
+        finally:
+            # Tidy up so idle guilds don't hold on to anything, unless more was queued after our last check.
+            # We keep the bucket of a guild that's still rate limited, so the next change still waits for it.
+            if not queue:
+                self.queues.pop(guildId, None)
+                self.workers.pop(guildId, None)
+                if bucket.pausedUntil <= time.monotonic():
+                    self.buckets.pop(guildId, None)
+
+
+    def observeRateLimit(self, route, bucket:TokenBucket) -> None:
+        if self.rateLimitObserver is None or route is None:
+            return
+        rateLimit = self.rateLimitObserver(route)
+        if rateLimit is not None:
+            bucket.observe(*rateLimit)
+
+
+    async def close(self) -> None:
+        # Stop every worker, and fail anything still waiting with SchedulerClosedError so nobody waits forever. A change
+        # that's running when its worker is stopped is failed by the worker, see runQueue.
+        workers = list(self.workers.values())
+        for worker in workers:
+            worker.cancel()
+        if workers:
+            await asyncio.wait(workers)
+        for queue in self.queues.values():
+            for mutation in queue.values():
+                if not mutation.future.done():
+                    mutation.future.set_exception(SchedulerClosedError())
+        self.queues.clear()
+        self.buckets.clear()
+        self.workers.clear()
+        self.queued = 0
+        Metrics.setGauge("role_mutation_queue_depth", 0)
@@ -0,0 +1,1073 @@
+"""
+Storage
+~~~~~~~
+
+Storage backends for our guild databases. Every backend exposes the same async interface, so the Extensions
+can await their database calls without ever blocking the event loop (and every other guild's interactions).
+"""
+
+import BotGlobals as config
+import Caching
+import Metrics
+import Utils
+
+from array import array
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import os
+import struct
+import tempfile
+import threading
+import time
+
+
+# The sections of a guild's database that can be saved independently, and where they live in the database dict.
+ROLE_SELECTION_LIST = "RoleSelectionList"
+ROLES_CHANNEL = "RolesChannel"
+SECTION_PATHS = {ROLE_SELECTION_LIST: ("Roles", "RoleSelectionList", "PublicList"),
+                 ROLES_CHANNEL: ("Channels", "RolesChannel", "ChannelID")}
+
+# Every guild's database carries a version, which every save bumps. A save made from an out of date copy (another
+# instance or an admin script saved the guild since we loaded it) is rejected with a StaleWriteError instead of
+# overwriting their changes.
+VERSION_PATH = ("Meta", "Config", "Version")
+
+# Our guild snapshot format, see writeSnapshot. Everything is little endian.
+SNAPSHOT_MAGIC = b"RPGS"
+SNAPSHOT_VERSION = 2
+SNAPSHOT_HEADER = struct.Struct("<4sII") # magic, format version, guild count
+SNAPSHOT_GUILD = struct.Struct("<QIQI") # guild ID, guild version, roles channel ID, role count, followed by that many 8 byte role IDs
+
+
+class StaleWriteError(Exception):
+
+    # Raised by saveSections when the guild has been saved by someone else since the version we're saving over.
+
+
+    def __init__(self, guildId:int, version:int) -> None:
+        super().__init__(f"Guild {guildId} has been changed since version {version}.")
+        self.guildId = guildId
+        self.version = version
+
+
+class StorageUnavailableError(Exception):
+
+    # Raised by CircuitBreakerStorage when its backend can't be reached, and straight away, without touching the database,
+    # while its circuit is open.
+
+
+    def __init__(self, retryAfter:float) -> None:
+        super().__init__(f"Storage is unavailable, retrying in {retryAfter:.0f} seconds.")
+        self.retryAfter = retryAfter
+
+
+def toStorageFormat(guildDb) -> dict:
+    # Return a copy of a guild's database (a GuildConfig or a dict) in the format we store it in. We must represent any
+    # Discord snowflakes as a string for compatability with a YAML database where needed. The copy is also safe to hand
+    # to another thread while the original keeps changing.
+    if isinstance(guildDb, GuildConfig):
+        return guildDb.toStorageFormat()
+    storedDb = {collectionName: {documentId: dict(document) for documentId, document in collection.items()}
+                for collectionName, collection in guildDb.items()}
+    roleSelectionList = storedDb.get("Roles", {}).get("RoleSelectionList")
+    if roleSelectionList and "PublicList" in roleSelectionList:
+        roleSelectionList["PublicList"] = [str(roleId) for roleId in roleSelectionList["PublicList"]]
+    return storedDb
+
+
+def getVersion(guildDb) -> int:
+    # Guilds that have never been saved (or were saved before we had versions) are version 0.
+    if isinstance(guildDb, GuildConfig):
+        return guildDb.version
+    return guildDb.get("Meta", {}).get("Config", {}).get("Version", 0)
+
+
+def getSectionValues(guildDb, sections=SECTION_PATHS) -> dict:
+    # Copy the given sections out of a guild's database as plain integers, {section: channel ID or tuple of role IDs}.
+    # Sections the guild doesn't have are left out. Works on both our storage format and a GuildConfig.
+    if isinstance(guildDb, GuildConfig):
+        return guildDb.getSectionValues(sections)
+    values = {}
+    for section in sections:
+        value = guildDb
+        for key in SECTION_PATHS[section]:
+            value = value.get(key) if isinstance(value, dict) else None
+        if value is not None:
+            values[section] = int(value) if section == ROLES_CHANNEL else tuple(int(roleId) for roleId in value)
+    return values
+
+
+def mergeSections(synced:dict, ours:dict, theirs:dict) -> dict:
+
+    # A three way merge of section values (see getSectionValues), for when someone else saved a guild after we loaded it.
+    # synced is the version we both started from, ours has our changes and theirs is what's stored now. Every change
+    # either side made is kept, and if we both changed the roles channel, ours wins.
+
+    merged = dict(theirs)
+    if ROLES_CHANNEL in ours and ours[ROLES_CHANNEL] != synced.get(ROLES_CHANNEL):
+        merged[ROLES_CHANNEL] = ours[ROLES_CHANNEL]
+
+    if ROLE_SELECTION_LIST in ours:
+        syncedRoles = synced.get(ROLE_SELECTION_LIST, ())
+        ourRoles = ours[ROLE_SELECTION_LIST]
+        theirRoles = theirs.get(ROLE_SELECTION_LIST, ())
+        syncedSet, ourSet, theirSet = set(syncedRoles), set(ourRoles), set(theirRoles)
+        if [roleId for roleId in ourRoles if roleId in syncedSet] != [roleId for roleId in syncedRoles if roleId in ourSet]:
+            # We reordered the list, so we keep our order, minus what they removed, plus what they added at the end.
+            merged[ROLE_SELECTION_LIST] = (tuple(roleId for roleId in ourRoles if roleId in theirSet or roleId not in syncedSet)
+                                           + tuple(roleId for roleId in theirRoles if roleId not in syncedSet and roleId not in ourSet))
+        else:
+            # Otherwise their order wins, minus what we removed, plus what we added at the end.
+            merged[ROLE_SELECTION_LIST] = (tuple(roleId for roleId in theirRoles if roleId in ourSet or roleId not in syncedSet)
+                                           + tuple(roleId for roleId in ourRoles if roleId not in syncedSet and roleId not in theirSet))
+    return merged
+
+
+class GuildConfig:
+
+    # A guild's settings, as the Extensions hold them in memory. Our storage format is several levels of dicts with every
+    # snowflake as a string, which costs over a kilobyte per guild before a single role is added, and a lookup and int()
+    # every time a setting is read. Here, the roles channel is an int and the role selection list a packed array of
+    # role IDs (see Caching.OrderedRoleSet), and we convert to and from the storage format only when loading and saving.
+
+    # synced holds the sections as they were at the version we hold, in case a save is rejected and has to be merged,
+    # see mergeSections. It's never stored.
+
+
+    __slots__ = ("version", "rolesChannelId", "roleIds", "synced")
+
+
+    def __init__(self, version:int=0, rolesChannelId:int=0, roleIds=()) -> None:
+        # Guilds that have never been set up have no roles channel (0) and no roles.
+        self.version = version
+        self.rolesChannelId = rolesChannelId
+        self.roleIds = Caching.OrderedRoleSet(roleIds)
+        self.synced = {}
+        self.markSynced(version, self.getSectionValues())
+
+
+    @classmethod
+    def fromStorageFormat(cls, storedDb:dict) -> "GuildConfig":
+        # Anything the stored guild doesn't have yet is given its default value.
+        sectionValues = getSectionValues(storedDb)
+        return cls(getVersion(storedDb), sectionValues.get(ROLES_CHANNEL, 0), sectionValues.get(ROLE_SELECTION_LIST, ()))
+
+
+    def toStorageFormat(self) -> dict:
+        return {"Meta": {"Config": {"Version": self.version}},
+                "Channels": {"RolesChannel": {"ChannelID": str(self.rolesChannelId)}},
+                "Roles": {"RoleSelectionList": {"PublicList": [str(roleId) for roleId in self.roleIds]}}}
+
+
+    def getSectionValues(self, sections=SECTION_PATHS) -> dict:
+        values = {}
+        if ROLES_CHANNEL in sections:
+            values[ROLES_CHANNEL] = self.rolesChannelId
+        if ROLE_SELECTION_LIST in sections:
+            values[ROLE_SELECTION_LIST] = tuple(self.roleIds)
+        return values
+
+
+    def markSynced(self, version:int, sectionValues:dict) -> None:
+        # Record that these sections (as returned by getSectionValues) match what's stored at version.
+        self.version = version
+        for section, value in sectionValues.items():
+            # Role lists are kept packed, like our own.
+            self.synced[section] = array("Q", value) if section == ROLE_SELECTION_LIST else value
+
+
+    def copyFrom(self, other:"GuildConfig") -> None:
+        # Replace our settings with another's in place, as handlers may be holding on to us. The role list is replaced
+        # rather than changed, so anything built from the old one can tell it's out of date.
+        self.version = other.version
+        self.rolesChannelId = other.rolesChannelId
+        self.roleIds = other.roleIds
+        self.synced = other.synced
+
+
+class StorageBackend:
+
+    # The interface every storage backend implements. A guild's database is represented as a dict in the same
+    # format regardless of the backend, {collectionName: {documentId: {key: value}}}, so that our mongo and yaml
+    # databases have parity. Every backend keeps the guild's version at VERSION_PATH. Guilds are loaded in this format,
+    # and saved from the GuildConfig the Extensions hold them in.
+
+
+    log = Utils.Log("Storage")
+
+    # The errors that mean we couldn't reach the backend (or it didn't answer in time), rather than that it refused what
+    # we asked. CircuitBreakerStorage counts these towards opening its circuit, and raises them as StorageUnavailableError.
+    transientErrors = (OSError, TimeoutError)
+
+
+    async def loadGuild(self, guildId:int) -> dict:
+        # Return the database dict for a single guild, or an empty dict if it has nothing saved yet.
+        raise NotImplementedError
+
+
+    async def loadGuilds(self, guildIds:list[int]) -> dict:
+        # Return {guildId: database dict} for several guilds. Backends that can fetch these in one go override this.
+        guildDbs = await asyncio.gather(*[self.loadGuild(guildId) for guildId in guildIds])
+        return dict(zip(guildIds, guildDbs))
+
+
+    async def loadChangedSince(self, token) -> tuple:
+        # Return ({guildId: database dict} for guilds saved since token, a token for the next call). Tokens are specific
+        # to the backend, a token of None returns no guilds, just the token to start from. A guild may be returned
+        # again after it was last returned, so check its version. Backends that can't do this cheaply don't implement it.
+        raise NotImplementedError
+
+
+    async def saveSections(self, guildId:int, guildDb:GuildConfig, sections:set) -> int:
+        # Persist several sections of the guild's database at once, as long as the stored version is still the guild's
+        # version. Returns the new version, or raises StaleWriteError. The guild's database is copied before anything
+        # is awaited, so it can keep changing while the save is in progress.
+        raise NotImplementedError
+
+
+    async def saveRoleSelectionList(self, guildId:int, guildDb:GuildConfig) -> int:
+        # Persist the guild's role selection list.
+        return await self.saveSections(guildId, guildDb, {ROLE_SELECTION_LIST})
+
+
+    async def saveRolesChannel(self, guildId:int, guildDb:GuildConfig) -> int:
+        # Persist the guild's roles channel.
+        return await self.saveSections(guildId, guildDb, {ROLES_CHANNEL})
+
+
+    async def close(self) -> None:
+        # Release any connections or threads held by the backend.
+        pass
+
+
+# One client per server, shared by every backend using it, as each client keeps its own connection pool and monitoring
+# threads. serverString: [AsyncMongoClient, how many backends are using it]
+mongoClients = {}
+
+
+def getMongoTransientErrors(pymongo) -> tuple:
+    # Connection failures (which include server selection and network timeouts) and operations that timed out.
+    return (pymongo.errors.ConnectionFailure, pymongo.errors.ExecutionTimeout, pymongo.errors.WTimeoutError, *StorageBackend.transientErrors)
+
+
+def acquireMongoClient(serverString:str):
+    # Return the shared, configured client for the server, creating it if we don't have one yet. Without timeouts, a
+    # slow or unreachable server would leave every handler waiting on it indefinitely.
+    import pymongo
+    if serverString not in mongoClients:
+        mongoClients[serverString] = [pymongo.AsyncMongoClient(serverString, maxPoolSize=config.mongoMaxPoolSize,
+                                                               serverSelectionTimeoutMS=config.mongoServerSelectionTimeoutMs,
+                                                               connectTimeoutMS=config.mongoConnectTimeoutMs,
+                                                               socketTimeoutMS=config.mongoSocketTimeoutMs), 0]
+    mongoClients[serverString][1] += 1
+    return mongoClients[serverString][0]
+
+
+async def releaseMongoClient(serverString:str) -> None:
+    # Close the server's client once no backend is using it.
+    mongoClients[serverString][1] -= 1
+    if mongoClients[serverString][1] == 0:
+        mongoClient, users = mongoClients.pop(serverString)
+        await mongoClient.close()
+
+
+class MongoStorage(StorageBackend):
+
+    # Uses pymongo's asyncio client, so every database round trip is awaited rather than blocking the event loop.
+    # Every guild has its own database, with one collection per section and one document per key.
+
+    # Finding changed guilds would mean querying every guild's database, so loadChangedSince isn't supported here. Use
+    # the consolidated schema for that.
+
+
+    def __init__(self, serverString:str) -> None:
+        import pymongo # Imported here so YAML deployments don't need pymongo installed.
+        self.pymongo = pymongo
+        self.serverString = serverString
+        self.transientErrors = getMongoTransientErrors(pymongo)
+        self.mongoClient = acquireMongoClient(serverString)
+
+
+    async def loadCollection(self, guildRawDb, collectionName:str) -> dict:
+        # Mongo makes this a little more complicated, we need to generate dicts for every document within the collection.
+        guildCollectionDocuments = await guildRawDb[collectionName].find().to_list(None)
+        return {str(document["_id"]): {k: v for k, v in document.items() if k != "_id"} for document in guildCollectionDocuments}
+
+
+    async def listGuildIds(self) -> list[int]:
+        # Every guild database is named after its guild ID, so we skip any that aren't (admin, local, etc).
+        return [int(databaseName) for databaseName in await self.mongoClient.list_database_names() if databaseName.isdigit()]
+
+
+    async def loadGuild(self, guildId:int) -> dict:
+        guildRawDb = self.mongoClient[str(guildId)]
+        guildDbCollectionNames = await guildRawDb.list_collection_names()
+        # We fetch every collection at the same time rather than one after the other.
+        collections = await asyncio.gather(*[self.loadCollection(guildRawDb, collectionName) for collectionName in guildDbCollectionNames])
+        return dict(zip(guildDbCollectionNames, collections))
+
+
+    async def claimVersion(self, guildId:int, version:int) -> None:
+        # Bump the guild's version, as long as it's still the version given. Collections can't be updated together
+        # atomically, so we claim the next version before writing the sections. If someone else got there first, there's
+        # no matching document, so the upsert tries to insert a second one and fails.
+        meta = self.mongoClient[str(guildId)]["Meta"]
+        try:
+            await meta.update_one({"_id": "Config", "Version": version or {"$in": [0, None]}}, {"$inc": {"Version": 1}}, upsert=True)
+        except self.pymongo.errors.DuplicateKeyError:
+            raise StaleWriteError(guildId, version)
+
+
+    async def saveSections(self, guildId:int, guildDb:GuildConfig, sections:set) -> int:
+        version = getVersion(guildDb)
+        storedDb = toStorageFormat(guildDb)
+        await self.claimVersion(guildId, version)
+        writes = []
+        if ROLE_SELECTION_LIST in sections:
+            roles = self.mongoClient[str(guildId)]["Roles"]
+            writes.append(roles.update_one({"_id": "RoleSelectionList"}, {"$set": {"PublicList": storedDb["Roles"]["RoleSelectionList"]["PublicList"]}}, upsert=True))
+        if ROLES_CHANNEL in sections:
+            channels = self.mongoClient[str(guildId)]["Channels"]
+            writes.append(channels.update_one({"_id": "RolesChannel"}, {"$set": {"ChannelID": storedDb["Channels"]["RolesChannel"]["ChannelID"]}}, upsert=True))
+        await asyncio.gather(*writes)
+        return version + 1
+
+
+    async def close(self) -> None:
+        await releaseMongoClient(self.serverString)
+
+
+class ConsolidatedMongoStorage(StorageBackend):
+
+    # An alternative Mongo schema, with a single collection holding one document per guild, keyed by the guild ID.
+    # Each document is the guild's database dict, so any number of guilds can be loaded with one query rather than
+    # a query per collection per guild. Use Migrate.py to convert existing per-guild databases to this schema.
+
+
+    # Every save also stamps the document with the server's time, which loadChangedSince queries on.
+
+
+    def __init__(self, serverString:str, databaseName:str, collectionName:str="Guilds") -> None:
+        import pymongo # Imported here so YAML deployments don't need pymongo installed.
+        self.pymongo = pymongo
+        self.serverString = serverString
+        self.transientErrors = getMongoTransientErrors(pymongo)
+        self.mongoClient = acquireMongoClient(serverString)
+        self.collection = self.mongoClient[databaseName][collectionName]
+        self.indexed = False
+
+
+    def documentToGuildDb(self, document:dict | None) -> dict:
+        if not document:
+            return {}
+        return {k: v for k, v in document.items() if k != "_id"}
+
+
+    async def loadGuild(self, guildId:int) -> dict:
+        # We must represent any Discord snowflakes as a string for compatability with a YAML database where needed.
+        return self.documentToGuildDb(await self.collection.find_one({"_id": str(guildId)}))
+
+
+    async def loadGuilds(self, guildIds:list[int]) -> dict:
+        guildId2Db = {guildId: {} for guildId in guildIds}
+        async for document in self.collection.find({"_id": {"$in": [str(guildId) for guildId in guildIds]}}):
+            guildId2Db[int(document["_id"])] = self.documentToGuildDb(document)
+        return guildId2Db
+
+
+    async def loadChangedSince(self, token) -> tuple:
+        if not self.indexed:
+            await self.collection.create_index("Meta.Config.UpdatedAt")
+            self.indexed = True
+        if token is None:
+            # Start from the most recently saved guild, using the server's clock rather than ours.
+            latest = await self.collection.find_one({"Meta.Config.UpdatedAt": {"$exists": True}}, sort=[("Meta.Config.UpdatedAt", -1)])
+            return ({}, latest["Meta"]["Config"]["UpdatedAt"] if latest else None)
+        # Guilds saved in the same millisecond as the last one we saw are returned again, rather than risking missing one.
+        guildId2Db = {}
+        async for document in self.collection.find({"Meta.Config.UpdatedAt": {"$gte": token}}):
+            guildId2Db[int(document["_id"])] = self.documentToGuildDb(document)
+            token = max(token, document["Meta"]["Config"]["UpdatedAt"])
+        return (guildId2Db, token)
+
+
+    async def saveSections(self, guildId:int, guildDb:GuildConfig, sections:set) -> int:
+        # Every section is a field in the same document, so they're all saved (and the version checked and bumped) with a
+        # single update. If the version doesn't match, the upsert tries to insert a second document and fails.
+        version = getVersion(guildDb)
+        storedDb = toStorageFormat(guildDb)
+        fields = {}
+        for section in sections:
+            value = storedDb
+            for key in SECTION_PATHS[section]:
+                value = value[key]
+            fields[".".join(SECTION_PATHS[section])] = value
+        try:
+            await self.collection.update_one({"_id": str(guildId), "Meta.Config.Version": version or {"$in": [0, None]}},
+                                             {"$set": fields, "$inc": {"Meta.Config.Version": 1}, "$currentDate": {"Meta.Config.UpdatedAt": True}}, upsert=True)
+        except self.pymongo.errors.DuplicateKeyError:
+            raise StaleWriteError(guildId, version)
+        return version + 1
+
+
+    async def saveGuilds(self, guildId2Db:dict) -> None:
+        # Replace the whole document for every guild given, in a single bulk write. Used by Migrate.py.
+        if guildId2Db:
+            await self.collection.bulk_write([self.pymongo.ReplaceOne({"_id": str(guildId)}, toStorageFormat(guildDb), upsert=True) for guildId, guildDb in guildId2Db.items()])
+
+
+    async def close(self) -> None:
+        await releaseMongoClient(self.serverString)
+
+
+class YamlStorage(StorageBackend):
+
+    # One YAML file per guild in ./databases. File access is synchronous, so we hand it off to a bounded thread pool
+    # and await the result instead of doing it on the event loop.
+
+    # Files are written to a temporary file then renamed over the original, so a crash mid-write never leaves a
+    # half-written database behind. With fsync enabled, the data is also flushed to disk before the rename.
+
+    # The version is kept in the file, so every save re-reads the file to check it first. Changed guilds are found by
+    # their files' modification times.
+
+
+    def __init__(self, directory:str="./databases", workers:int=4, fsync:bool=False) -> None:
+        import yaml # Imported here so Mongo deployments don't need pyyaml installed.
+        self.yaml = yaml
+        self.directory = directory
+        self.fsync = fsync
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="YamlStorage")
+        # Checking a guild's version and writing it must happen together, so each guild's saves take one of these locks.
+        self.locks = [threading.Lock() for _ in range(64)]
+
+
+    def getPath(self, guildId:int) -> str:
+        return os.path.join(self.directory, f"{guildId}.yaml")
+
+
+    async def listGuildIds(self) -> list[int]:
+        # Every database file is named after its guild ID, anything else in the directory is skipped.
+        if not os.path.exists(self.directory):
+            return []
+        fileNames = await self.runInExecutor(os.listdir, self.directory)
+        return [int(fileName[:-5]) for fileName in fileNames if fileName.endswith(".yaml") and fileName[:-5].isdigit()]
+
+
+    async def runInExecutor(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+
+
+    def readGuild(self, guildId:int) -> dict:
+        # This is fine, if the file doesn't exist, it'll be replaced by the default values later anyway.
+        if not os.path.exists(self.getPath(guildId)):
+            return {}
+        with open(self.getPath(guildId), "r") as guildDb:
+            return self.yaml.safe_load(guildDb) or {}
+
+
+    def writeGuild(self, guildId:int, guildDb:dict) -> None:
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+        fileDescriptor, tempPath = tempfile.mkstemp(dir=self.directory, prefix=f".{guildId}.", suffix=".tmp")
+        try:
+            with os.fdopen(fileDescriptor, "w") as guildDbFile:
+                self.yaml.safe_dump(guildDb, guildDbFile)
+                if self.fsync:
+                    guildDbFile.flush()
+                    os.fsync(guildDbFile.fileno())
+            os.replace(tempPath, self.getPath(guildId))
+        except:
+            os.remove(tempPath)
+            raise
+
+
+    def writeGuildVersion(self, guildId:int, guildDb:dict, version:int) -> None:
+        with self.locks[guildId % len(self.locks)]:
+            if getVersion(self.readGuild(guildId)) != version:
+                raise StaleWriteError(guildId, version)
+            self.writeGuild(guildId, guildDb)
+
+
+    def readChangedSince(self, token:int | None) -> tuple:
+        guildIds = []
+        latest = token or 0
+        if os.path.exists(self.directory):
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith(".yaml") and entry.name[:-5].isdigit():
+                    modifiedAt = entry.stat().st_mtime_ns
+                    # Files changed in the same instant as the last one we saw are returned again, so none are missed.
+                    if token is not None and modifiedAt >= token:
+                        guildIds.append(int(entry.name[:-5]))
+                    latest = max(latest, modifiedAt)
+        return ({guildId: self.readGuild(guildId) for guildId in guildIds}, latest)
+
+
+    async def loadGuild(self, guildId:int) -> dict:
+        return await self.runInExecutor(self.readGuild, guildId)
+
+
+    async def loadChangedSince(self, token) -> tuple:
+        return await self.runInExecutor(self.readChangedSince, token)
+
+
+    async def saveSections(self, guildId:int, guildDb:GuildConfig, sections:set) -> int:
+        # YAML can't update part of a file, so every section lives in the same file, and any number of them cost one write.
+        # We dump a copy, as the original may be changed on the event loop while the worker thread is writing it.
+        version = getVersion(guildDb)
+        storedDb = toStorageFormat(guildDb)
+        storedDb.setdefault("Meta", {}).setdefault("Config", {})["Version"] = version + 1
+        await self.runInExecutor(self.writeGuildVersion, guildId, storedDb, version)
+        return version + 1
+
+
+    async def close(self) -> None:
+        # Let any writes in progress finish, without blocking the event loop while we wait.
+        await asyncio.to_thread(self.executor.shutdown, wait=True)
+
+
+class SqliteStorage(StorageBackend):
+
+    # Every guild in a single SQLite database, with a row per roles channel and a row per role in each guild's role
+    # selection list, so a change only writes the rows that changed rather than the whole guild. The database runs in
+    # WAL mode, so readers never wait on the writer, and a crash at any point leaves it consistent.
+
+    # sqlite3 is synchronous, so as with YAML, every call is handed off to a thread. Writes go through a single thread
+    # (SQLite only allows one writer at a time anyway), while reads are spread over a pool with a connection each.
+    # Every statement is a constant with parameters, so each connection compiles it once and reuses it from its cache.
+
+    # Each guild's version lives in GuildVersions, along with the revision it was last saved in. Revisions count up
+    # across every guild, so loadChangedSince only has to look for revisions after the last one it saw.
+
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS RolesChannels (
+            guildId INTEGER PRIMARY KEY,
+            channelId INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS RoleSelectionRoles (
+            guildId INTEGER NOT NULL,
+            roleId INTEGER NOT NULL,
+            position INTEGER NOT NULL,
+            PRIMARY KEY (guildId, roleId)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS RoleSelectionOrder ON RoleSelectionRoles (guildId, position);
+        CREATE TABLE IF NOT EXISTS GuildVersions (
+            guildId INTEGER PRIMARY KEY,
+            version INTEGER NOT NULL,
+            revision INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS GuildRevisions ON GuildVersions (revision);
+    """
+    SELECT_CHANNEL = "SELECT channelId FROM RolesChannels WHERE guildId = ?"
+    SELECT_ROLES = "SELECT roleId, position FROM RoleSelectionRoles WHERE guildId = ? ORDER BY position"
+    UPSERT_CHANNEL = "INSERT INTO RolesChannels (guildId, channelId) VALUES (?, ?) ON CONFLICT (guildId) DO UPDATE SET channelId = excluded.channelId"
+    INSERT_ROLE = "INSERT INTO RoleSelectionRoles (guildId, roleId, position) VALUES (?, ?, ?)"
+    UPDATE_ROLE = "UPDATE RoleSelectionRoles SET position = ? WHERE guildId = ? AND roleId = ?"
+    DELETE_ROLE = "DELETE FROM RoleSelectionRoles WHERE guildId = ? AND roleId = ?"
+    SELECT_GUILD_IDS = "SELECT guildId FROM RolesChannels UNION SELECT guildId FROM RoleSelectionRoles"
+    SELECT_VERSION = "SELECT version FROM GuildVersions WHERE guildId = ?"
+    UPSERT_VERSION = ("INSERT INTO GuildVersions (guildId, version, revision) VALUES (?, ?, (SELECT IFNULL(MAX(revision), 0) + 1 FROM GuildVersions)) "
+                      "ON CONFLICT (guildId) DO UPDATE SET version = excluded.version, revision = excluded.revision")
+    SELECT_CHANGED = "SELECT guildId, revision FROM GuildVersions WHERE revision > ?"
+    SELECT_LATEST_REVISION = "SELECT IFNULL(MAX(revision), 0) FROM GuildVersions"
+
+
+    def __init__(self, path:str="./databases/RoleProvider.sqlite3", workers:int=4, fsync:bool=False) -> None:
+        import sqlite3 # Imported here so Mongo and YAML deployments never load it.
+        self.sqlite3 = sqlite3
+        self.path = path
+        # In WAL mode, NORMAL only syncs at checkpoints, so a power cut may lose the last few commits but never corrupts
+        # the database. FULL syncs on every commit.
+        self.synchronous = "FULL" if fsync else "NORMAL"
+        self.connections = [] # Every connection we've opened, so we can close them all.
+        self.threadConnections = threading.local()
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="SqliteWriter", initializer=self.connect)
+        self.readers = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="SqliteReader", initializer=self.connect)
+
+
+    def connect(self) -> None:
+        # Give the calling worker thread its own connection.
+        directory = os.path.dirname(os.path.abspath(self.path))
+        if not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        # We manage transactions ourselves, see write.
+        connection = self.sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        connection.execute("PRAGMA busy_timeout = 5000")
+        connection.execute("PRAGMA journal_mode = WAL")
+        connection.execute(f"PRAGMA synchronous = {self.synchronous}")
+        connection.executescript(self.SCHEMA)
+        self.threadConnections.connection = connection
+        self.connections.append(connection)
+
+
+    async def runInExecutor(self, executor:ThreadPoolExecutor, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(executor, function, *args)
+
+
+    def readGuilds(self, guildIds:list[int]) -> dict:
+        connection = self.threadConnections.connection
+        guildId2Db = {}
+        for guildId in guildIds:
+            channelRow = connection.execute(self.SELECT_CHANNEL, (guildId,)).fetchone()
+            roleRows = connection.execute(self.SELECT_ROLES, (guildId,)).fetchall()
+            versionRow = connection.execute(self.SELECT_VERSION, (guildId,)).fetchone()
+            guildDb = {}
+            # Like our other backends, snowflakes are strings in our storage format, and sections only exist once saved.
+            if versionRow:
+                guildDb["Meta"] = {"Config": {"Version": versionRow[0]}}
+            if channelRow:
+                guildDb["Channels"] = {"RolesChannel": {"ChannelID": str(channelRow[0])}}
+            if roleRows:
+                guildDb["Roles"] = {"RoleSelectionList": {"PublicList": [str(roleId) for roleId, position in roleRows]}}
+            guildId2Db[guildId] = guildDb
+        return guildId2Db
+
+
+    def writeRoles(self, connection, guildId:int, roleIds:list[int]) -> None:
+
+        # Bring the guild's rows in line with its role selection list, touching only the rows that need it.
+
+        # Positions only need to increase down the list, they don't need to be consecutive. So a role that still comes
+        # after the last role we kept keeps its position, and only roles that were added or moved are given a new one.
+        # Adding or removing a role costs one row, however long the list.
+        storedPositions = dict(connection.execute(self.SELECT_ROLES, (guildId,)).fetchall())
+        lastPosition = -1
+        for roleId in roleIds:
+            position = storedPositions.pop(roleId, None)
+            if position is not None and position > lastPosition:
+                lastPosition = position
+            elif position is not None:
+                lastPosition += 1
+                connection.execute(self.UPDATE_ROLE, (lastPosition, guildId, roleId))
+            else:
+                lastPosition += 1
+                connection.execute(self.INSERT_ROLE, (guildId, roleId, lastPosition))
+        # Anything left wasn't in the list any more.
+        connection.executemany(self.DELETE_ROLE, [(guildId, roleId) for roleId in storedPositions])
+
+
+    def write(self, guildId2Sections:dict) -> dict:
+        # Write {guildId: (version, {section: value})} in one transaction, where values are as returned by getSectionValues.
+        # A version of None skips the version check. Returns {guildId: new version}.
+        connection = self.threadConnections.connection
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            newVersions = {}
+            for guildId, (version, sections) in guildId2Sections.items():
+                versionRow = connection.execute(self.SELECT_VERSION, (guildId,)).fetchone()
+                storedVersion = versionRow[0] if versionRow else 0
+                if version is not None and storedVersion != version:
+                    raise StaleWriteError(guildId, version)
+                if ROLES_CHANNEL in sections:
+                    connection.execute(self.UPSERT_CHANNEL, (guildId, sections[ROLES_CHANNEL]))
+                if ROLE_SELECTION_LIST in sections:
+                    self.writeRoles(connection, guildId, sections[ROLE_SELECTION_LIST])
+                connection.execute(self.UPSERT_VERSION, (guildId, storedVersion + 1))
+                newVersions[guildId] = storedVersion + 1
+            connection.execute("COMMIT")
+            return newVersions
+        except:
+            connection.execute("ROLLBACK")
+            raise
+
+
+    def readChangedSince(self, token:int | None) -> tuple:
+        connection = self.threadConnections.connection
+        if token is None:
+            return ({}, connection.execute(self.SELECT_LATEST_REVISION).fetchone()[0])
+        rows = connection.execute(self.SELECT_CHANGED, (token,)).fetchall()
+        return (self.readGuilds([guildId for guildId, revision in rows]), max([token] + [revision for guildId, revision in rows]))
+
+
+    async def listGuildIds(self) -> list[int]:
+        rows = await self.runInExecutor(self.readers, lambda: self.threadConnections.connection.execute(self.SELECT_GUILD_IDS).fetchall())
+        return [guildId for guildId, in rows]
+
+
+    async def loadGuild(self, guildId:int) -> dict:
+        return (await self.runInExecutor(self.readers, self.readGuilds, [guildId]))[guildId]
+
+
+    async def loadGuilds(self, guildIds:list[int]) -> dict:
+        return await self.runInExecutor(self.readers, self.readGuilds, guildIds)
+
+
+    async def loadChangedSince(self, token) -> tuple:
+        return await self.runInExecutor(self.readers, self.readChangedSince, token)
+
+
+    async def saveSections(self, guildId:int, guildDb:GuildConfig, sections:set) -> int:
+        # What we're saving is copied out as plain integers here, on the event loop, before the writer thread gets to it.
+        newVersions = await self.runInExecutor(self.writer, self.write, {guildId: (getVersion(guildDb), getSectionValues(guildDb, sections))})
+        return newVersions[guildId]
+
+
+    async def saveGuilds(self, guildId2Db:dict) -> None:
+        # Save every section of every guild given, in one transaction, whatever their versions. Used by Migrate.py.
+        await self.runInExecutor(self.writer, self.write, {guildId: (None, getSectionValues(guildDb)) for guildId, guildDb in guildId2Db.items()})
+
+
+    async def close(self) -> None:
+        # Let any reads and writes in progress finish, then close every connection.
+        await asyncio.to_thread(self.writer.shutdown, wait=True)
+        await asyncio.to_thread(self.readers.shutdown, wait=True)
+        for connection in self.connections:
+            connection.close()
+        self.connections.clear()
+
+
+class MemoryStorage(StorageBackend):
+
+    # Keeps every guild database in memory, in the same format we'd store it in. Nothing survives a restart, so this is
+    # only for benchmarks and load tests, where we want to measure the bot rather than the database.
+    # An optional latency is awaited on every call to stand in for a database round trip.
+
+
+    def __init__(self, latency:float=0.0) -> None:
+        self.latency = latency
+        self.guildDbs = {} # guildId: database dict in storage format
+        self.revisions = {} # guildId: the revision it was last saved in, counting up across every guild
+        self.revision = 0
+        self.loads = 0
+        self.saves = 0
+
+
+    async def wait(self) -> None:
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+
+
+    async def loadGuild(self, guildId:int) -> dict:
+        self.loads += 1
+        await self.wait()
+        # Hand out a copy, just like the other backends never share their dicts with the caller.
+        return toStorageFormat(self.guildDbs.get(guildId, {}))
+
+
+    async def loadChangedSince(self, token) -> tuple:
+        await self.wait()
+        if token is None:
+            return ({}, self.revision)
+        return ({guildId: toStorageFormat(self.guildDbs[guildId]) for guildId, revision in self.revisions.items() if revision > token}, self.revision)
+
+
+    async def saveSections(self, guildId:int, guildDb:GuildConfig, sections:set) -> int:
+        self.saves += 1
+        version = getVersion(guildDb)
+        storedDb = toStorageFormat(guildDb)
+        await self.wait()
+        if getVersion(self.guildDbs.get(guildId, {})) != version:
+            raise StaleWriteError(guildId, version)
+        storedDb.setdefault("Meta", {}).setdefault("Config", {})["Version"] = version + 1
+        self.guildDbs[guildId] = storedDb
+        self.revision += 1
+        self.revisions[guildId] = self.revision
+        return version + 1
+
+
+class CircuitBreakerStorage(StorageBackend):
+
+    # Wraps another backend, so that once it's failing we stop waiting on it. After failureThreshold calls in a row fail
+    # with one of the backend's transientErrors, the circuit opens and every call raises StorageUnavailableError straight
+    # away for resetTimeout seconds. Then one call is let through to test the backend (half open): if it works the circuit
+    # closes again, otherwise it stays open. Transient errors are raised as StorageUnavailableError too, open or not.
+
+    # While it's open, the Extension keeps serving the guilds it has cached, and our write queue holds on to changes
+    # until they can be saved, so an outage delays saving rather than stopping role selection.
+
+
+    log = Utils.Log("CircuitBreaker")
+
+
+    def __init__(self, backend:StorageBackend, failureThreshold:int=5, resetTimeout:float=30.0) -> None:
+        self.backend = backend
+        self.failureThreshold = failureThreshold
+        self.resetTimeout = resetTimeout
+        self.failures = 0 # In a row.
+        self.openUntil = None # time.monotonic() value, or None while the circuit is closed.
+        self.testing = False # Whether the one call we let through while half open is still in progress.
+
+
+    async def call(self, function, *args):
+        if self.openUntil is not None:
+            now = time.monotonic()
+            if now < self.openUntil or self.testing:
+                Metrics.increment("storage_unavailable_total")
+                raise StorageUnavailableError(max(0.0, self.openUntil - now))
+            self.testing = True
+
+        try:
+            result = await function(*args)
+        except asyncio.CancelledError:
+            # We don't know how the call would have gone, so let the next one test the backend instead.
+            self.testing = False
+            raise
+        except self.backend.transientErrors as exception:
+            # We couldn't reach the backend, so as far as our callers are concerned, storage is unavailable. They hold on
+            # to their changes the same way as they do while the circuit is open.
+            self.failed()
+            retryAfter = max(0.0, self.openUntil - time.monotonic()) if self.openUntil is not None else 0.0
+            raise StorageUnavailableError(retryAfter) from exception
+        except Exception:
+            # The backend answered, it just said no (a stale write, for example).
+            self.succeeded()
+            raise
+        self.succeeded()
+        return result
+
+
+    def succeeded(self) -> None:
+        if self.openUntil is not None:
+            self.log.print("Storage has recovered, closing the circuit.")
+            Metrics.setGauge("storage_circuit_open", 0)
+        self.failures = 0
+        self.openUntil = None
+        self.testing = False
+
+
+    def failed(self) -> None:
+        self.failures += 1
+        if self.testing or self.failures >= self.failureThreshold:
+            if self.openUntil is None:
+                self.log.warning(f"Storage has failed {self.failures} times in a row, failing fast for {self.resetTimeout} seconds.")
+                Metrics.setGauge("storage_circuit_open", 1)
+            self.openUntil = time.monotonic() + self.resetTimeout
+            self.testing = False
+
+
+    async def loadGuild(self, guildId:int) -> dict:
+        return await self.call(self.backend.loadGuild, guildId)
+
+
+    async def loadGuilds(self, guildIds:list[int]) -> dict:
+        return await self.call(self.backend.loadGuilds, guildIds)
+
+
+    async def loadChangedSince(self, token) -> tuple:
+        return await self.call(self.backend.loadChangedSince, token)
+
+
+    async def saveSections(self, guildId:int, guildDb:GuildConfig, sections:set) -> int:
+        return await self.call(self.backend.saveSections, guildId, guildDb, sections)
+
+
+    async def close(self) -> None:
+        await self.backend.close()
+
+
+def createStorage() -> StorageBackend:
+    # Create the storage backend our config asks for.
+    if config.useMongoDb:
+        if config.mongoSchema == "consolidated":
+            storage = ConsolidatedMongoStorage(config.mongoServerString, config.mongoDatabaseName)
+        else:
+            storage = MongoStorage(config.mongoServerString)
+        return CircuitBreakerStorage(storage, config.storageBreakerFailures, config.storageBreakerResetSeconds)
+    elif config.storageBackend == "sqlite":
+        return SqliteStorage(config.sqlitePath, workers=config.storageWorkers, fsync=config.storageFsync)
+    else:
+        return YamlStorage(workers=config.storageWorkers, fsync=config.storageFsync)
+
+
+def writeSnapshot(path:str, guilds:list) -> None:
+
+    # Write a snapshot of our cached guilds, a list of (guildId, version, rolesChannelId, roleIds) tuples. Every ID is a
+    # snowflake, so the snapshot is just packed integers, which is far smaller and quicker to read back than any text format.
+    # Like our YAML files, it's written to a temporary file then renamed, so a crash never leaves half a snapshot behind.
+
+    chunks = [SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(guilds))]
+    for guildId, version, rolesChannelId, roleIds in guilds:
+        chunks.append(SNAPSHOT_GUILD.pack(guildId, version, rolesChannelId, len(roleIds)))
+        chunks.append(struct.pack(f"<{len(roleIds)}Q", *roleIds))
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fileDescriptor, tempPath = tempfile.mkstemp(dir=directory, prefix=".snapshot.", suffix=".tmp")
+    try:
+        with os.fdopen(fileDescriptor, "wb") as snapshotFile:
+            snapshotFile.write(b"".join(chunks))
+        os.replace(tempPath, path)
+    except:
+        os.remove(tempPath)
+        raise
+
+
+def readSnapshot(path:str) -> dict:
+
+    # Read a snapshot written by writeSnapshot, returning {guildId: GuildConfig} in the order the guilds were written.
+    # Raises ValueError if the file isn't a snapshot we understand.
+
+    with open(path, "rb") as snapshotFile:
+        data = snapshotFile.read()
+    try:
+        magic, version, guildCount = SNAPSHOT_HEADER.unpack_from(data, 0)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            raise ValueError(f"{path} is not a version {SNAPSHOT_VERSION} guild snapshot.")
+        offset = SNAPSHOT_HEADER.size
+        guildId2Db = {}
+        for _ in range(guildCount):
+            guildId, version, rolesChannelId, roleCount = SNAPSHOT_GUILD.unpack_from(data, offset)
+            offset += SNAPSHOT_GUILD.size
+            roleIds = struct.unpack_from(f"<{roleCount}Q", data, offset)
+            offset += roleCount * 8
+            guildId2Db[guildId] = GuildConfig(version, rolesChannelId, roleIds)
+    except struct.error as exception:
+        raise ValueError(f"{path} is truncated or corrupt.") from exception
+    return guildId2Db
+
+
+class WriteBehindQueue:
+
+    # Sits in front of a storage backend and coalesces saves. Every change to a guild within the write-behind window
+    # is merged into one write per guild, so bulk edits cost one write rather than one per change.
+
+    # With a window of 0 (the default), saves are written through immediately instead, which is the most durable option,
+    # and means admin commands only report success once their changes are stored. Write-behind is opt-in.
+
+    # If a save is rejected because someone else saved the guild first, merge is awaited with the guild's ID and database,
+    # to bring it up to date with what's stored (keeping our changes), then the save is tried again.
+
+    # Saves that fail are kept and retried, even when writing through, so changes made while storage is unavailable
+    # are saved once it recovers, however long that takes. Any other error means storage could be reached but rejected
+    # the save. Those are retried up to maxFailures times in a row, then the save is dropped, as an error that keeps
+    # coming back (a guild storage rejects, for example) isn't going away by itself.
+
+
+    log = Utils.Log("WriteBehindQueue")
+
+
+    def __init__(self, storage:StorageBackend, window:float, merge=None, maxAttempts:int=3, maxFailures:int=5) -> None:
+        self.storage = storage
+        self.window = window
+        self.merge = merge
+        self.maxAttempts = maxAttempts
+        self.maxFailures = maxFailures
+        self.pending = {} # guildId: (guildDb, set of sections to save)
+        self.saving = {} # guildId: guildDb, for saves that are currently in flight.
+        self.failures = {} # guildId: how many times in a row its save has failed, other than storage being unavailable.
+        self.flushTask = None
+        self.retryDelay = max(window, 1.0) # Seconds between attempts to save guilds that failed to save.
+
+
+    def getPending(self, guildId:int) -> GuildConfig | None:
+        # Return the guild's database if it has unsaved changes, as it's newer than what's in storage.
+        entry = self.pending.get(guildId)
+        return entry[0] if entry else self.saving.get(guildId)
+
+
+    async def write(self, guildId:int, guildDb:GuildConfig, sections:set) -> None:
+        self.saving[guildId] = guildDb
+        try:
+            for attempt in range(self.maxAttempts):
+                # Taken right before the backend copies the guild, so it's exactly what gets saved.
+                sectionValues = getSectionValues(guildDb, sections)
+                try:
+                    with Metrics.timer("storage_seconds", operation="save"):
+                        version = await self.storage.saveSections(guildId, guildDb, sections)
+                    guildDb.markSynced(version, sectionValues)
+                    return
+                except StaleWriteError:
+                    Metrics.increment("storage_conflicts_total")
+                    if self.merge is None or attempt == self.maxAttempts - 1:
+                        raise
+                    self.log.print(f"Guild {guildId} was changed elsewhere, merging before saving again.")
+                    await self.merge(guildId, guildDb)
+                    # The merge can change any section.
+                    sections = set(SECTION_PATHS)
+        finally:
+            self.saving.pop(guildId, None)
+
+
+    async def save(self, guildId:int, guildDb:GuildConfig, *sections:str) -> bool:
+        # Every section given is saved in the same write. Returns whether the changes have been stored yet. If not,
+        # they're queued and saved shortly (after the write-behind window, or once storage is available again).
+        if self.window <= 0:
+            try:
+                await self.write(guildId, guildDb, set(sections))
+                return True
+            except StorageUnavailableError:
+                # Our changes are already in the guild's database, so we hold on to them until storage is back.
+                self.requeue(guildId, guildDb, set(sections))
+                self.retryLater()
+                return False
+
+        if guildId in self.pending:
+            self.pending[guildId][1].update(sections)
+        else:
+            self.pending[guildId] = (guildDb, set(sections))
+
+        if self.flushTask is None or self.flushTask.done():
+            self.flushTask = asyncio.create_task(self.flushLater())
+        return False
+
+
+    async def flushLater(self, delay:float=None) -> None:
+        await asyncio.sleep(self.window if delay is None else delay)
+        await self.flush()
+
+
+    def requeue(self, guildId:int, guildDb:GuildConfig, sections:set) -> None:
+        # Put a save that failed back in the queue, merging with anything queued since.
+        if guildId in self.pending:
+            self.pending[guildId][1].update(sections)
+        else:
+            self.pending[guildId] = (guildDb, sections)
+
+
+    def retryLater(self) -> None:
+        if self.flushTask is None or self.flushTask.done() or self.flushTask is asyncio.current_task():
+            self.flushTask = asyncio.create_task(self.flushLater(self.retryDelay))
+
+
+    async def flushGuild(self, guildId:int, guildDb:GuildConfig, sections:set) -> bool:
+        # Returns False if storage was unavailable, which flush reports once for every guild rather than each one.
+        try:
+            await self.write(guildId, guildDb, sections)
+            self.failures.pop(guildId, None)
+        except StorageUnavailableError:
+            self.requeue(guildId, guildDb, sections)
+            return False
+        except Exception:
+            failures = self.failures.get(guildId, 0) + 1
+            if failures >= self.maxFailures:
+                self.failures.pop(guildId, None)
+                self.log.error(f"Could not save guild {guildId} after {failures} attempts, its changes have been dropped.")
+                return True
+            if failures == 1:
+                # Only the first failure is logged in full, the retries would just repeat it.
+                self.log.exception(f"Could not save guild {guildId}, it will be retried.")
+            self.failures[guildId] = failures
+            self.requeue(guildId, guildDb, sections)
+        return True
+
+
+    async def flush(self) -> None:
+        # Write every pending guild, all at the same time. Anything that fails is queued again, see requeue.
+        pending, self.pending = self.pending, {}
+        # Until each write starts, the guilds are in neither pending nor saving, so getPending would miss them.
+        self.saving.update((guildId, guildDb) for guildId, (guildDb, sections) in pending.items())
+        try:
+            results = await asyncio.gather(*[self.flushGuild(guildId, guildDb, sections) for guildId, (guildDb, sections) in pending.items()])
+        except asyncio.CancelledError:
+            # We're being closed part way through, so we put the whole batch back for close to write. Saving a guild
+            # that had already been written again is harmless, losing one that hadn't isn't.
+            for guildId, (guildDb, sections) in pending.items():
+                self.requeue(guildId, guildDb, sections)
+            raise
+        if not all(results):
+            self.log.warning(f"Storage is unavailable, changes to {results.count(False)} guilds will be saved once it recovers.")
+
+        if self.pending:
+            # Some writes failed (or more changes came in while we were writing), try again shortly.
+            self.retryLater()
+
+
+    async def close(self) -> None:
+        # Cancel the scheduled flush and write everything that's left right now. We wait for the cancelled flush to
+        # finish, as one that was part way through puts its batch back in pending as it stops.
+        if self.flushTask and not self.flushTask.done() and self.flushTask is not asyncio.current_task():
+            self.flushTask.cancel()
+            await asyncio.wait([self.flushTask])
+        pending, self.pending = self.pending, {}
+        for guildId, (guildDb, sections) in pending.items():
+            await self.write(guildId, guildDb, sections)
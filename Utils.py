@@ -6,25 +6,157 @@ Utilities used throughout the bot, defined separately for ease of access.
 """
 
 from datetime import datetime
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+
+
+class TextFormatter(logging.Formatter):
+
+    # [hour:minute:second] className: output, with the level added for anything other than info.
+
+
+    def format(self, record:logging.LogRecord) -> str:
+        timestamp = "[" + datetime.fromtimestamp(record.created).strftime("%H:%M:%S") + "]"
+        level = "" if record.levelno == logging.INFO else f"{record.levelname}: "
+        output = f"{timestamp} {record.className}: {level}{record.getMessage()}"
+        if record.exc_info:
+            output += "\n" + self.formatException(record.exc_info)
+        return output
+
+
+class JsonLinesFormatter(logging.Formatter):
+
+    # One JSON object per line, for log collectors.
+
+
+    def format(self, record:logging.LogRecord) -> str:
+        entry = {"time": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+                 "level": record.levelname,
+                 "source": record.className,
+                 "message": record.getMessage()}
+        if record.category:
+            entry["category"] = record.category
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+class BackgroundQueueHandler(logging.handlers.QueueHandler):
+
+    # The standard QueueHandler formats records before queueing them. We leave that to the background writer thread,
+    # so logging from the event loop only costs putting the record on the queue.
+
+
+    def prepare(self, record:logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class LogSettings:
+
+    # Shared by every Log instance, set up with configureLogging.
+
+    logger = logging.getLogger("RoleProvider")
+    listener = None
+    sampling = {} # category: fraction of logs to keep, between 0 and 1.
+
+
+def configureLogging(level:str="INFO", jsonLines:bool=False, logFile:str=None, maxBytes:int=10485760, backupCount:int=5, sampling:dict=None) -> None:
+
+    # Set up where our logs go. Logs are put on a queue and written to the console (and optionally a rotating log file)
+    # by a background thread, so the event loop never waits on stdout or the disk.
+
+    if LogSettings.listener:
+        LogSettings.listener.stop()
+
+    formatter = JsonLinesFormatter() if jsonLines else TextFormatter()
+    handlers = [logging.StreamHandler(sys.stdout)]
+    if logFile:
+        handlers.append(logging.handlers.RotatingFileHandler(logFile, maxBytes=maxBytes, backupCount=backupCount, encoding="utf-8"))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    logQueue = queue.SimpleQueue()
+    LogSettings.logger.handlers = [BackgroundQueueHandler(logQueue)]
+    LogSettings.logger.setLevel(level.upper())
+    LogSettings.logger.propagate = False
+    LogSettings.sampling = sampling or {}
+    LogSettings.listener = logging.handlers.QueueListener(logQueue, *handlers, respect_handler_level=True)
+    LogSettings.listener.start()
+
+
+def stopLogging() -> None:
+    # Write out anything still queued and stop the background writer.
+    if LogSettings.listener:
+        LogSettings.listener.stop()
+        LogSettings.listener = None
+
+
+def getShardedPath(path:str, shardIds:list=None) -> str:
+    # Files written by each of the launcher's processes need their own name, e.g. bot.log becomes bot-shards0-3.log.
+    if not shardIds:
+        return path
+    root, extension = os.path.splitext(path)
+    return f"{root}-shards{shardIds[0]}-{shardIds[-1]}{extension}"
+
 
 class Log:
 
     # This class allows for us to output things to the console in a better format, including
     # the timestamp and where the log came from.
 
+    # High volume logs can be given a category, which can be sampled in the config so only a fraction of them are kept.
+
 
     def __init__(self, className:str) -> None:
         self.className = className
 
 
-    def getTimestamp(self) -> str:
-        # Return the current timestamp in a readable format, [hour:minute:second]
-        return "[" + str(datetime.now().strftime("%H:%M:%S")) + "]"
+    def sample(self, category:str) -> bool:
+        # Whether a log in this category should be kept, so callers can skip building expensive messages.
+        rate = LogSettings.sampling.get(category, 1.0)
+        return rate >= 1.0 or random.random() < rate
+
+
+    def log(self, level:int, string, category:str=None, exc_info=None) -> None:
+        if not LogSettings.logger.isEnabledFor(level) or (category and not self.sample(category)):
+            return
+        LogSettings.logger.log(level, string, exc_info=exc_info, extra={"className": self.className, "category": category})
+
 
+    def debug(self, string, category:str=None) -> None:
+        self.log(logging.DEBUG, string, category)
 
-    def print(self, string) -> None:
+
+    def print(self, string, category:str=None) -> None:
         # [hour:minute:second] className: output
-        print(f"{self.getTimestamp()} {self.className}: {string}")
+        self.log(logging.INFO, string, category)
+
+
+    info = print
+
+
+    def warning(self, string, category:str=None) -> None:
+        self.log(logging.WARNING, string, category)
+
+
+    def error(self, string, category:str=None) -> None:
+        self.log(logging.ERROR, string, category)
+
+
+    def exception(self, string, category:str=None) -> None:
+        # Log an error along with the traceback of the exception currently being handled.
+        self.log(logging.ERROR, string, category, exc_info=True)
+
+
+# Log to the console by default, until configureLogging is called with our config.
+configureLogging()
+atexit.register(stopLogging)
 
 
 class EmbedColours:
@@ -35,4 +167,4 @@ class EmbedColours:
     neutral = 0xFFFF55 # Yellow 
     negative = 0xFF5555 # Red
     info = 0x5555FF # Blurple
-    error = 0xAA0000 # Dark Red
\ No newline at end of file
+    error = 0xAA0000 # Dark Red
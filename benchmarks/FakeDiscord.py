@@ -0,0 +1,330 @@
+"""
+Fake Discord
+~~~~~~~~~~~~
+
+A local stand-in for Discord's gateway and HTTP API, used by LoadTest.py to run the real bot with no network access.\n
+It serves just enough of both for interactions.py to log in, connect, receive guilds and handle component
+interactions. Every REST call the bot makes is counted by route, and every interaction we send is timed until the bot
+acknowledges it (the first callback) and until it has sent its final response.
+"""
+
+import Utils
+
+from aiohttp import web
+
+import asyncio
+from array import array
+from collections import Counter
+from datetime import datetime, timezone
+import itertools
+import json
+import re
+import time
+
+
+API_VERSION = 10
+SNOWFLAKE = re.compile(r"/\d{5,}")
+TOKEN = re.compile(r"/token\d+")
+
+# Interaction callback types, see https://discord.com/developers/docs/interactions/receiving-and-responding
+CALLBACK_MESSAGE = 4
+CALLBACK_DEFERRED_MESSAGE = 5
+CALLBACK_DEFERRED_UPDATE = 6
+CALLBACK_UPDATE = 7
+
+
+def jsonResponse(data, status:int=200, headers:dict=None) -> web.Response:
+    # interactions.py only parses responses with a Content-Type of exactly "application/json", as Discord sends, but
+    # aiohttp's json_response adds a charset.
+    return web.Response(body=json.dumps(data).encode(), status=status, headers={"Content-Type": "application/json", **(headers or {})})
+
+
+def isGuildOnShard(guildId:int, shard:list) -> bool:
+    # shard is [shard ID, shard count], and Discord puts a guild on shard (guild ID >> 22) % shard count.
+    return (guildId >> 22) % shard[1] == shard[0]
+
+
+def timestamp() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class FakeGuildState:
+
+    # What Discord would know about one of our guilds: its roles, a channel, and which roles each member has.
+
+
+    def __init__(self, guildId:int, roleIds:list, channelId:int) -> None:
+        self.guildId = guildId
+        self.roleIds = roleIds
+        self.channelId = channelId
+        self.memberRoleIds = {} # memberId: set of role IDs
+
+
+    def toGuildCreate(self) -> dict:
+        roles = [{"id": str(self.guildId), "name": "@everyone", "color": 0, "hoist": False, "position": 0, "permissions": "0", "managed": False, "mentionable": False, "flags": 0}]
+        roles += [{"id": str(roleId), "name": f"Role {index + 1}", "color": 0, "hoist": False, "position": index + 1, "permissions": "0", "managed": False, "mentionable": False, "flags": 0}
+                  for index, roleId in enumerate(self.roleIds)]
+        return {"id": str(self.guildId), "name": f"Guild {self.guildId}", "icon": None, "owner_id": "1", "roles": roles,
+                "channels": [{"id": str(self.channelId), "type": 0, "name": "roles", "position": 0, "guild_id": str(self.guildId), "permission_overwrites": []}],
+                "members": [], "member_count": len(self.memberRoleIds), "large": False, "unavailable": False, "joined_at": timestamp(),
+                "features": [], "emojis": [], "stickers": [], "threads": [], "presences": [], "voice_states": [], "stage_instances": [],
+                "guild_scheduled_events": [], "afk_timeout": 300, "verification_level": 0, "default_message_notifications": 0,
+                "explicit_content_filter": 0, "mfa_level": 0, "system_channel_flags": 0, "premium_tier": 0, "preferred_locale": "en-US",
+                "nsfw_level": 0, "premium_progress_bar_enabled": False}
+
+
+class InteractionTimings:
+
+    # Ack and response latencies, in seconds. Kept in arrays of doubles so a long soak doesn't distort the memory
+    # figures we're trying to measure.
+
+
+    def __init__(self) -> None:
+        self.sentAt = {} # interactionId: when we sent it to the bot
+        self.deferred = {} # token: interactionId, for interactions acknowledged but not yet responded to
+        self.ackLatencies = array("d")
+        self.responseLatencies = array("d")
+
+
+    def markSent(self, interactionId:int, sentAt:float=None) -> None:
+        self.sentAt[interactionId] = time.perf_counter() if sentAt is None else sentAt
+
+
+    def markAcknowledged(self, interactionId:int, token:str, callbackType:int) -> None:
+        sentAt = self.sentAt.get(interactionId)
+        if sentAt is None:
+            return
+        latency = time.perf_counter() - sentAt
+        self.ackLatencies.append(latency)
+        if callbackType in (CALLBACK_DEFERRED_MESSAGE, CALLBACK_DEFERRED_UPDATE):
+            # The real response follows as a followup or an edit of the original.
+            self.deferred[token] = interactionId
+        else:
+            self.responseLatencies.append(latency)
+            del self.sentAt[interactionId]
+
+
+    def markResponded(self, token:str) -> None:
+        interactionId = self.deferred.pop(token, None)
+        if interactionId is not None:
+            self.responseLatencies.append(time.perf_counter() - self.sentAt.pop(interactionId))
+
+
+class FakeDiscord:
+
+    log = Utils.Log("FakeDiscord")
+
+
+    def __init__(self, botId:int, guilds:list, host:str="127.0.0.1", port:int=0, memberEditLimit:int=0, memberEditWindow:float=1.0,
+                 shardCount:int=1, memberEditLatency:float=0.0) -> None:
+        # memberEditLimit optionally rate limits member role changes per guild, like Discord does, to that many calls
+        # every memberEditWindow seconds. Calls over the limit get a 429, just like the real thing.
+        # memberEditLatency optionally slows every member role change down by that many seconds.
+        # shardCount is the shard count we recommend to an auto-sharding bot.
+        self.botId = botId
+        self.shardCount = shardCount
+        self.guilds = {guildState.guildId: guildState for guildState in guilds}
+        self.host = host
+        self.port = port
+        self.memberEditLimit = memberEditLimit
+        self.memberEditWindow = memberEditWindow
+        self.memberEditLatency = memberEditLatency
+        self.memberEditWindows = {} # guildId: (window start, calls made in it)
+        self.restCalls = Counter() # "METHOD /route/{id}": count
+        self.rateLimited = 0
+        self.timings = InteractionTimings()
+        self.nextId = itertools.count(10**17)
+        self.sockets = {} # socket: [shard ID, shard count], as sent when it identified.
+        self.sequence = itertools.count(1)
+        self.runner = None
+        self.ready = asyncio.Event()
+
+        self.app = web.Application()
+        self.app.router.add_get("/gateway", self.handleGateway)
+        self.app.router.add_route("*", f"/api/v{API_VERSION}/{{path:.*}}", self.handleRest)
+
+
+    @property
+    def apiBase(self) -> str:
+        return f"http://{self.host}:{self.port}/api/v{API_VERSION}"
+
+
+    async def start(self) -> None:
+        self.runner = web.AppRunner(self.app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, self.host, self.port)
+        await site.start()
+        # If we asked for any free port, find out which one we got.
+        self.port = site._server.sockets[0].getsockname()[1]
+
+
+    async def stop(self) -> None:
+        for socket in list(self.sockets):
+            await socket.close()
+        if self.runner:
+            await self.runner.cleanup()
+
+
+    def botUser(self) -> dict:
+        return {"id": str(self.botId), "username": "Role Provider", "discriminator": "0", "global_name": None, "avatar": None, "bot": True, "flags": 0}
+
+
+    def message(self, channelId:int=0, content:str="") -> dict:
+        return {"id": str(next(self.nextId)), "channel_id": str(channelId), "author": self.botUser(), "content": content or "",
+                "timestamp": timestamp(), "edited_timestamp": None, "tts": False, "mention_everyone": False, "mentions": [],
+                "mention_roles": [], "attachments": [], "embeds": [], "pinned": False, "type": 0, "flags": 64, "components": []}
+
+
+    # Gateway
+
+    async def send(self, socket:web.WebSocketResponse, payload:dict) -> None:
+        await socket.send_str(json.dumps(payload))
+
+
+    async def dispatch(self, eventName:str, data:dict, guildId:int=None) -> None:
+        # Events for a guild only go to the shard that guild belongs to, like they would on Discord.
+        for socket, shard in list(self.sockets.items()):
+            if guildId is None or isGuildOnShard(guildId, shard):
+                await self.send(socket, {"op": 0, "t": eventName, "s": next(self.sequence), "d": data})
+
+
+    async def handleGateway(self, request:web.Request) -> web.WebSocketResponse:
+        socket = web.WebSocketResponse(max_msg_size=0)
+        await socket.prepare(request)
+        self.sockets[socket] = [0, 1]
+        await self.send(socket, {"op": 10, "d": {"heartbeat_interval": 41250}})
+        try:
+            async for message in socket:
+                payload = json.loads(message.data)
+                if payload["op"] == 1:
+                    # Heartbeat
+                    await self.send(socket, {"op": 11})
+                elif payload["op"] == 2:
+                    # Identify
+                    shard = self.sockets[socket] = payload["d"].get("shard") or [0, 1]
+                    guildStates = [guildState for guildId, guildState in self.guilds.items() if isGuildOnShard(guildId, shard)]
+                    await self.send(socket, {"op": 0, "t": "READY", "s": next(self.sequence), "d": {
+                        "v": API_VERSION, "user": self.botUser(), "session_id": "loadtest", "shard": shard,
+                        "resume_gateway_url": f"ws://{self.host}:{self.port}/gateway",
+                        "guilds": [{"id": str(guildState.guildId), "unavailable": True} for guildState in guildStates],
+                        "application": {"id": str(self.botId), "flags": 0}}})
+                    for guildState in guildStates:
+                        await self.send(socket, {"op": 0, "t": "GUILD_CREATE", "s": next(self.sequence), "d": guildState.toGuildCreate()})
+                    self.ready.set()
+                elif payload["op"] == 6:
+                    # Resume
+                    await self.send(socket, {"op": 0, "t": "RESUMED", "s": next(self.sequence), "d": {}})
+                # Anything else (presence updates, member requests) needs no reply.
+        finally:
+            self.sockets.pop(socket, None)
+        return socket
+
+
+    async def sendInteraction(self, guildId:int, memberId:int, customId:str, componentType:int, values:list=(), options:list=None, sentAt:float=None) -> None:
+        # Send a component interaction from a member, as if they'd pressed a button (componentType 2) or used a
+        # selection list (componentType 3) with these options on our message. Its latencies are timed from sentAt
+        # (a time.perf_counter value) if given, or from now.
+        guildState = self.guilds[guildId]
+        interactionId = next(self.nextId)
+        component = {"type": componentType, "custom_id": customId}
+        if componentType == 2:
+            component.update(style=1, label="Get roles...")
+        else:
+            component.update(options=[{"label": f"Role {value}", "value": value, "default": False} for value in options or ()], min_values=0, max_values=1)
+        message = self.message(guildState.channelId)
+        message["components"] = [{"type": 1, "components": [component]}]
+        message["flags"] = 64 if componentType == 3 else 0
+
+        self.timings.markSent(interactionId, sentAt)
+        await self.dispatch("INTERACTION_CREATE", {
+            "id": str(interactionId), "application_id": str(self.botId), "type": 3, "token": f"token{interactionId}", "version": 1,
+            "guild_id": str(guildId), "channel_id": str(guildState.channelId),
+            "member": {"user": {"id": str(memberId), "username": f"member{memberId}", "discriminator": "0", "global_name": f"Member {memberId}", "avatar": None},
+                       "roles": [str(roleId) for roleId in guildState.memberRoleIds.get(memberId, ())],
+                       "joined_at": timestamp(), "deaf": False, "mute": False, "flags": 0, "permissions": "0"},
+            "data": {"custom_id": customId, "component_type": componentType, "values": list(values)},
+            "message": message, "locale": "en-US", "guild_locale": "en-US", "app_permissions": "0", "entitlements": [],
+            "authorizing_integration_owners": {"0": str(guildId)}, "context": 0}, guildId)
+
+
+    # REST
+
+    def isMemberEditRateLimited(self, guildId:int) -> tuple:
+        # (rate limited, remaining, reset after), using a fixed window per guild.
+        now = time.monotonic()
+        windowStart, calls = self.memberEditWindows.get(guildId, (now, 0))
+        if now - windowStart >= self.memberEditWindow:
+            windowStart, calls = now, 0
+        resetAfter = self.memberEditWindow - (now - windowStart)
+        if calls >= self.memberEditLimit:
+            return (True, 0, resetAfter)
+        self.memberEditWindows[guildId] = (windowStart, calls + 1)
+        return (False, self.memberEditLimit - calls - 1, resetAfter)
+
+
+    async def handleRest(self, request:web.Request) -> web.Response:
+        path = "/" + request.match_info["path"]
+        route = request.method + " " + SNOWFLAKE.sub("/{id}", TOKEN.sub("/{token}", path))
+        self.restCalls[route] += 1
+        parts = path.strip("/").split("/")
+        payload = None
+        if request.can_read_body:
+            try:
+                payload = await request.json()
+            except ValueError:
+                payload = None
+
+        if path == "/users/@me":
+            return jsonResponse({**self.botUser(), "verified": True, "mfa_enabled": False, "locale": "en-US"})
+        if path == "/oauth2/applications/@me":
+            return jsonResponse({"id": str(self.botId), "name": "Role Provider", "icon": None, "description": "", "bot_public": True,
+                                      "bot_require_code_grant": False, "verify_key": "0", "summary": "", "flags": 0, "team": None, "owner": {**self.botUser(), "id": "1", "bot": False}})
+        if path == "/gateway" or path == "/gateway/bot":
+            return jsonResponse({"url": f"ws://{self.host}:{self.port}/gateway", "shards": self.shardCount,
+                                      "session_start_limit": {"total": 1000, "remaining": 1000, "reset_after": 0, "max_concurrency": 1}})
+        if parts[-1] == "commands":
+            return jsonResponse([])
+
+        if parts[0] == "interactions" and parts[-1] == "callback":
+            self.timings.markAcknowledged(int(parts[1]), parts[2], (payload or {}).get("type", CALLBACK_MESSAGE))
+            return web.Response(status=204)
+        if parts[0] == "webhooks":
+            # A followup (POST), or fetching or editing the original response (GET or PATCH on messages/@original).
+            if request.method in ("POST", "PATCH"):
+                self.timings.markResponded(parts[2])
+            return jsonResponse(self.message(content=(payload or {}).get("content")))
+
+        if parts[0] == "guilds" and len(parts) >= 4 and parts[2] == "members":
+            guildId, memberId = int(parts[1]), int(parts[3])
+            if self.memberEditLimit:
+                limited, remaining, resetAfter = self.isMemberEditRateLimited(guildId)
+                headers = {"X-RateLimit-Limit": str(self.memberEditLimit), "X-RateLimit-Remaining": str(remaining),
+                           "X-RateLimit-Reset-After": f"{resetAfter:.3f}", "X-RateLimit-Bucket": f"members{guildId}"}
+                if limited:
+                    self.rateLimited += 1
+                    return jsonResponse({"message": "You are being rate limited.", "retry_after": resetAfter, "global": False}, status=429, headers=headers)
+            else:
+                headers = {}
+            if self.memberEditLatency > 0:
+                await asyncio.sleep(self.memberEditLatency)
+            memberRoleIds = self.guilds[guildId].memberRoleIds.setdefault(memberId, set())
+            if len(parts) == 6 and parts[4] == "roles":
+                # Adding or removing a single role.
+                if request.method == "PUT":
+                    memberRoleIds.add(int(parts[5]))
+                else:
+                    memberRoleIds.discard(int(parts[5]))
+                return web.Response(status=204, headers=headers)
+            if request.method == "PATCH" and payload and "roles" in payload:
+                memberRoleIds.clear()
+                memberRoleIds.update(int(roleId) for roleId in payload["roles"])
+            return jsonResponse({"user": {"id": str(memberId), "username": f"member{memberId}", "discriminator": "0", "avatar": None},
+                                      "roles": [str(roleId) for roleId in memberRoleIds], "joined_at": timestamp(),
+                                      "deaf": False, "mute": False, "flags": 0}, headers=headers)
+
+        if parts[0] == "channels" and parts[-1] == "messages" and request.method == "POST":
+            return jsonResponse(self.message(int(parts[1])))
+
+        # Anything else we don't model, we just accept.
+        self.log.debug(f"Unmodelled route: {route}")
+        return jsonResponse({})
@@ -0,0 +1,214 @@
+"""
+Fakes
+~~~~~
+
+Lightweight stand-ins for the Discord objects our Extensions use (guilds, members, roles, contexts and the client), so
+they can be driven offline without a gateway connection. Every request that would have gone to Discord is counted
+instead, by endpoint, on a shared RestRecorder.
+"""
+
+import Components
+
+import interactions
+
+from collections import Counter
+from types import SimpleNamespace
+
+
+class RestRecorder:
+
+    # Counts the REST calls the fakes would have made, e.g. {"addRole": 3, "interactionResponse": 5}.
+
+
+    def __init__(self) -> None:
+        self.calls = Counter()
+
+
+    def record(self, endpoint:str) -> None:
+        self.calls[endpoint] += 1
+
+
+    def total(self) -> int:
+        return sum(self.calls.values())
+
+
+    def reset(self) -> None:
+        self.calls.clear()
+
+
+class FakeRole:
+
+    __slots__ = ("id", "name", "position", "is_assignable", "default")
+
+
+    def __init__(self, roleId:int, name:str, position:int=1, assignable:bool=True, default:bool=False) -> None:
+        self.id = roleId
+        self.name = name
+        self.position = position
+        self.is_assignable = assignable
+        self.default = default
+
+
+class FakeChannel:
+
+    def __init__(self, rest:RestRecorder, channelId:int, name:str) -> None:
+        self.rest = rest
+        self.id = channelId
+        self.name = name
+
+
+    async def send(self, content:str=None, **kwargs) -> None:
+        self.rest.record("createMessage")
+
+
+class FakeGuild:
+
+    def __init__(self, rest:RestRecorder, guildId:int, name:str, roles:list=(), channels:list=()) -> None:
+        self.rest = rest
+        self.id = guildId
+        self.name = name
+        self.roleIds2Role = {role.id: role for role in roles}
+        self.channelIds2Channel = {channel.id: channel for channel in channels}
+        self.memberIds2Member = {} # Filled in by FakeMember.
+
+
+    @property
+    def roles(self) -> list:
+        return list(self.roleIds2Role.values())
+
+
+    def get_role(self, roleId:int) -> FakeRole | None:
+        return self.roleIds2Role.get(int(roleId))
+
+
+    def get_channel(self, channelId:int) -> FakeChannel | None:
+        return self.channelIds2Channel.get(int(channelId))
+
+
+    async def fetch_member(self, memberId:int, force:bool=False) -> "FakeMember | None":
+        self.rest.record("fetchMember")
+        return self.memberIds2Member.get(int(memberId))
+
+
+    def addRole(self, role:FakeRole) -> None:
+        self.roleIds2Role[role.id] = role
+
+
+    def deleteRole(self, roleId:int) -> None:
+        self.roleIds2Role.pop(roleId, None)
+
+
+class FakeMember:
+
+    # Also stands in for the member's User, as the Extensions only need an ID and names from it.
+    # Like interactions.Member, the roles are resolved from the guild by ID. Edit updates _role_ids, standing in for the
+    # member update Discord sends us afterwards.
+
+
+    def __init__(self, guild:FakeGuild, memberId:int, roleIds:list=()) -> None:
+        self.guild = guild
+        self.id = memberId
+        self.username = f"member{memberId}"
+        self.global_name = f"Member {memberId}"
+        self._role_ids = list(roleIds)
+        guild.memberIds2Member[memberId] = self
+
+
+    @property
+    def roles(self) -> list:
+        return [role for role in (self.guild.get_role(roleId) for roleId in self._role_ids) if role]
+
+
+    async def add_role(self, role, reason:str=None) -> None:
+        self.guild.rest.record("addRole")
+        if role.id not in self._role_ids:
+            self._role_ids.append(role.id)
+
+
+    async def remove_role(self, role, reason:str=None) -> None:
+        self.guild.rest.record("removeRole")
+        if role.id in self._role_ids:
+            self._role_ids.remove(role.id)
+
+
+    async def edit(self, roles:list=None, reason:str=None, **kwargs) -> None:
+        self.guild.rest.record("editMember")
+        if roles is not None:
+            self._role_ids = [int(roleId) for roleId in roles]
+
+
+class FakeContext:
+
+    # Covers both component and slash command contexts, recording each response as a REST call.
+
+
+    def __init__(self, guild:FakeGuild, member:FakeMember, customId:str="", componentType:interactions.ComponentType=None, options:list=(), values:list=()) -> None:
+        self.guild = guild
+        self.member = member
+        self.user = member
+        self.custom_id = customId
+        self.component_type = componentType
+        self.component = SimpleNamespace(options=[SimpleNamespace(value=value) for value in options])
+        self.values = list(values)
+        self.responses = []
+
+
+    async def send(self, content:str=None, **kwargs) -> None:
+        self.guild.rest.record("interactionResponse")
+        self.responses.append((content, kwargs))
+
+
+    async def defer(self, ephemeral:bool=False, **kwargs) -> None:
+        self.guild.rest.record("interactionResponse")
+
+
+    async def edit(self, content:str=None, **kwargs) -> None:
+        self.guild.rest.record("editInteractionResponse")
+        self.responses.append((content, kwargs))
+
+
+class FakeComponentEvent:
+
+    def __init__(self, ctx:FakeContext) -> None:
+        self.ctx = ctx
+
+
+class FakeBucketLock:
+
+    # What the client's HTTP rate limit lookup returns before Discord has sent us any rate limit headers.
+
+    bucket_hash = None
+    limit = 1
+    remaining = 1
+    delta = 0.0
+
+
+class FakeClient:
+
+    # Just enough of interactions.Client for an Extension to be loaded into it. Commands and listeners are accepted
+    # but never run by us, the benchmark calls the Extension directly.
+
+
+    def __init__(self, guilds:list=()) -> None:
+        self.ext = {}
+        self.async_startup_tasks = []
+        self.guilds = list(guilds)
+        self.latency = 0.0
+        self.componentRouter = Components.ComponentRouter()
+        self.http = SimpleNamespace(get_ratelimit=lambda route: FakeBucketLock())
+
+
+    def add_command(self, command) -> None:
+        pass
+
+
+    def add_listener(self, listener) -> None:
+        pass
+
+
+    def add_global_autocomplete(self, autocomplete) -> None:
+        pass
+
+
+    def dispatch(self, event) -> None:
+        pass
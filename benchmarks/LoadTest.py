@@ -0,0 +1,367 @@
+"""
+Load Test
+~~~~~~~~~
+
+Runs the real bot (RPBotClient, with every Extension) against FakeDiscord, a local stand-in for Discord's gateway and
+HTTP API, then replays a stream of "Get roles..." button presses and role selections across many guilds. Nothing
+leaves this machine, so it can run headless before every deploy to catch latency cliffs and leaks.\n
+    python benchmarks/LoadTest.py --guilds 1000 --rate 15 --duration 60 [--trace trace.jsonl] [--record trace.jsonl] [--json report.json]\n
+We report interaction ack and response latency (p50, p90, p99, max), REST calls made by route, how the guild cache
+(guildId2Db) and the process grow in memory over the run, and our own handler timings. With --max-p99-ms,
+--max-rss-growth-mib or --max-unanswered, we exit with status 1 if the run breaches them.
+
+interactions.py holds every REST call to 45 per second, so at about 2.5 calls per interaction the bot saturates at
+around 18 interactions per second. Past that, interactions queue up behind the limit and are still unanswered when the
+run ends, which is why our default rate is well below it.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import types
+from typing import NamedTuple
+
+
+REPO_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BOT_ID = 900000000000000001
+PAGE_SIZE = 25 # The options in our first selection list, which is what the synthetic selections pick from.
+
+
+class TraceEvent(NamedTuple):
+
+    # One interaction to replay: "at" seconds after the start, a member of a guild presses the button ("button") or
+    # selects a role from the first selection list ("select"). Guilds, members and roles are indexes, so a trace can
+    # be replayed against any number of guilds. A role of None clears the member's selection.
+
+    at: float
+    action: str
+    guild: int
+    member: int
+    role: int | None
+
+
+def generateTrace(duration:float, rate:float, guilds:int, members:int, roles:int, selectRatio:float, skew:float, seed:int) -> list:
+    # Poisson arrivals at the given rate. With a skew above 0, guilds are picked with a Zipf-like distribution, so a
+    # few busy guilds get most of the traffic like they do in production.
+    randomiser = random.Random(seed)
+    guildWeights = [1 / (index + 1) ** skew for index in range(guilds)]
+    trace = []
+    at = randomiser.expovariate(rate)
+    while at < duration:
+        guild = randomiser.choices(range(guilds), weights=guildWeights)[0] if skew > 0 else randomiser.randrange(guilds)
+        if randomiser.random() < selectRatio:
+            role = None if randomiser.random() < 0.1 else randomiser.randrange(min(roles, PAGE_SIZE))
+            trace.append(TraceEvent(at, "select", guild, randomiser.randrange(members), role))
+        else:
+            trace.append(TraceEvent(at, "button", guild, randomiser.randrange(members), None))
+        at += randomiser.expovariate(rate)
+    return trace
+
+
+def loadTrace(path:str) -> list:
+    with open(path, "r") as traceFile:
+        return [TraceEvent(**json.loads(line)) for line in traceFile if line.strip()]
+
+
+def saveTrace(path:str, trace:list) -> None:
+    with open(path, "w") as traceFile:
+        for event in trace:
+            traceFile.write(json.dumps(event._asdict()) + "\n")
+
+
+def getDeepSize(root) -> int:
+    # The memory used by an object and everything it references (but not classes, modules or functions).
+    seen = set()
+    stack = [root]
+    total = 0
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, (type, types.ModuleType, types.FunctionType, types.MethodType)):
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        else:
+            stack.extend(getattr(obj, slot) for slot in getattr(type(obj), "__slots__", ()) if hasattr(obj, slot))
+            if hasattr(obj, "__dict__"):
+                stack.append(obj.__dict__)
+    return total
+
+
+def getRss() -> int:
+    # The process' resident memory in bytes. /proc is Linux only, elsewhere we fall back to the peak.
+    try:
+        with open("/proc/self/statm", "r") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def getPercentiles(values) -> dict:
+    # Latencies in milliseconds.
+    if not values:
+        return {"count": 0, "p50": None, "p90": None, "p99": None, "max": None}
+    ordered = sorted(values)
+    percentile = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000
+    return {"count": len(ordered), "p50": percentile(0.5), "p90": percentile(0.9), "p99": percentile(0.99), "max": ordered[-1] * 1000}
+
+
+class LoadTest:
+
+
+    def __init__(self, arguments:argparse.Namespace, trace:list) -> None:
+        self.arguments = arguments
+        self.trace = trace
+        self.samples = [] # (seconds since start, cached guilds, guildId2Db bytes, process RSS bytes)
+        self.client = None
+        self.extension = None
+
+        # Every guild gets a block of IDs: the guild, its roles channel, then its roles and members.
+        self.guildStates = []
+        for index in range(arguments.guilds):
+            guildId = 100000000000000000 + index * 100000
+            roleIds = [guildId + 10 + roleIndex for roleIndex in range(arguments.roles)]
+            self.guildStates.append(FakeDiscord.FakeGuildState(guildId, roleIds, guildId + 1))
+        self.fakeDiscord = FakeDiscord.FakeDiscord(BOT_ID, self.guildStates, memberEditLimit=arguments.member_edit_limit, memberEditWindow=arguments.member_edit_window,
+                                                 memberEditLatency=arguments.member_edit_latency)
+
+
+    def getMemberId(self, guildState:"FakeDiscord.FakeGuildState", member:int) -> int:
+        return guildState.guildId + 50000 + member
+
+
+    def seedDatabases(self) -> None:
+        # Every guild starts with its roles channel set and all of its roles in the selection list.
+        storage = Storage.YamlStorage(directory="databases")
+        for guildState in self.guildStates:
+            storage.writeGuild(guildState.guildId, {"Roles": {"RoleSelectionList": {"PublicList": [str(roleId) for roleId in guildState.roleIds]}},
+                                                    "Channels": {"RolesChannel": {"ChannelID": str(guildState.channelId)}}})
+        storage.executor.shutdown()
+
+
+    async def startBot(self) -> None:
+        await self.fakeDiscord.start()
+        Route.BASE = self.fakeDiscord.apiBase
+        self.client = Main.RPBotClient(command_prefix=config.commandPrefix, intents=interactions.Intents.DEFAULT)
+        # There's no point syncing slash commands with our fake Discord.
+        self.client.sync_interactions = False
+        logging.getLogger("interactions").setLevel(logging.WARNING)
+        self.botTask = asyncio.create_task(self.client.astart(config.token))
+
+        # Wait until the bot has connected, received every guild and loaded its Extensions.
+        startedAt = time.perf_counter()
+        while self.client.get_ext("RoleSelection") is None:
+            if self.botTask.done():
+                self.botTask.result() # The bot failed to start, raise why.
+            if time.perf_counter() - startedAt > self.arguments.startup_timeout:
+                raise TimeoutError("The bot didn't load the RoleSelection Extension in time.")
+            await asyncio.sleep(0.05)
+        self.extension = self.client.get_ext("RoleSelection")
+        print(f"Bot started with {len(self.guildStates)} guilds in {time.perf_counter() - startedAt:.1f} s.")
+
+
+    async def stopBot(self) -> None:
+        # Cancelling astart stops the bot from its own finally block, which closes the gateway before the HTTP session.
+        # Calling client.stop ourselves closes the HTTP session first, which leaves the gateway spinning.
+        # Stopping also shuts our Extensions down, which lets their handlers finish before closing storage.
+        self.botTask.cancel()
+        await asyncio.gather(self.botTask, return_exceptions=True)
+        await self.fakeDiscord.stop()
+
+
+    def sample(self, startedAt:float) -> None:
+        guildId2Db = self.extension.guildId2Db
+        self.samples.append((time.perf_counter() - startedAt, len(guildId2Db), getDeepSize(guildId2Db.entries), getRss()))
+
+
+    async def sampleMemory(self, startedAt:float) -> None:
+        # Walking the cache stalls the event loop for a moment, so we don't do it too often.
+        while True:
+            self.sample(startedAt)
+            await asyncio.sleep(self.arguments.sample_interval)
+
+
+    async def replay(self, startedAt:float) -> None:
+        for event in self.trace:
+            # Interactions are timed from when they were due, not when we got round to sending them, so the event loop
+            # falling behind shows up in our latencies rather than hiding them.
+            dueAt = startedAt + event.at
+            delay = dueAt - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            guildState = self.guildStates[event.guild % len(self.guildStates)]
+            memberId = self.getMemberId(guildState, event.member)
+            if event.action == "button":
+                await self.fakeDiscord.sendInteraction(guildState.guildId, memberId, f"roleSelection-{guildState.guildId}-0", 2, sentAt=dueAt)
+            else:
+                pageRoleIds = [str(roleId) for roleId in guildState.roleIds[:PAGE_SIZE]]
+                values = [] if event.role is None else [pageRoleIds[event.role % len(pageRoleIds)]]
+                await self.fakeDiscord.sendInteraction(guildState.guildId, memberId, f"roleSelection-{guildState.guildId}-1", 3, values, pageRoleIds, sentAt=dueAt)
+
+
+    async def waitForResponses(self) -> None:
+        # Give anything still in flight a little longer to be answered.
+        waitUntil = time.perf_counter() + self.arguments.grace
+        while self.fakeDiscord.timings.sentAt and time.perf_counter() < waitUntil:
+            await asyncio.sleep(0.05)
+
+
+    async def run(self) -> dict:
+        self.seedDatabases()
+        await self.startBot()
+        try:
+            startedAt = time.perf_counter()
+            sampler = asyncio.create_task(self.sampleMemory(startedAt))
+            await self.replay(startedAt)
+            await self.waitForResponses()
+            elapsed = time.perf_counter() - startedAt
+            sampler.cancel()
+            self.sample(startedAt)
+            return self.getReport(elapsed)
+        finally:
+            await self.stopBot()
+
+
+    def getReport(self, elapsed:float) -> dict:
+        timings = self.fakeDiscord.timings
+        restCalls = dict(self.fakeDiscord.restCalls.most_common())
+        interactionCalls = sum(count for route, count in restCalls.items() if "/interactions/" in route or "/webhooks/" in route or "/guilds/{id}/members/" in route)
+        # Leaks show up as growth after the cache has warmed up, so we compare the middle of the run with the end.
+        middle = self.samples[len(self.samples) // 2]
+        last = self.samples[-1]
+        handlers = {labels["handler"]: {"count": histogram.count, "p50": histogram.quantile(0.5) * 1000, "p99": histogram.quantile(0.99) * 1000}
+                    for labels, histogram in Metrics.registry.getHistograms("handler_seconds")}
+        return {"duration": elapsed,
+                "interactions": len(self.trace),
+                "rate": len(self.trace) / elapsed,
+                "guilds": len(self.guildStates),
+                "ackLatencyMs": getPercentiles(timings.ackLatencies),
+                "responseLatencyMs": getPercentiles(timings.responseLatencies),
+                "unanswered": len(timings.sentAt),
+                "restCalls": restCalls,
+                "restCallsPerInteraction": interactionCalls / max(len(self.trace), 1),
+                "rateLimited": self.fakeDiscord.rateLimited,
+                "handlersMs": handlers,
+                "memorySamples": [{"at": at, "cachedGuilds": cachedGuilds, "guildCacheBytes": cacheBytes, "rssBytes": rss} for at, cachedGuilds, cacheBytes, rss in self.samples],
+                "guildCacheGrowthBytes": last[2] - middle[2],
+                "rssGrowthBytes": last[3] - middle[3]}
+
+
+def formatLatencies(latencies:dict) -> str:
+    if not latencies["count"]:
+        return "no data"
+    return f"p50 {latencies['p50']:.1f}  p90 {latencies['p90']:.1f}  p99 {latencies['p99']:.1f}  max {latencies['max']:.1f}  ({latencies['count']})"
+
+
+def printReport(report:dict) -> None:
+    first, last = report["memorySamples"][0], report["memorySamples"][-1]
+    print(f"\n{report['interactions']} interactions in {report['duration']:.1f} s ({report['rate']:.1f}/s) across {report['guilds']} guilds")
+    print(f"Ack latency (ms):       {formatLatencies(report['ackLatencyMs'])}")
+    print(f"Response latency (ms):  {formatLatencies(report['responseLatencyMs'])}")
+    print(f"Unanswered:             {report['unanswered']}")
+    print(f"REST calls:             {report['restCallsPerInteraction']:.2f} per interaction, {report['rateLimited']} rate limited")
+    for route, count in report["restCalls"].items():
+        print(f"    {count:>8}  {route}")
+    print("Handlers (ms):")
+    for handler, timings in report["handlersMs"].items():
+        print(f"    {handler:<20} p50 {timings['p50']:.2f}  p99 {timings['p99']:.2f}  ({timings['count']})")
+    print(f"guildId2Db:             {first['cachedGuilds']} -> {last['cachedGuilds']} guilds, {first['guildCacheBytes'] / 1024:.0f} -> {last['guildCacheBytes'] / 1024:.0f} KiB"
+          f" ({report['guildCacheGrowthBytes'] / 1024:+.0f} KiB in the second half)")
+    print(f"Process RSS:            {first['rssBytes'] / 2**20:.1f} -> {last['rssBytes'] / 2**20:.1f} MiB ({report['rssGrowthBytes'] / 2**20:+.1f} MiB in the second half)")
+
+
+def checkThresholds(report:dict, arguments:argparse.Namespace) -> list:
+    failures = []
+    p99 = report["responseLatencyMs"]["p99"]
+    if arguments.max_p99_ms is not None and (p99 is None or p99 > arguments.max_p99_ms):
+        failures.append(f"Response p99 of {p99} ms is over the {arguments.max_p99_ms} ms limit.")
+    if arguments.max_rss_growth_mib is not None and report["rssGrowthBytes"] / 2**20 > arguments.max_rss_growth_mib:
+        failures.append(f"RSS grew by {report['rssGrowthBytes'] / 2**20:.1f} MiB in the second half, over the {arguments.max_rss_growth_mib} MiB limit.")
+    if arguments.max_unanswered is not None and report["unanswered"] > arguments.max_unanswered:
+        # They may just be queued behind the REST rate limit rather than lost, either way the bot didn't keep up.
+        failures.append(f"{report['unanswered']} interactions were still unanswered at the end of the run, over the limit of {arguments.max_unanswered}.")
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the bot against a local fake Discord.")
+    parser.add_argument("--guilds", type=int, default=100, help="How many guilds the bot is in.")
+    parser.add_argument("--roles", type=int, default=25, help="How many roles are in each guild's selection list.")
+    parser.add_argument("--members", type=int, default=1000, help="How many members interact in each guild.")
+    parser.add_argument("--rate", type=float, default=10.0, help="Interactions per second, for synthetic traces. The bot saturates at around 18.")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds of synthetic trace to generate.")
+    parser.add_argument("--select-ratio", type=float, default=0.5, help="The fraction of interactions that are role selections rather than button presses.")
+    parser.add_argument("--skew", type=float, default=1.0, help="How unevenly traffic is spread across guilds, 0 for evenly.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for generating synthetic traces.")
+    parser.add_argument("--trace", help="Replay this JSON lines trace instead of generating one.")
+    parser.add_argument("--record", help="Save the trace we replay to this file.")
+    parser.add_argument("--scheduler", action="store_true", help="Use the role mutation scheduler.")
+    parser.add_argument("--member-edit-limit", type=int, default=0, help="Rate limit member role changes to this many per guild per window, 0 for no limit.")
+    parser.add_argument("--member-edit-window", type=float, default=1.0, help="The member role change rate limit window in seconds.")
+    parser.add_argument("--member-edit-latency", type=float, default=0.0, help="Seconds every member role change takes.")
+    parser.add_argument("--fast-ack", action="store_true", help="Acknowledge role selections before applying them.")
+    parser.add_argument("--cache-size", type=int, default=None, help="Override guildCacheSize.")
+    parser.add_argument("--sample-interval", type=float, default=5.0, help="Seconds between memory samples.")
+    parser.add_argument("--grace", type=float, default=5.0, help="Seconds to wait for outstanding responses at the end.")
+    parser.add_argument("--startup-timeout", type=float, default=120.0, help="Seconds to wait for the bot to start.")
+    parser.add_argument("--max-p99-ms", type=float, default=None, help="Fail if the response p99 is over this.")
+    parser.add_argument("--max-rss-growth-mib", type=float, default=None, help="Fail if the process grows by more than this in the second half of the run.")
+    parser.add_argument("--max-unanswered", type=int, default=None, help="Fail if more than this many interactions are still unanswered at the end of the run.")
+    parser.add_argument("--log-level", default="WARNING", help="The bot's log level.")
+    parser.add_argument("--json", help="Also write the report to this file.")
+    arguments = parser.parse_args()
+
+    trace = loadTrace(arguments.trace) if arguments.trace else generateTrace(arguments.duration, arguments.rate, arguments.guilds, arguments.members,
+                                                                             arguments.roles, arguments.select_ratio, arguments.skew, arguments.seed)
+    if arguments.record:
+        saveTrace(arguments.record, trace)
+    jsonPath = os.path.abspath(arguments.json) if arguments.json else None
+
+    # BotGlobals reads Config.json from the working directory, so we run in a temporary one with a config of our own.
+    # The bot's YAML databases are written there too.
+    botConfig = {"userId": BOT_ID, "token": "loadtest", "useMongoDb": False, "logLevel": arguments.log_level,
+                 "roleMutationScheduler": arguments.scheduler, "fastAckRoleSelection": arguments.fast_ack}
+    if arguments.cache_size:
+        botConfig["guildCacheSize"] = arguments.cache_size
+    workDirectory = tempfile.mkdtemp(prefix="LoadTest")
+    with open(os.path.join(workDirectory, "Config.json"), "w") as configFile:
+        json.dump(botConfig, configFile)
+    os.chdir(workDirectory)
+    sys.path.insert(0, REPO_DIRECTORY)
+
+    import BotGlobals as config
+    import Main
+    import Metrics
+    import Storage
+    import Utils
+    import FakeDiscord
+
+    import interactions
+    from interactions.api.http.route import Route
+
+    Utils.configureLogging(config.logLevel)
+    try:
+        report = asyncio.run(LoadTest(arguments, trace).run())
+        printReport(report)
+        if jsonPath:
+            with open(jsonPath, "w") as reportFile:
+                json.dump(report, reportFile, indent=4)
+        failures = checkThresholds(report, arguments)
+        for failure in failures:
+            print(f"FAILED: {failure}")
+    finally:
+        os.chdir(REPO_DIRECTORY)
+        shutil.rmtree(workDirectory, ignore_errors=True)
+    sys.exit(1 if failures else 0)
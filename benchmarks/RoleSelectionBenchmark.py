@@ -0,0 +1,301 @@
+"""
+Role Selection Benchmark
+~~~~~~~~~~~~~~~~~~~~~~~~
+
+Offline benchmarks for the RoleSelection Extension's hot paths, driven with the fake Discord objects in Fakes.py, so
+no bot token or network is needed. Run this from the repository root and compare the results before and after any
+change to the Extension:\n
+    python benchmarks/RoleSelectionBenchmark.py [--storage memory|yaml|sqlite] [--quick] [--json results.json]\n
+For each scenario we report throughput, the memory allocated (peak, and retained per operation, from tracemalloc),
+how many REST calls would have been made to Discord, and how many storage loads and saves were made.
+"""
+
+import argparse
+import asyncio
+import functools
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+
+REPO_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ROLE_COUNTS = (1, 10, 25, 100, 250, 500, 1000)
+GUILD_COUNTS = (1, 100, 1000, 10000)
+QUICK_ROLE_COUNTS = (1, 25, 100)
+QUICK_GUILD_COUNTS = (1, 100, 1000)
+MEMBERS_PER_GUILD = 100
+ROLES_PER_GUILD = 5 # For the guild count scenarios, where the role list size isn't what we're measuring.
+
+
+class BenchmarkGuild:
+
+    # A fake guild with a role selection list of roleCount roles, a roles channel and a pool of members, half of which
+    # already have one of the roles in the list.
+
+
+    def __init__(self, rest, guildId:int, roleCount:int) -> None:
+        roles = [Fakes.FakeRole(guildId * 10000 + index + 1, f"Role {index + 1}", position=index + 1) for index in range(roleCount + 1)]
+        self.listRoles = roles[:roleCount]
+        self.spareRole = roles[roleCount] # Not in the list, for the add and remove commands.
+        self.channel = Fakes.FakeChannel(rest, guildId * 10000, "roles")
+        self.guild = Fakes.FakeGuild(rest, guildId, f"Guild {guildId}", roles, [self.channel])
+        self.members = [Fakes.FakeMember(self.guild, guildId * 10000 + 5000 + index,
+                                         [self.listRoles[index % roleCount].id] if index % 2 else [])
+                        for index in range(MEMBERS_PER_GUILD)]
+
+
+    def storedDb(self) -> dict:
+        return {"Roles": {"RoleSelectionList": {"PublicList": [str(role.id) for role in self.listRoles]}},
+                "Channels": {"RolesChannel": {"ChannelID": str(self.channel.id)}}}
+
+
+class Harness:
+
+    # A RoleSelection Extension loaded into a fake client, with guildCount guilds saved in the chosen storage backend.
+
+
+    def __init__(self, storageKind:str, guildCount:int, roleCount:int) -> None:
+        self.storageKind = storageKind
+        self.rest = Fakes.RestRecorder()
+        self.guilds = [BenchmarkGuild(self.rest, 100000 + index, roleCount) for index in range(guildCount)]
+        self.client = Fakes.FakeClient([benchmarkGuild.guild for benchmarkGuild in self.guilds])
+        if storageKind == "yaml":
+            self.storage = Storage.YamlStorage(directory=os.path.join(os.getcwd(), "databases"), workers=config.storageWorkers)
+        elif storageKind == "sqlite":
+            self.storage = Storage.SqliteStorage(os.path.join(os.getcwd(), "databases", "RoleProvider.sqlite3"), workers=config.storageWorkers)
+        else:
+            self.storage = Storage.MemoryStorage()
+        self.extension = None
+
+
+    async def start(self) -> None:
+        await asyncio.gather(*[self.storage.saveSections(benchmarkGuild.guild.id, benchmarkGuild.storedDb(), set(Storage.SECTION_PATHS))
+                               for benchmarkGuild in self.guilds])
+        self.extension = RoleSelection.RoleSelection(self.client)
+        # Swap in our storage backend, so every scenario starts from the guilds we saved above.
+        await self.extension.storage.close()
+        self.extension.storage = self.storage
+        self.extension.writeQueue = Storage.WriteBehindQueue(self.storage, config.writeBehindWindow)
+
+
+    async def stop(self) -> None:
+        await self.extension.closeStorage()
+
+
+    def getStorageCounts(self) -> tuple:
+        # (loads, saves), as counted by our storage metrics.
+        return (sum(histogram.count for labels, histogram in Metrics.registry.getHistograms("storage_seconds") if labels.get("operation") == "load"),
+                sum(histogram.count for labels, histogram in Metrics.registry.getHistograms("storage_seconds") if labels.get("operation") == "save"))
+
+
+    def buttonEvent(self, benchmarkGuild:BenchmarkGuild, member) -> "Fakes.FakeComponentEvent":
+        ctx = Fakes.FakeContext(benchmarkGuild.guild, member, self.extension.getUniqueId(benchmarkGuild.guild.id, 0), interactions.ComponentType.BUTTON)
+        return Fakes.FakeComponentEvent(ctx)
+
+
+    def selectionEvent(self, benchmarkGuild:BenchmarkGuild, member, selectedRole) -> "Fakes.FakeComponentEvent":
+        pageRoles = benchmarkGuild.listRoles[:25]
+        ctx = Fakes.FakeContext(benchmarkGuild.guild, member, self.extension.getUniqueId(benchmarkGuild.guild.id, 1), interactions.ComponentType.STRING_SELECT,
+                                options=[str(role.id) for role in pageRoles], values=[str(selectedRole.id)] if selectedRole else [])
+        return Fakes.FakeComponentEvent(ctx)
+
+
+    def commandContext(self, benchmarkGuild:BenchmarkGuild) -> "Fakes.FakeContext":
+        return Fakes.FakeContext(benchmarkGuild.guild, benchmarkGuild.members[0])
+
+
+    async def runCommand(self, command, *args) -> None:
+        # Slash command callbacks stay bound to the first Extension instance they were loaded into, so we call the
+        # underlying function with ours.
+        callback = command.callback.func if isinstance(command.callback, functools.partial) else command.callback
+        await callback(self.extension, *args)
+
+
+    def evictAll(self) -> None:
+        # Forget every cached guild and role menu, so the next press in each guild is cold again.
+        for benchmarkGuild in self.guilds:
+            self.extension.guildId2Db.evict(benchmarkGuild.guild.id)
+            self.extension.roleMenus.invalidate(benchmarkGuild.guild.id)
+
+
+    async def click(self, index:int) -> None:
+        # A member presses "Get roles...", spread across every guild.
+        benchmarkGuild = self.guilds[index % len(self.guilds)]
+        await self.client.componentRouter.dispatch(self.buttonEvent(benchmarkGuild, benchmarkGuild.members[index % MEMBERS_PER_GUILD]))
+
+
+    async def select(self, index:int) -> None:
+        # A member selects a role from the first page, or clears their selection every fourth time.
+        benchmarkGuild = self.guilds[index % len(self.guilds)]
+        pageRoles = benchmarkGuild.listRoles[:25]
+        selectedRole = None if index % 4 == 3 else pageRoles[index % len(pageRoles)]
+        await self.client.componentRouter.dispatch(self.selectionEvent(benchmarkGuild, benchmarkGuild.members[index % MEMBERS_PER_GUILD], selectedRole))
+
+
+    async def addRemoveRole(self, index:int) -> None:
+        # Staff add a role to the list, then remove it again.
+        benchmarkGuild = self.guilds[index % len(self.guilds)]
+        command = self.extension.addRoleToLIst if (index // len(self.guilds)) % 2 == 0 else self.extension.removeRoleFromLIst
+        await self.runCommand(command, self.commandContext(benchmarkGuild), benchmarkGuild.spareRole)
+
+
+    async def setRolesChannel(self, index:int) -> None:
+        benchmarkGuild = self.guilds[index % len(self.guilds)]
+        await self.runCommand(self.extension.setRolesChannel, self.commandContext(benchmarkGuild), benchmarkGuild.channel)
+
+
+    async def sendRoleButton(self, index:int) -> None:
+        benchmarkGuild = self.guilds[index % len(self.guilds)]
+        await self.runCommand(self.extension.sendRoleButton, self.commandContext(benchmarkGuild))
+
+
+async def measure(harness:Harness, scenario:str, size:int, operation, iterations:int, allocationIterations:int) -> dict:
+
+    # Time the operation, then run it again under tracemalloc (unless allocationIterations is 0), which is too slow to
+    # leave on while timing.
+
+    harness.rest.reset()
+    loadsBefore, savesBefore = harness.getStorageCounts()
+    startedAt = time.perf_counter()
+    for index in range(iterations):
+        await operation(index)
+    elapsed = time.perf_counter() - startedAt
+    # Anything still in the write-behind queue is written now, so its saves are counted.
+    await harness.extension.writeQueue.flush()
+    loadsAfter, savesAfter = harness.getStorageCounts()
+    restCalls = dict(harness.rest.calls)
+
+    peakKib = retainedBytesPerOp = None
+    if allocationIterations > 0:
+        tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+        for index in range(iterations, iterations + allocationIterations):
+            await operation(index)
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        await harness.extension.writeQueue.flush()
+        peakKib = (peak - baseline) / 1024
+        retainedBytesPerOp = (current - baseline) / allocationIterations
+
+    return {"scenario": scenario,
+            "size": size,
+            "iterations": iterations,
+            "opsPerSecond": iterations / elapsed,
+            "microsecondsPerOp": elapsed / iterations * 1e6,
+            "restCallsPerOp": sum(restCalls.values()) / iterations,
+            "restCalls": restCalls,
+            "storageLoads": loadsAfter - loadsBefore,
+            "storageSaves": savesAfter - savesBefore,
+            "peakKib": peakKib,
+            "retainedBytesPerOp": retainedBytesPerOp}
+
+
+async def benchmarkRoleCounts(storageKind:str, roleCounts:tuple, iterations:int, allocationIterations:int) -> list:
+    # The button, selection and staff commands in a single guild, for each size of role selection list.
+    results = []
+    for roleCount in roleCounts:
+        harness = Harness(storageKind, 1, roleCount)
+        await harness.start()
+        await harness.click(0) # Load the guild and build its role menu, so we measure the warm path.
+        for scenario, operation in (("button", harness.click),
+                                    ("select", harness.select),
+                                    ("addremoverole", harness.addRemoveRole),
+                                    ("setroleschannel", harness.setRolesChannel),
+                                    ("sendrolebutton", harness.sendRoleButton)):
+            results.append(await measure(harness, scenario, roleCount, operation, iterations, allocationIterations))
+            printResult(results[-1])
+        await harness.stop()
+    return results
+
+
+async def benchmarkGuildCounts(storageKind:str, guildCounts:tuple, iterations:int, allocationIterations:int) -> list:
+    # Button presses spread across many guilds. The first press in each guild loads it from storage (cold), after that
+    # it's served from our cache (warm). We also report how much memory each cached guild costs.
+    results = []
+    for guildCount in guildCounts:
+        harness = Harness(storageKind, guildCount, ROLES_PER_GUILD)
+        await harness.start()
+
+        result = await measure(harness, "button-cold", guildCount, harness.click, guildCount, 0)
+        result["cachedGuilds"] = len(harness.extension.guildId2Db)
+
+        # Load every guild again under tracemalloc, to see how much memory our caches hold per guild.
+        harness.evictAll()
+        tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+        for index in range(guildCount):
+            await harness.click(index)
+        result["bytesPerCachedGuild"] = (tracemalloc.get_traced_memory()[0] - baseline) / guildCount
+        tracemalloc.stop()
+        results.append(result)
+        printResult(result)
+
+        results.append(await measure(harness, "button-warm", guildCount, harness.click, max(iterations, guildCount), allocationIterations))
+        printResult(results[-1])
+        await harness.stop()
+    return results
+
+
+def printHeader() -> None:
+    print(f"{'scenario':<16}{'size':>7}{'ops/s':>12}{'us/op':>10}{'REST/op':>9}{'loads':>7}{'saves':>7}{'peak KiB':>10}{'kept B/op':>11}")
+
+
+def printResult(result:dict) -> None:
+    peakKib = "-" if result["peakKib"] is None else f"{result['peakKib']:.1f}"
+    retainedBytesPerOp = "-" if result["retainedBytesPerOp"] is None else f"{result['retainedBytesPerOp']:.1f}"
+    print(f"{result['scenario']:<16}{result['size']:>7}{result['opsPerSecond']:>12.0f}{result['microsecondsPerOp']:>10.1f}{result['restCallsPerOp']:>9.2f}"
+          f"{result['storageLoads']:>7}{result['storageSaves']:>7}{peakKib:>10}{retainedBytesPerOp:>11}")
+    if "bytesPerCachedGuild" in result:
+        print(f"    {result['cachedGuilds']} guilds cached, {result['bytesPerCachedGuild']:.0f} bytes per cached guild")
+
+
+async def runBenchmarks(arguments:argparse.Namespace) -> list:
+    printHeader()
+    roleCounts = QUICK_ROLE_COUNTS if arguments.quick else ROLE_COUNTS
+    guildCounts = QUICK_GUILD_COUNTS if arguments.quick else GUILD_COUNTS
+    results = await benchmarkRoleCounts(arguments.storage, roleCounts, arguments.iterations, arguments.allocation_iterations)
+    results += await benchmarkGuildCounts(arguments.storage, guildCounts, arguments.iterations, arguments.allocation_iterations)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the RoleSelection Extension.")
+    parser.add_argument("--storage", choices=["memory", "yaml", "sqlite"], default="memory", help="Where guild databases are stored. YAML and SQLite databases are written to a temporary directory.")
+    parser.add_argument("--iterations", type=int, default=1000, help="How many times each operation is timed.")
+    parser.add_argument("--allocation-iterations", type=int, default=200, help="How many times each operation is run under tracemalloc.")
+    parser.add_argument("--write-behind", type=float, default=0.0, help="The write-behind window in seconds, 0 writes every change through.")
+    parser.add_argument("--quick", action="store_true", help="Only run the smaller sizes.")
+    parser.add_argument("--json", help="Also write the results to this file, to compare against later runs.")
+    arguments = parser.parse_args()
+
+    # BotGlobals reads Config.json from the working directory, so we run in a temporary one with a config of our own.
+    # This also keeps any YAML or SQLite databases we write away from the real ones.
+    jsonPath = os.path.abspath(arguments.json) if arguments.json else None
+    workDirectory = tempfile.mkdtemp(prefix="RoleSelectionBenchmark")
+    with open(os.path.join(workDirectory, "Config.json"), "w") as configFile:
+        json.dump({"useMongoDb": False, "logLevel": "WARNING", "writeBehindWindow": arguments.write_behind}, configFile)
+    os.chdir(workDirectory)
+    sys.path.insert(0, REPO_DIRECTORY)
+
+    import BotGlobals as config
+    import Metrics
+    import Storage
+    import Utils
+    import Fakes
+    from extensions import RoleSelection
+
+    import interactions
+
+    Utils.configureLogging(config.logLevel)
+    try:
+        results = asyncio.run(runBenchmarks(arguments))
+        if jsonPath:
+            with open(jsonPath, "w") as resultsFile:
+                json.dump(results, resultsFile, indent=4)
+    finally:
+        os.chdir(REPO_DIRECTORY)
+        shutil.rmtree(workDirectory, ignore_errors=True)
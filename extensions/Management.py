@@ -2,9 +2,10 @@
 Management
 ~~~~~~~~~~
 
-This Extension can be used for administrative commands, but for now just contains the \"ping\" command.
+This Extension can be used for administrative commands, such as the \"ping\" and \"stats\" commands.
 """
 
+import Metrics
 import Utils
 
 import interactions
@@ -38,4 +39,43 @@ class Management(interactions.Extension):
         latency = int(self.client.latency*1000)
         
         self.log.print(f"Server staff member requsted bot latecy. Latency: {latency} ms.")
-        await ctx.send(f"Pong! Client latency: {latency} ms", ephemeral=True)
\ No newline at end of file
+        await ctx.send(f"Pong! Client latency: {latency} ms", ephemeral=True)
+
+
+    def formatTimings(self, name:str, label:str) -> str:
+        # One line per histogram: count, p50 and p99 in milliseconds, and errors if there were any.
+        lines = []
+        for labels, histogram in Metrics.registry.getHistograms(name):
+            errors = Metrics.registry.getCounter("errors_total", **labels)
+            line = f"`{labels.get(label, '?')}`: {histogram.count} calls, p50 {histogram.quantile(0.5)*1000:.1f} ms, p99 {histogram.quantile(0.99)*1000:.1f} ms"
+            if errors:
+                line += f", {errors} errors"
+            lines.append(line)
+        return "\n".join(lines) or "No data yet."
+
+
+    @interactions.slash_command(name="stats", description="Show bot performance statistics (bot owner only).", default_member_permissions=interactions.Permissions.MANAGE_WEBHOOKS)
+    async def stats(self, ctx: interactions.SlashContext) -> None:
+
+        # This command is for the bot owner to see where interaction time goes, using the metrics we collect in-process.
+        # Our metrics cover every guild we're in, so other guilds' staff members aren't allowed to see them.
+
+        if not await interactions.is_owner()(ctx):
+            await ctx.send(embed=interactions.Embed(title="Error", description="Only the bot owner can view bot statistics.", color=Utils.EmbedColours.error), ephemeral=True)
+            return
+
+        cacheLines = []
+        for labels, hits in Metrics.registry.getCounters("cache_hits_total"):
+            misses = Metrics.registry.getCounter("cache_misses_total", **labels)
+            cacheLines.append(f"`{labels['cache']}`: {hits / (hits + misses) * 100:.1f}% hit rate ({hits + misses} lookups)")
+        restLines = [f"`{labels['endpoint']}`: {value}" for labels, value in Metrics.registry.getCounters("rest_calls_total")]
+
+        statsEmbed = interactions.Embed(title="Statistics", color=Utils.EmbedColours.info)
+        statsEmbed.add_field(name="Handlers", value=self.formatTimings("handler_seconds", "handler"))
+        statsEmbed.add_field(name="Storage", value=self.formatTimings("storage_seconds", "operation"))
+        statsEmbed.add_field(name="Caches", value="\n".join(cacheLines) or "No data yet.")
+        statsEmbed.add_field(name="REST calls", value="\n".join(restLines) or "No data yet.")
+        statsEmbed.add_field(name="Gateway latency", value=f"{int(self.client.latency*1000)} ms")
+
+        self.log.print("Bot owner requested bot statistics.")
+        await ctx.send(embed=statsEmbed, ephemeral=True)
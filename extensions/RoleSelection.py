@@ -6,17 +6,23 @@ This Extension entirely handles role selection for users, and administrative com
 """
 
 import BotGlobals as config
+import Caching
+import Metrics
+import Scheduler
+import Storage
 import Utils
 
 import interactions
+from interactions.api.http.route import Route
 
-if config.useMongoDb:
-    import pymongo
-else:
-    import yaml
-
-import os
-import traceback
+import aiohttp
+import asyncio
+import fnmatch
+import io
+import json
+import math
+import re
+from typing import NamedTuple
 
 
 class RoleButton(interactions.Button):
@@ -44,6 +50,21 @@ class RoleList(interactions.StringSelectMenu):
         super().__init__(options, placeholder=f"Select a role (Page {pageNumber} of {totalPages})", min_values=0, max_values=1, custom_id=customId)
 
 
+ROLE_ID_PATTERN = re.compile(r"\d{15,20}") # Role IDs, on their own or in <@&roleId> mentions.
+MAX_IMPORT_SIZE = 1048576 # Bytes, far more than any role selection list needs.
+MAX_ROWS = 5 # Discord allows five action rows per message.
+MAX_CHOICES = 25 # And 25 autocomplete choices, or options per selection list.
+SHUTDOWN_TIMEOUT = 10 # Seconds we wait for acknowledged role selections while stopping, well within the launcher's limit.
+
+
+class RoleSelectionId(NamedTuple):
+
+    # A parsed "roleSelection-{guildId}-{number}" custom ID. Our button is number 0, our RoleLists are numbered from 1.
+
+    guildId: int
+    number: int
+
+
 class RoleSelection(interactions.Extension):
 
 
@@ -52,227 +73,814 @@ class RoleSelection(interactions.Extension):
 
     def __init__(self, client:interactions.Client) -> None:
 
-        # Create our dict, all of our guildIds are the keys, then the values are their respective database in dict format.
-        self.guildId2Db = self.loadDatabaseItems()
+        # Create our cache, all of our guildIds are the keys, then the values are their respective settings as a Storage.GuildConfig.
+        # Guilds are only loaded the first time they're used, so startup time and memory scale with active guilds.
+        self.storage = Storage.createStorage()
+        # Changes are written through to storage, or optionally queued and written in batches, see Storage.WriteBehindQueue. If another instance saved a guild
+        # since we loaded it, our changes are merged with theirs rather than overwriting them.
+        self.writeQueue = Storage.WriteBehindQueue(self.storage, config.writeBehindWindow, self.mergeStaleGuild)
+        self.guildId2Db = Caching.GuildCache(self.loadDatabaseItems, config.guildCacheSize, config.guildCacheTtl)
+        # Our resolved and paginated role selection lists, so the "Get roles..." button doesn't rebuild them on every click.
+        self.roleMenus = Caching.RoleMenuCache(config.guildCacheSize)
+        # Optionally, role changes are queued per guild and paced to Discord's rate limits, see Scheduler.RoleMutationScheduler.
+        self.roleScheduler = None
+        if config.roleMutationScheduler:
+            self.roleScheduler = Scheduler.RoleMutationScheduler(config.roleMutationRate, config.roleMutationBurst, self.getRouteRateLimit)
+
+        # Our buttons and selection lists are routed to us by the client, see Components.ComponentRouter.
+        self.client.componentRouter.register("roleSelection", interactions.ComponentType.BUTTON, self.handleButton, self.parseUniqueId)
+        self.client.componentRouter.register("roleSelection", interactions.ComponentType.STRING_SELECT, self.handleSelection, self.parseUniqueId)
+        self.client.componentRouter.register("rolePage", interactions.ComponentType.BUTTON, self.handlePageButton, self.parseUniqueId)
+
+        # Optionally, the guilds we had cached are saved to a snapshot file, so a restart can serve them straight away.
+        self.snapshotPath = None
+        self.snapshotTask = None
+        # Optionally, guilds changed by another instance are pulled in periodically, see refreshChangedGuilds.
+        self.refreshTask = None
+        self.changeToken = None
+        # Role selections being applied after we've acknowledged them, see handleSelection.
+        self.backgroundTasks = set()
+        # Roles deleted from a guild are removed from its role selection list in the background, see reconcileStaleRoles.
+        self.staleGuildIds = set()
+        self.staleRolesFound = asyncio.Event()
+        self.staleRoleTask = None
+        if config.guildSnapshotFile:
+            self.snapshotPath = Utils.getShardedPath(config.guildSnapshotFile, getattr(self.client, "shard_ids", None))
 
         self.log.print("Ready!")
 
 
+    async def startup(self) -> None:
+        # Called by our client once every Extension is loaded. Anything slow here runs in the background, so we can
+        # answer interactions as soon as possible.
+        if self.snapshotPath:
+            await self.loadSnapshot()
+            self.snapshotTask = asyncio.create_task(self.saveSnapshotPeriodically())
+        if config.preloadGuildDatabases:
+            asyncio.create_task(self.preloadDatabaseItems())
+        if config.guildRefreshInterval > 0:
+            self.refreshTask = asyncio.create_task(self.refreshPeriodically())
+        self.staleRoleTask = asyncio.create_task(self.reconcileStaleRoles())
+
+
     def drop(self) -> None:
         # This is called when the Extension is being dropped (unloaded).
         # If we need to do anything before unloading, we can do it here.
 
-        # There's nothing we need to do for now, so we'll just log that we're unloading.
+        # We write any changes still waiting in our write-behind queue, then close our storage backend so any
+        # connections or threads it holds are released.
         self.log.print("Unloading.")
+        self.client.componentRouter.unregister("roleSelection")
+        self.client.componentRouter.unregister("rolePage")
+        asyncio.create_task(self.shutdown())
         super().drop()
 
 
-    def loadDatabaseItems(self) -> dict:
-        # Here, we load our database items, whether that be from our mongo database or YAML database.
-        # This is a separate function from __init__() as we may need to call this again later.
+    async def shutdown(self) -> None:
+        # Called by our client as the bot stops, as well as when we're dropped, so nothing queued is lost either way.
+        if self.backgroundTasks:
+            # Let any role selections we've already acknowledged finish, but not for so long that we're killed before
+            # our changes are saved.
+            done, pending = await asyncio.wait(self.backgroundTasks, timeout=SHUTDOWN_TIMEOUT)
+            if pending:
+                # Anything that's left is cancelled, so nothing is still using storage once we close it.
+                self.log.warning(f"{len(pending)} role selections did not finish before shutting down, cancelling them.")
+                for task in pending:
+                    task.cancel()
+                await asyncio.wait(pending)
+        if self.roleScheduler:
+            # Any other selections still queued tell their users that they weren't applied.
+            await self.roleScheduler.close()
+        if self.refreshTask:
+            self.refreshTask.cancel()
+            self.refreshTask = None
+        if self.staleRoleTask:
+            self.staleRoleTask.cancel()
+            self.staleRoleTask = None
+        if self.snapshotTask:
+            self.snapshotTask.cancel()
+            self.snapshotTask = None
+            try:
+                await self.saveSnapshot()
+            except:
+                self.log.exception("Could not save the guild snapshot while unloading.")
+        await self.closeStorage()
+
 
-        self.log.print("Loading database items.")
+    async def closeStorage(self) -> None:
+        try:
+            await self.writeQueue.close()
+        except:
+            self.log.exception("Could not save pending database changes while unloading.")
+        await self.storage.close()
+
+
+    async def loadDatabaseItems(self, guildId:int) -> Storage.GuildConfig:
+        # Here, we load a guild's database items, whether that be from our mongo database or YAML database.
+        # Our GuildCache calls this whenever a guild is used that isn't cached yet.
+        pendingDb = self.writeQueue.getPending(guildId)
+        if pendingDb is not None:
+            # The guild was evicted with changes that haven't been written yet, so storage is out of date.
+            return pendingDb
+        with Metrics.timer("storage_seconds", operation="load"):
+            storedDb = await self.storage.loadGuild(guildId)
+        return Storage.GuildConfig.fromStorageFormat(storedDb)
+
+
+    async def preloadDatabaseItems(self) -> None:
+        # Optionally warm our cache with every guild we're in (up to the cache size) using a single bulk load.
+        # This is cheap with the consolidated Mongo schema, where it's one query no matter how many guilds we're in.
+        self.log.print("Preloading database items.")
+        try:
+            guildIds = [guild.id for guild in self.client.guilds if guild.id not in self.guildId2Db][:config.guildCacheSize]
+            with Metrics.timer("storage_seconds", operation="loadMany"):
+                guildId2Db = await self.storage.loadGuilds(guildIds)
+            for guildId, storedDb in guildId2Db.items():
+                # Anything loaded or changed while we were waiting is newer than what we fetched, so we leave it alone.
+                if guildId not in self.guildId2Db and guildId not in self.guildId2Db.loading and self.writeQueue.getPending(guildId) is None:
+                    self.guildId2Db.put(guildId, Storage.GuildConfig.fromStorageFormat(storedDb))
+            self.log.print(f"Preloaded {len(guildId2Db)} guilds.")
+        except:
+            # Not fatal, the guilds will just be loaded as they're used instead.
+            self.log.exception("Could not preload database items.")
+
+
+    async def mergeStaleGuild(self, guildId:int, guildDb:Storage.GuildConfig) -> None:
+        # Someone else saved this guild since the version we hold, so our save was rejected. We bring the guild up to date
+        # with what's stored while keeping our own changes (see Storage.mergeSections), so the save can be tried again.
+        # The guild is updated in place, as handlers may be holding on to it.
+        storedDb = Storage.GuildConfig.fromStorageFormat(await self.storage.loadGuild(guildId))
+        merged = Storage.mergeSections(guildDb.synced, guildDb.getSectionValues(), storedDb.synced)
+        guildDb.rolesChannelId = merged[Storage.ROLES_CHANNEL]
+        if tuple(guildDb.roleIds) != tuple(merged[Storage.ROLE_SELECTION_LIST]):
+            # A new list, so anything built from the old one is rebuilt.
+            guildDb.roleIds = Caching.OrderedRoleSet(merged[Storage.ROLE_SELECTION_LIST])
+        guildDb.version = storedDb.version
+        guildDb.synced = storedDb.synced
+
+
+    async def refreshChangedGuilds(self) -> int:
+        # Pull in the guilds another instance (or an admin script) has saved since we last checked, so we don't serve
+        # their old settings until they expire from our cache. Only guilds that were actually saved are loaded, and only
+        # cached guilds are updated, anything else is loaded fresh when it's next used. Returns how many were updated.
+        guildId2Db, self.changeToken = await self.storage.loadChangedSince(self.changeToken)
+        updated = 0
+        for guildId, storedDb in guildId2Db.items():
+            guildDb = self.guildId2Db.peek(guildId)
+            # Guilds we're saving will be merged with the stored version if they need to be, so we leave them alone.
+            if guildDb is None or self.writeQueue.getPending(guildId) is not None or Storage.getVersion(storedDb) <= guildDb.version:
+                continue
+            guildDb.copyFrom(Storage.GuildConfig.fromStorageFormat(storedDb))
+            updated += 1
+        return updated
+
+
+    async def refreshPeriodically(self) -> None:
+        try:
+            # Our first call only gets a token, so we only pull in changes made from now on.
+            await self.refreshChangedGuilds()
+        except NotImplementedError:
+            self.log.warning("Our storage backend can't find changed guilds, so guildRefreshInterval is ignored.")
+            return
+        except:
+            self.log.exception("Could not start refreshing changed guilds.")
+            return
+        while True:
+            await asyncio.sleep(config.guildRefreshInterval)
+            try:
+                updated = await self.refreshChangedGuilds()
+                if updated:
+                    self.log.print(f"Refreshed {updated} guilds changed elsewhere.")
+            except:
+                self.log.exception("Could not refresh changed guilds.")
+
+
+    def markStaleRoles(self, guildId:int) -> None:
+        # Have the guild's role selection list checked for deleted roles by our reconciler, rather than by whoever noticed.
+        self.staleGuildIds.add(guildId)
+        self.staleRolesFound.set()
+
+
+    async def removeStaleRoles(self, guildId:int) -> int:
+        # Remove every role from a cached guild's role selection list that no longer exists in the guild, with a single
+        # write for all of them. Returns how many were removed.
+        guildDb = self.guildId2Db.peek(guildId)
+        guild = self.client.get_guild(guildId)
+        if guildDb is None or guild is None or guild.unavailable:
+            # Either there's nothing cached to clean up, or we can't trust the guild's roles right now.
+            return 0
+        publicList = guildDb.roleIds
+        staleRoleIds = [roleId for roleId in publicList if guild.get_role(roleId) is None]
+        if not staleRoleIds:
+            return 0
+        for roleId in staleRoleIds:
+            publicList.discard(roleId)
+        self.roleMenus.invalidate(guildId)
+        await self.refreshRoleSelectionDatabase(guildId, guildDb)
+        Metrics.increment("stale_roles_removed_total", len(staleRoleIds))
+        return len(staleRoleIds)
+
+
+    async def reconcileStaleRoles(self) -> None:
+        # Our housekeeping loop. Guilds we've been told about (a role in their list was deleted, or a click found one
+        # missing) are cleaned up straight away, and every cached guild is swept every staleRoleSweepInterval seconds,
+        # to catch any deletes we missed while disconnected.
+        sweepInterval = config.staleRoleSweepInterval if config.staleRoleSweepInterval > 0 else None
+        while True:
+            try:
+                await asyncio.wait_for(self.staleRolesFound.wait(), sweepInterval)
+                guildIds = list(self.staleGuildIds)
+            except asyncio.TimeoutError:
+                guildIds = list(self.guildId2Db.entries)
+            self.staleRolesFound.clear()
+            self.staleGuildIds.clear()
+
+            removed = 0
+            for index, guildId in enumerate(guildIds):
+                try:
+                    removed += await self.removeStaleRoles(guildId)
+                except:
+                    self.log.exception(f"Could not remove deleted roles from guild {guildId}.")
+                if index % 100 == 99:
+                    # Let everything else have a turn during a big sweep.
+                    await asyncio.sleep(0)
+            if removed:
+                self.log.print(f"Removed {removed} deleted roles from {len(guildIds)} guilds' role selection lists.")
+
+
+    def getSnapshotEntry(self, guildDb:Storage.GuildConfig) -> tuple:
+        # The parts of a guild's database we keep in our snapshot, (version, rolesChannelId, roleIds).
+        return (guildDb.version, guildDb.rolesChannelId, tuple(guildDb.roleIds))
+
+
+    async def saveSnapshot(self) -> None:
+        # Snapshot every cached guild, least recently used first. Only the file is written off the event loop, copying
+        # out the IDs is quick.
+        guilds = [(guildId, *self.getSnapshotEntry(guildDb)) for guildId, (guildDb, loadedAt) in self.guildId2Db.entries.items()]
+        await asyncio.to_thread(Storage.writeSnapshot, self.snapshotPath, guilds)
+
+
+    async def saveSnapshotPeriodically(self) -> None:
+        while True:
+            await asyncio.sleep(config.guildSnapshotInterval)
+            try:
+                await self.saveSnapshot()
+            except:
+                self.log.exception("Could not save the guild snapshot.")
 
 
-        guildId2Db = {}
-        if config.useMongoDb:
-            self.mongoClient = pymongo.MongoClient(config.mongoServerString)
-            for guild in self.client.guilds:
-                # Load the mongo database for every guild that we're in.
-                guildRawDb = self.mongoClient[str(guild.id)]
-                guildDbCollectionNames = guildRawDb.list_collection_names()
-                guildId2Db[guild.id] = {}
-                
-                for collectionName in guildDbCollectionNames:
-                    guildCollection = guildRawDb[collectionName]
-                    # Mongo makes this a little more complicated, we need to generate dicts for every document within every collection to generate our
-                    # dict for our guildId2Db dict. We do this so that our mongo and yaml db have parity.
-                    guildCollectionDocuments = list(guildCollection.find())
-                    guildId2Db[guild.id][collectionName] = {str(document["_id"]): {k: v for k, v in document.items() if k != "_id"} for document in guildCollectionDocuments}
+    async def loadSnapshot(self) -> None:
+        # Cache every guild from our last snapshot, so they're served straight away rather than after a database sweep.
+        # They're checked against storage in the background afterwards, see reconcileSnapshot.
+        try:
+            snapshotDbs = await asyncio.to_thread(Storage.readSnapshot, self.snapshotPath)
+        except FileNotFoundError:
+            return
+        except:
+            self.log.exception("Could not read the guild snapshot, guilds will be loaded from storage as they're used instead.")
+            return
+
+        guildId2Entry = {}
+        # The snapshot is least recently used first, so if our cache is now smaller, we keep the most recent guilds.
+        for guildId, guildDb in list(snapshotDbs.items())[-config.guildCacheSize:]:
+            if guildId not in self.guildId2Db and guildId not in self.guildId2Db.loading:
+                self.guildId2Db.put(guildId, guildDb)
+                guildId2Entry[guildId] = self.getSnapshotEntry(guildDb)
+        self.log.print(f"Loaded {len(guildId2Entry)} guilds from the guild snapshot.")
+        asyncio.create_task(self.reconcileSnapshot(guildId2Entry))
+
+
+    async def reconcileSnapshot(self, guildId2Entry:dict, batchSize:int=500) -> None:
+        # Our snapshot may be out of date, if another instance or an admin script changed a guild while we were stopped,
+        # so we reload the snapshot's guilds from storage and bring any that differ up to date. Guilds are updated in
+        # place, as handlers may be holding on to them.
+        guildIds = list(guildId2Entry)
+        updated = 0
+        try:
+            for index in range(0, len(guildIds), batchSize):
+                with Metrics.timer("storage_seconds", operation="loadMany"):
+                    storedDbs = await self.storage.loadGuilds(guildIds[index:index + batchSize])
+                for guildId, storedDb in storedDbs.items():
+                    guildDb = self.guildId2Db.peek(guildId)
+                    # Anything changed since we loaded the snapshot is newer than storage, so we leave it alone.
+                    if guildDb is None or self.writeQueue.getPending(guildId) is not None or self.getSnapshotEntry(guildDb) != guildId2Entry[guildId]:
+                        continue
+                    storedDb = Storage.GuildConfig.fromStorageFormat(storedDb)
+                    if self.getSnapshotEntry(storedDb) != guildId2Entry[guildId]:
+                        guildDb.copyFrom(storedDb)
+                        updated += 1
+            self.log.print(f"Checked {len(guildIds)} snapshot guilds against storage, {updated} were out of date.")
+        except:
+            # Not fatal, any out of date guilds are reloaded once they expire from our cache.
+            self.log.exception("Could not check the guild snapshot against storage.")
 
 
-        else:
-            for guild in self.client.guilds:
-                guildId2Db[guild.id] = {}
-                # This is fine, if the file doesn't exist, it'll be replaced by the default values later in this function anyway.
-                if os.path.exists(f"./databases/{guild.id}.yaml"):
-                    with open(f"./databases/{guild.id}.yaml", "r") as guildDb:
-                        # YAML is simpler, just load the DB file for each guild we're in, or set to an empty dict if it can't be loaded.
-                        guildId2Db[guild.id] = yaml.safe_load(guildDb) or {}
-
-
-        # Checking for missing keys and putting default values in their place
-        # If other DB values are added in the future, this'll need to be modified.
-        channels = guildId2Db[guild.id].get("Channels", {})
-        rolesChannel = channels.get("RolesChannel", {})
-        if "ChannelID" not in rolesChannel:
-            rolesChannel["ChannelID"] = "0"
-        channels["RolesChannel"] = rolesChannel
-        guildId2Db[guild.id]["Channels"] = channels
-        roles = guildId2Db[guild.id].get("Roles", {})
-        roleSelectionList = roles.get("RoleSelectionList", {})
-        if "PublicList" not in roleSelectionList:
-            roleSelectionList["PublicList"] = []
-        roles["RoleSelectionList"] = roleSelectionList
-        guildId2Db[guild.id]["Roles"] = roles
-
-        
-        return guildId2Db
-    
-    
-    def getUniqueId(self, guildId:int, number:int) -> str:
+    def getUniqueId(self, guildId:int, number:int, namespace:str="roleSelection") -> str:
 
         # This is utilised so that every button and selection list can have a unique identifier.
+        # Our page buttons use the "rolePage" namespace, with the group of pages they go to as their number.
 
-        return f"roleSelection-{guildId}-{number}"
-    
+        return f"{namespace}-{guildId}-{number}"
 
-    def refreshRoleSelectionDatabase(self, guildId:int) -> None:
-        # We need to do this a lot, so updating the role selection list in the database has its own function here.
-        # We just take a guildId argument in order to update the correct database with our current dict.
 
-        if config.useMongoDb:
-            # We must represent any Discord snowflakes as a string for compatability with a YAML database where needed.
-            roles = self.mongoClient[str(guildId)]["Roles"]
-            roles.update_one({"_id": "RoleSelectionList"}, {"$set": {"PublicList": self.guildId2Db[guildId]["Roles"]["RoleSelectionList"]["PublicList"]}}, upsert=True)
-        else:
-            if not os.path.exists("./databases"):
-                os.makedirs("./databases")
-            with open(f"./databases/{guildId}.yaml", "w") as guildDb:
-                yaml.safe_dump(self.guildId2Db[guildId], guildDb)
+    def parseUniqueId(self, customId:str) -> RoleSelectionId | None:
 
+        # The reverse of getUniqueId, returns None if the custom ID isn't one of ours.
+
+        parts = customId.split("-")
+        if len(parts) != 3 or not parts[1].isdigit() or not parts[2].isdigit():
+            return None
+        return RoleSelectionId(int(parts[1]), int(parts[2]))
     
 
-    @interactions.listen(interactions.api.events.Component)
-    async def handleInteraction(self, event: interactions.api.events.Component) -> None:
-
-        # Here, we have our callback for our buttons and selection lists.
-
-        # First, we check if it's an interaction for roleSelection, otherwise we ignore it.
-        # Since this function would pick up every interaction otherwise.
-        if event.ctx.custom_id.startswith("roleSelection"):
-
-            if event.ctx.component_type == interactions.ComponentType.BUTTON:
-                # It's a button, so we generate custom selection list(s) for the user to select roles and reply with them.
-
-                roleObjects = []
-                index = 0
-                # First, check all of the roles still exist, if not, remove them from both our list and the database.
-                for roleId in self.guildId2Db[event.ctx.guild.id]["Roles"]["RoleSelectionList"]["PublicList"]:
-                    role = event.ctx.guild.get_role(roleId)
-                    if role:
-                        # It exists, so add it to our array of Role objects.
-                        roleObjects.append(role)
-                    else:
-                        # It doesn't exist, so remove it from our dict and database.
-                        self.guildId2Db[event.ctx.guild.id]["Roles"]["RoleSelectionList"]["PublicList"].pop(index)
-                        self.refreshRoleSelectionDatabase(event.ctx.guild.id)
-                    index += 1
-
-                if len(roleObjects) < 1:
-                    # Either no roles have been added yet, or they were deleted, we'll tell the user that and return.
-                    await event.ctx.send("There are currently no roles available.", ephemeral=True)
-                    return
-                
-
-                selectionLists = []
-                options = [[]]# A list of lists of StringSelectOptions for each selection list.
-                index = 0
-                listNumber = 0
-                for role in roleObjects:
-                    # The label arg is what the user sees (we make this the role name),
-                    # the value arg is what's sent back to us when they select it (we make this the role ID).
-                    # The default arg is a bool as to whether it's pre-selected or not.
-                    # We pre-select any roles the user has already obtained to make it tailored to them.
-                    # Otherwise, selection lists may be a little confusing for users to use.
-                    options[listNumber].append(interactions.StringSelectOption(label=role.name, value=str(role.id), default=event.ctx.member.has_role(role)))
-                    index += 1
-                    if index % 25 == 0:
-                        # We have to split the roles into multiple selection lists if there's too many, as Discord has a limit per list.
-                        listNumber += 1
-                        options.append([])
-                
-                index = 1 # This is intentional. Our button is 0!
-                for optionList in options:
-                    # Now to create all of our RoleList instances and add them to the selectionLists list.
-                    # We have each of these in their own ActionRow instance to allow for multiple RoleLists in our response.
-                    if len(optionList) > 0:
-                        selectionLists.append(interactions.ActionRow(RoleList(optionList, self.getUniqueId(event.ctx.guild.id, index), index, len(options))))
-                        index += 1
-
-                # And finally, send them all to the user!
-                await event.ctx.send(components=selectionLists, ephemeral=True)
-
-            elif event.ctx.component_type == interactions.ComponentType.STRING_SELECT:
-                 # It's a string selection list, so we check what's selected/unselected vs the user's current roles and update them accordingly.
-
-                roleObjects = []
-                
-                for option in event.ctx.component.options:
-                    role = event.ctx.guild.get_role(int(option.value))
-                    if role:
-                        roleObjects.append(role)
-                    else:
-                        await event.ctx.send("The list of available roles has changed. Please press \"Get roles...\" again for the updated list.", ephemeral=True)
-                        return
-                    
-
-                # Now, we give the user the roles, and generate a user friendly response listing what roles were added or removed.
-                responseText = ""
-                addedRoleNames = ""
-                removedRoleNames = ""
-                # I've (mostly) done this in a way so that, if it ever was needed for multiple roles to be selected in the future, it can be handled fine
-                for role in roleObjects:
-                    if str(role.id) not in event.ctx.values:
-                        if event.ctx.member.has_role(role):
+    def buildRoleListRow(self, guildId:int, roleMenu:Caching.RoleMenu, pageIndex:int, memberRoleIds:set=frozenset()) -> interactions.ActionRow:
+        # The label arg is what the user sees (we make this the role name),
+        # the value arg is what's sent back to us when they select it (we make this the role ID).
+        # The default arg is a bool as to whether it's pre-selected or not.
+        # We pre-select any roles the user has already obtained to make it tailored to them.
+        # Otherwise, selection lists may be a little confusing for users to use.
+        options = [interactions.StringSelectOption(label=label, value=value, default=roleId in memberRoleIds)
+                   for label, value, roleId in roleMenu.pages[pageIndex]]
+        # Our button is 0, so our RoleLists are numbered from 1.
+        return interactions.ActionRow(RoleList(options, self.getUniqueId(guildId, pageIndex + 1), pageIndex + 1, len(roleMenu.pages)))
+
+
+    def getPagesPerScreen(self, roleMenu:Caching.RoleMenu) -> int:
+        # Up to five pages fit in one message. Past that (over 125 roles), we show four at a time and use the last row
+        # for our previous and next page buttons.
+        return MAX_ROWS if len(roleMenu.pages) <= MAX_ROWS else MAX_ROWS - 1
+
+
+    def buildScreen(self, guildId:int, roleMenu:Caching.RoleMenu, screen:int, memberRoleIds:set) -> list:
+        # Build the components for one group of pages (a screen), only rendering the pages on it.
+        pagesPerScreen = self.getPagesPerScreen(roleMenu)
+        screenCount = math.ceil(len(roleMenu.pages) / pagesPerScreen)
+        screen = max(0, min(screen, screenCount - 1)) # The list may have shrunk since the button was sent.
+
+        selectionLists = []
+        for pageIndex in range(screen * pagesPerScreen, min(len(roleMenu.pages), (screen + 1) * pagesPerScreen)):
+            # We have each RoleList in its own ActionRow instance to allow for multiple RoleLists in our response.
+            if not memberRoleIds.isdisjoint(roleMenu.pageRoleIds[pageIndex]):
+                # The user has a role from this page, so it needs to be tailored to them.
+                selectionLists.append(self.buildRoleListRow(guildId, roleMenu, pageIndex, memberRoleIds))
+            else:
+                # Nothing is pre-selected on this page, so every user gets the same one, which we only build once.
+                if roleMenu.rows[pageIndex] is None:
+                    roleMenu.rows[pageIndex] = self.buildRoleListRow(guildId, roleMenu, pageIndex)
+                selectionLists.append(roleMenu.rows[pageIndex])
+
+        if screenCount > 1:
+            if screen not in roleMenu.pageButtonRows:
+                # Buttons in a message need different custom IDs, so a disabled button points at the screen we're on.
+                roleMenu.pageButtonRows[screen] = interactions.ActionRow(
+                    interactions.Button(style=interactions.ButtonStyle.GREY, label="Previous page", disabled=screen == 0,
+                                        custom_id=self.getUniqueId(guildId, max(screen - 1, 0), "rolePage")),
+                    interactions.Button(style=interactions.ButtonStyle.GREY, label="Next page", disabled=screen == screenCount - 1,
+                                        custom_id=self.getUniqueId(guildId, min(screen + 1, screenCount - 1), "rolePage")))
+            selectionLists.append(roleMenu.pageButtonRows[screen])
+        return selectionLists
+
+
+    def getMemberRoleIds(self, member:interactions.Member) -> set:
+        # The IDs of every role the member has, worked out once per interaction so that role checks are O(1).
+        return {role.id for role in member.roles}
+
+
+    def getRouteRateLimit(self, route:Route) -> tuple | None:
+        # Read the rate limit Discord last gave us for a route, (limit, remaining, resetAfter), from the client's rate
+        # limit buckets.
+        bucketLock = self.client.http.get_ratelimit(route)
+        if bucketLock.bucket_hash is None:
+            # We haven't seen any rate limit headers for this route yet.
+            return None
+        return (bucketLock.limit, bucketLock.remaining, bucketLock.delta)
+
+
+    async def paceMemberRequest(self, pace, member:interactions.Member, method:str, path:str="") -> None:
+        # Called before each member request while our scheduler is applying the change, so it's paced and tuned to the
+        # rate limit of the route we actually use, see Scheduler.RequestPacer. Member rate limits are per guild and
+        # method, so the user and role IDs in the route don't matter.
+        if pace is not None:
+            await pace(Route(method, "/guilds/{guild_id}/members/{user_id}" + path, guild_id=member.guild.id, user_id=0, role_id=0))
+
+
+    async def changeMemberRoles(self, member:interactions.Member, roleObjects:list, selectedValues:set, publicList:Caching.OrderedRoleSet, reason:str, pace=None) -> tuple:
+        # Work out which roles to give and take from the member for their selection, then apply them.
+        # Nothing is applied until we know the final set. Returns (rolesAdded, rolesRemoved, rolesFailed).
+        # pace is given by our scheduler, see paceMemberRequest.
+
+        # We look the user's roles and their selections up in sets, so every check here is O(1).
+        memberRoles = {role.id: role for role in member.roles}
+        rolesToAdd = []
+        rolesToRemove = []
+        # I've (mostly) done this in a way so that, if it ever was needed for multiple roles to be selected in the future, it can be handled fine
+        for role in roleObjects:
+            if str(role.id) not in selectedValues:
+                if role.id in memberRoles:
+                    # If they have the role, get rid of it.
+                    rolesToRemove.append(role)
+            else:
+                if role.id not in memberRoles:
+                    # If they don't have the role, add it.
+                    rolesToAdd.append(role)
+
+                    # Change this part if you want multiple roles to be selected (and change the max selection on the RoleList class)
+                    # This checks EVERY role that the user can select, even from other selection lists, to ensure they can only have
+                    # one at a time, as outlined in the brief. We only need to look at the roles the user actually has.
+                    for otherRoleId, otherRole in memberRoles.items():
+                        if otherRoleId != role.id and otherRoleId in publicList and otherRole not in rolesToRemove:
                             # If they have the role, get rid of it.
-                            await event.ctx.member.remove_role(role)
-                            self.log.print(
-                                f"Removed user \"{event.ctx.user.global_name}\" (User ID: {event.ctx.user.id}) from the \"{role.name}\" role (Role ID: {role.id}) in guild \"{event.ctx.guild.name}\" (Guild ID: {event.ctx.guild.id})"
-                                )
-                            removedRoleNames += f"    • {role.name}\n" # Add to our user-friendly list of removed roles.
-                    else:
-                        if not event.ctx.member.has_role(role):
-                            # If they don't have the role, add it.
-                            await event.ctx.member.add_role(role)
-                            self.log.print(
-                                f"Gave user \"{event.ctx.user.global_name}\" (User ID: {event.ctx.user.id}) the \"{role.name}\" role (Role ID: {role.id}) in guild \"{event.ctx.guild.name}\" (Guild ID: {event.ctx.guild.id})"
-                                )
-                            addedRoleNames += f"    • {role.name}\n" # Add to our user-friendly list of added roles.
-
-                            # Change this part if you want multiple roles to be selected (and change the max selection on the RoleList class)
-                            # This checks EVERY role that the user can select, even from other selection lists, to ensure they can only have
-                            # one at a time, as outlined in the brief.
-                            for roleId in self.guildId2Db[event.ctx.guild.id]["Roles"]["RoleSelectionList"]["PublicList"]:
-                                otherRole = event.ctx.guild.get_role(int(roleId))
-                                if otherRole != role:
-                                    if event.ctx.member.has_role(otherRole):
-                                        # If they have the role, get rid of it.
-                                        await event.ctx.member.remove_role(otherRole)
-                                        self.log.print(
-                                            f"Removed user \"{event.ctx.user.global_name}\" (User ID: {event.ctx.user.id}) from the \"{role.name}\" role (Role ID: {role.id}) in guild \"{event.ctx.guild.name}\" (Guild ID: {event.ctx.guild.id})"
-                                            )
-                                        removedRoleNames += f"    • {otherRole.name}\n" # Add to our user-friendly list of removed roles.
-
-                if len(removedRoleNames) == 0 and len(addedRoleNames) == 0:
-                    # No changes to the user's roles.
-                    responseText = "No role changes have been made."
-                else:
-                    if len(removedRoleNames) > 0:
-                        # One or more roles were removed from the user as part of this interaction.
-                        responseText += "**Removed the following roles:**\n"
-                        responseText += removedRoleNames
-                    if len(addedRoleNames) > 0:
-                        # One or more roles were added to the user as part of this interaction.
-                        responseText += "\n\n**Added the following roles:**\n"
-                        responseText += addedRoleNames
-
-                # And finally, send our user friendly response text!
-                await event.ctx.send(responseText, ephemeral=True)
-                
+                            rolesToRemove.append(otherRole)
+
+        rolesFailed = await self.applyRoleChanges(member, rolesToAdd, rolesToRemove, reason, pace)
+        return ([role for role in rolesToAdd if role not in rolesFailed], [role for role in rolesToRemove if role not in rolesFailed], rolesFailed)
+
+
+    async def applyRoleChanges(self, member:interactions.Member, rolesToAdd:list, rolesToRemove:list, reason:str, pace=None) -> list:
+        # Apply all of a member's role changes in as few requests as we can. Returns the roles Discord wouldn't let us change.
+
+        if len(rolesToAdd) + len(rolesToRemove) == 0:
+            return []
+
+        if len(rolesToAdd) + len(rolesToRemove) <= 2:
+            # A single edit needs the member fetched first, so up to two changes cost no more one at a time, and adding
+            # or removing one role never touches the member's other roles.
+            return await self.applyRoleChangesIndividually(member, rolesToAdd, rolesToRemove, reason, pace)
+
+        try:
+            # The edit sets the member's whole role list, so we work it out from their roles right now rather than when
+            # they clicked, which may have been a while ago if the change was queued. Any roles given or taken since (by
+            # staff, another bot or another selection) are kept as they are.
+            await self.paceMemberRequest(pace, member, "GET")
+            Metrics.increment("rest_calls_total", endpoint="fetchMember")
+            currentMember = await member.guild.fetch_member(member.id, force=True)
+            if currentMember is None:
+                # They've left the guild, so every change will fail, and they'll be reported as such.
+                return await self.applyRoleChangesIndividually(member, rolesToAdd, rolesToRemove, reason, pace)
+            finalRoleIds = self.getMemberRoleIds(currentMember)
+            finalRoleIds.difference_update(role.id for role in rolesToRemove)
+            finalRoleIds.update(role.id for role in rolesToAdd)
+            await self.paceMemberRequest(pace, member, "PATCH")
+            Metrics.increment("rest_calls_total", endpoint="editMember")
+            await currentMember.edit(roles=list(finalRoleIds), reason=reason)
+        except interactions.client.errors.HTTPException:
+            # Discord can reject the edit over a role we aren't changing (a managed role, for example). Fall back to
+            # changing only the roles we need to, one at a time.
+            self.log.warning(f"Could not edit roles for member {member.id} in a single request, falling back to individual role changes.")
+            Metrics.increment("errors_total", operation="editMember")
+            return await self.applyRoleChangesIndividually(member, rolesToAdd, rolesToRemove, reason, pace)
+        return []
+
+
+    async def applyRoleChangesIndividually(self, member:interactions.Member, rolesToAdd:list, rolesToRemove:list, reason:str, pace=None) -> list:
+        # One request per role. A role Discord rejects (it was moved above us, for example) doesn't stop the others,
+        # it's returned so the member can be told.
+        rolesFailed = []
+        for role in rolesToRemove:
+            try:
+                await self.paceMemberRequest(pace, member, "DELETE", "/roles/{role_id}")
+                Metrics.increment("rest_calls_total", endpoint="removeRole")
+                await member.remove_role(role, reason=reason)
+            except interactions.client.errors.HTTPException:
+                Metrics.increment("errors_total", operation="removeRole")
+                rolesFailed.append(role)
+        for role in rolesToAdd:
+            try:
+                await self.paceMemberRequest(pace, member, "PUT", "/roles/{role_id}")
+                Metrics.increment("rest_calls_total", endpoint="addRole")
+                await member.add_role(role, reason=reason)
+            except interactions.client.errors.HTTPException:
+                Metrics.increment("errors_total", operation="addRole")
+                rolesFailed.append(role)
+        return rolesFailed
+
+
+    async def getGuildDb(self, guildId:int) -> Storage.GuildConfig:
+        # Return the guild's database, loading it first if it isn't cached.
+        return await self.guildId2Db.get(guildId)
+
+
+    async def getGuildDbForComponent(self, ctx) -> Storage.GuildConfig | None:
+        # Return the guild's database for one of our components (or /findrole, which answers like one), or tell the user
+        # to try again and return None if it isn't cached and storage is currently unavailable.
+        try:
+            return await self.getGuildDb(ctx.guild.id)
+        except Storage.StorageUnavailableError:
+            await ctx.send("Roles are temporarily unavailable, please try again shortly.", ephemeral=True)
+            return None
+
+
+    async def refreshRoleSelectionDatabase(self, guildId:int, guildDb:Storage.GuildConfig) -> bool:
+        # We need to do this a lot, so updating the role selection list in the database has its own function here.
+        # We take the guildId and its database in order to update the correct database.
+        # Several changes in a short space of time are coalesced into a single write by our write queue.
+        # Returns whether the change has been stored yet, see Storage.WriteBehindQueue.save.
+        return await self.writeQueue.save(guildId, guildDb, Storage.ROLE_SELECTION_LIST)
+
+
+    def getSavedNote(self, saved:bool) -> str:
+        # Added to our success messages, so staff know when a change is only queued (storage is unavailable, or writes are batched).
+        return "" if saved else " It will be saved shortly."
+
+
+    @interactions.listen(interactions.api.events.GuildJoin)
+    async def onGuildJoin(self, event: interactions.api.events.GuildJoin) -> None:
+        # We've been added to a guild (or it arrived late while we were starting up). Its admins are likely about to set
+        # it up, so we load just this guild's database now rather than on its first interaction.
+        try:
+            await self.getGuildDb(event.guild_id)
+        except:
+            # Not fatal, it'll be loaded when it's first used instead.
+            self.log.exception(f"Could not load the database for newly joined guild {event.guild_id}.")
+
+
+    @interactions.listen(interactions.api.events.GuildLeft)
+    async def onGuildLeft(self, event: interactions.api.events.GuildLeft) -> None:
+        # We've been removed from the guild (or it was deleted), so there's no reason to keep anything for it in memory.
+        # Its database is left in storage, in case we're added back. Any unsaved changes are still saved by our write queue.
+        self.guildId2Db.evict(event.guild_id)
+        self.roleMenus.invalidate(event.guild_id)
+
+
+    @interactions.listen(interactions.api.events.GuildUnavailable)
+    async def onGuildUnavailable(self, event: interactions.api.events.GuildUnavailable) -> None:
+        # A Discord outage, the guild will come back, so we keep its database. Its roles may change while it's away though,
+        # so we drop its role menu, which holds on to its Role objects.
+        self.roleMenus.invalidate(event.guild_id)
+
+
+    @interactions.listen(interactions.api.events.GuildAvailable)
+    async def onGuildAvailable(self, event: interactions.api.events.GuildAvailable) -> None:
+        # The guild is back (after an outage, or on a new session after reconnecting), with a fresh copy of its roles.
+        # We don't load anything here, a new session makes every guild available again, which would mean reloading every
+        # guild's database at once. Cached guilds stay cached and anything else is loaded when it's used.
+        self.roleMenus.invalidate(event.guild_id)
+
+
+    @interactions.listen(interactions.api.events.RoleCreate)
+    async def onRoleCreate(self, event: interactions.api.events.RoleCreate) -> None:
+        # Role positions and names can shift when roles are created, so rebuild the guild's role menu on its next use.
+        self.roleMenus.invalidate(event.guild_id)
+
+
+    @interactions.listen(interactions.api.events.RoleUpdate)
+    async def onRoleUpdate(self, event: interactions.api.events.RoleUpdate) -> None:
+        # The role may have been renamed, so if it's in the guild's role menu, rebuild it on its next use.
+        self.roleMenus.invalidateRole(event.guild_id, event.after.id)
+
+
+    @interactions.listen(interactions.api.events.RoleDelete)
+    async def onRoleDelete(self, event: interactions.api.events.RoleDelete) -> None:
+        self.roleMenus.invalidateRole(event.guild_id, event.id)
+        guildDb = self.guildId2Db.peek(event.guild_id)
+        if guildDb and event.id in guildDb.roleIds:
+            self.markStaleRoles(event.guild_id)
+
+
+    def isValidComponent(self, event: interactions.api.events.Component, componentId:RoleSelectionId) -> bool:
+
+        # Reject components that weren't made for the guild they were used in before we touch any guild state.
+
+        if event.ctx.guild is None or componentId.guildId != event.ctx.guild.id:
+            self.log.print(f"Ignoring interaction from a roleSelection component for another guild: {event.ctx.custom_id}")
+            return False
+        return True
+
+
+    @Metrics.timed("handler_seconds", handler="button")
+    async def handleButton(self, event: interactions.api.events.Component, componentId:RoleSelectionId) -> None:
+
+        # Here, we have our callback for our "Get roles..." button.
+        # We generate custom selection list(s) for the user to select roles and reply with them.
+
+        if not self.isValidComponent(event, componentId):
+            return
 
+        guildDb = await self.getGuildDbForComponent(event.ctx)
+        if guildDb is None:
+            return
+
+        # Our roles are resolved and split into pages ahead of time, and only rebuilt when the list or the guild's roles change.
+        publicList = guildDb.roleIds
+        roleMenu = self.roleMenus.get(event.ctx.guild, publicList)
+
+        if roleMenu.missingRoleIds:
+            # Some of the roles no longer exist. They're already left out of the menu, so we leave removing them from
+            # the list and the database to our reconciler, rather than making the user wait for it.
+            roleMenu.missingRoleIds = []
+            self.markStaleRoles(event.ctx.guild.id)
+
+        if len(roleMenu.roles) < 1:
+            # Either no roles have been added yet, or they were deleted, we'll tell the user that and return.
+            await event.ctx.send("There are currently no roles available.", ephemeral=True)
+            return
+
+
+        # We start on the first page(s), larger lists have buttons to move through the rest, see handlePageButton.
+        selectionLists = self.buildScreen(event.ctx.guild.id, roleMenu, 0, self.getMemberRoleIds(event.ctx.member))
+
+        # And finally, send them all to the user!
+        await event.ctx.send(components=selectionLists, ephemeral=True)
+
+
+    @Metrics.timed("handler_seconds", handler="page")
+    async def handlePageButton(self, event: interactions.api.events.Component, componentId:RoleSelectionId) -> None:
+
+        # Our previous and next page buttons, we replace the selection lists in the user's message with the ones they asked for.
+
+        if not self.isValidComponent(event, componentId):
+            return
+
+        guildDb = await self.getGuildDbForComponent(event.ctx)
+        if guildDb is None:
+            return
+        roleMenu = self.roleMenus.get(event.ctx.guild, guildDb.roleIds)
+        if len(roleMenu.roles) < 1:
+            await event.ctx.edit_origin(content="There are currently no roles available.", components=[])
+            return
+
+        await event.ctx.edit_origin(components=self.buildScreen(event.ctx.guild.id, roleMenu, componentId.number, self.getMemberRoleIds(event.ctx.member)))
+
+
+    @Metrics.timed("handler_seconds", handler="select")
+    async def handleSelection(self, event: interactions.api.events.Component, componentId:RoleSelectionId) -> None:
+
+        # Here, we have our callback for our selection lists.
+        # We check what's selected/unselected vs the user's current roles and update them accordingly.
+
+        if not self.isValidComponent(event, componentId):
+            return
+
+        if config.fastAckRoleSelection:
+            # Acknowledge the selection straight away, then apply it in the background and edit our response with what
+            # happened once it's done. However slow Discord is to change roles, we're never near the interaction deadline.
+            await event.ctx.defer(ephemeral=True)
+            task = asyncio.create_task(self.applySelectionInBackground(event))
+            self.backgroundTasks.add(task)
+            task.add_done_callback(self.backgroundTasks.discard)
+            return
+
+        await self.applySelection(event)
+
+
+    async def applySelectionInBackground(self, event: interactions.api.events.Component) -> None:
+        # Our "select" timing only covers acknowledging a selection in fast-ack mode, so applying it is timed on its own.
+        with Metrics.timer("handler_seconds", handler="applySelection"):
+            await self.applySelection(event)
+
+
+    async def applySelection(self, event: interactions.api.events.Component) -> None:
+
+        # Apply a member's selection, making sure the user always gets a response. In fast-ack mode we run detached, so
+        # nobody else is waiting on us to report a failure.
+
+        try:
+            await self.changeSelectedRoles(event)
+        except Scheduler.SchedulerClosedError:
+            # We're stopping, so the change was never made.
+            await self.sendSelectionError(event, "The bot is restarting, so your roles have not been changed. Please try again shortly.")
+        except asyncio.CancelledError:
+            if asyncio.current_task().cancelling():
+                # We're being cancelled ourselves as the bot stops, so there's nobody left to answer.
+                raise
+            # Something we were waiting on was cancelled instead (a guild load, for example), so the user still needs an answer.
+            self.log.warning(f"Role selection by user {event.ctx.user.id} in guild {event.ctx.guild.id} was interrupted.")
+            await self.sendSelectionError(event, "Your roles could not be changed due to an internal error. Please try again.")
+        except Exception:
+            self.log.exception(f"Could not change roles for user {event.ctx.user.id} in guild \"{event.ctx.guild.name}\" (Guild ID: {event.ctx.guild.id}).")
+            await self.sendSelectionError(event, "Your roles could not be changed due to an internal error. Please try again.")
+
+
+    async def sendSelectionError(self, event: interactions.api.events.Component, message:str) -> None:
+        try:
+            await event.ctx.send(message, ephemeral=True)
+        except Exception:
+            self.log.exception(f"Could not tell user {event.ctx.user.id} their roles could not be changed.")
+
+
+    async def changeSelectedRoles(self, event: interactions.api.events.Component) -> None:
+
+        # Change the member's roles for their selection and respond with the roles we added and removed. If the interaction
+        # has been deferred, our response replaces the "thinking" message.
+
+        guildDb = await self.getGuildDbForComponent(event.ctx)
+        if guildDb is None:
+            return
+
+        roleObjects = []
+        for option in event.ctx.component.options:
+            role = event.ctx.guild.get_role(int(option.value))
+            if role:
+                roleObjects.append(role)
             else:
-                self.log.print(f"Ignoring interaction from invalid roleSelection component: {event.ctx.custom_id}")
+                await event.ctx.send("The list of available roles has changed. Please press \"Get roles...\" again for the updated list.", ephemeral=True)
+                return
+
+        # Now, we work out which roles to give and take from the user, and apply them.
+        publicList = guildDb.roleIds
+        selectedValues = set(event.ctx.values)
+        reason = f"Role selection by {event.ctx.user.username} ({event.ctx.user.id})"
+
+        async def changeRoles(pace=None) -> tuple:
+            return await self.changeMemberRoles(event.ctx.member, roleObjects, selectedValues, publicList, reason, pace)
+
+        if self.roleScheduler:
+            # Our change may have to wait its turn in the guild's queue, so we acknowledge the interaction first
+            # so that it doesn't time out while we wait.
+            if not event.ctx.deferred:
+                await event.ctx.defer(ephemeral=True)
+            result = await self.roleScheduler.submit(event.ctx.guild.id, event.ctx.user.id, changeRoles)
+            if result is Scheduler.RoleMutationScheduler.SUPERSEDED:
+                # The user made another selection before this one was applied, that one will respond instead.
+                await event.ctx.send("This selection was replaced by a newer one.", ephemeral=True)
+                return
+            rolesToAdd, rolesToRemove, rolesFailed = result
+        else:
+            rolesToAdd, rolesToRemove, rolesFailed = await changeRoles()
+
+        # Generate a user friendly response listing what roles were added or removed.
+        responseText = ""
+        addedRoleNames = ""
+        removedRoleNames = ""
+        for role in rolesToRemove:
+            self.log.print(
+                f"Removed user \"{event.ctx.user.global_name}\" (User ID: {event.ctx.user.id}) from the \"{role.name}\" role (Role ID: {role.id}) in guild \"{event.ctx.guild.name}\" (Guild ID: {event.ctx.guild.id})",
+                category="roleChanges")
+            removedRoleNames += f"    • {role.name}\n" # Add to our user-friendly list of removed roles.
+        for role in rolesToAdd:
+            self.log.print(
+                f"Gave user \"{event.ctx.user.global_name}\" (User ID: {event.ctx.user.id}) the \"{role.name}\" role (Role ID: {role.id}) in guild \"{event.ctx.guild.name}\" (Guild ID: {event.ctx.guild.id})",
+                category="roleChanges")
+            addedRoleNames += f"    • {role.name}\n" # Add to our user-friendly list of added roles.
+        failedRoleNames = "".join(f"    • {role.name}\n" for role in rolesFailed)
+        if rolesFailed:
+            self.log.warning(f"Could not change {len(rolesFailed)} roles for user {event.ctx.user.id} in guild \"{event.ctx.guild.name}\" (Guild ID: {event.ctx.guild.id})")
+
+        if len(removedRoleNames) == 0 and len(addedRoleNames) == 0 and len(failedRoleNames) == 0:
+            # No changes to the user's roles.
+            responseText = "No role changes have been made."
+        else:
+            if len(removedRoleNames) > 0:
+                # One or more roles were removed from the user as part of this interaction.
+                responseText += "**Removed the following roles:**\n"
+                responseText += removedRoleNames
+            if len(addedRoleNames) > 0:
+                # One or more roles were added to the user as part of this interaction.
+                responseText += "\n\n**Added the following roles:**\n"
+                responseText += addedRoleNames
+            if len(failedRoleNames) > 0:
+                # Discord wouldn't let us change these, most likely they've been moved above our own role.
+                responseText += "\n\n**Could not change the following roles, please ask a member of staff:**\n"
+                responseText += failedRoleNames
+
+        # And finally, send our user friendly response text!
+        await event.ctx.send(responseText, ephemeral=True)
+
+
+    @interactions.slash_command(name="findrole", description="Search the roles you can select by name.",
+                                options=[{"name": "name",
+                                          "description": "The start of the role's name, or of any word in it.",
+                                          "type": interactions.OptionType.STRING,
+                                          "required": True,
+                                          "autocomplete": True},])
+    @Metrics.timed("handler_seconds", handler="findrole")
+    async def findRole(self, ctx: interactions.SlashContext, name:str) -> None:
+        # For guilds with more roles than fit on a page, users can search for one instead of paging through them all.
+        # We reply with a selection list of the matches, which works just like the ones from the "Get roles..." button.
+        if ctx.guild is None:
+            await ctx.send(embed=interactions.Embed(title="Error", description="Roles can only be searched in a server.", color=Utils.EmbedColours.error), ephemeral=True)
+            return
+        guildDb = await self.getGuildDbForComponent(ctx)
+        if guildDb is None:
+            return
+        roleMenu = self.roleMenus.get(ctx.guild, guildDb.roleIds)
+
+        # A role picked from our suggestions arrives as its ID.
+        role = ctx.guild.get_role(int(name)) if name.isdigit() else None
+        roles = [role] if role and role.id in guildDb.roleIds else roleMenu.search(name, MAX_CHOICES)
+        if not roles:
+            await ctx.send(embed=interactions.Embed(title="No roles found", description="None of the roles you can select match your search.", color=Utils.EmbedColours.error), ephemeral=True)
+            return
+
+        memberRoleIds = self.getMemberRoleIds(ctx.member)
+        options = [interactions.StringSelectOption(label=role.name, value=str(role.id), default=role.id in memberRoleIds) for role in roles]
+        await ctx.send(components=interactions.ActionRow(RoleList(options, self.getUniqueId(ctx.guild.id, 1), 1, 1)), ephemeral=True)
+
+
+    @findRole.autocomplete("name")
+    async def findRoleAutocomplete(self, ctx: interactions.AutocompleteContext) -> None:
+        # Suggest roles as the user types, from our index of role names, see Caching.RoleMenu.search.
+        # Outside a server, or while the guild can't be loaded, there's nothing to suggest.
+        if ctx.guild is None:
+            await ctx.send(choices=[])
+            return
+        try:
+            guildDb = await self.getGuildDb(ctx.guild.id)
+        except Storage.StorageUnavailableError:
+            await ctx.send(choices=[])
+            return
+        roleMenu = self.roleMenus.get(ctx.guild, guildDb.roleIds)
+        await ctx.send(choices=[{"name": role.name[:100], "value": str(role.id)} for role in roleMenu.search(ctx.input_text, MAX_CHOICES)])
 
 
     @interactions.slash_command(name="setroleschannel", description="Specify a roles selection channel.", 
@@ -281,68 +889,52 @@ class RoleSelection(interactions.Extension):
                                           "type": interactions.OptionType.CHANNEL,
                                           "required": True},],
                                 default_member_permissions=interactions.Permissions.MANAGE_WEBHOOKS)
+    @Metrics.timed("handler_seconds", handler="setroleschannel")
     async def setRolesChannel(self, ctx: interactions.SlashContext, channel:interactions.models.discord.channel.GuildChannel) -> None:
         # This is for server staff members to set the channel in which the "Get roles..." button will be sent to.
         await ctx.send(embed=interactions.Embed(title="Please wait", description="Saving your changes...", color=Utils.EmbedColours.neutral), ephemeral=True)
 
-        # We must represent any Discord snowflakes as a string for compatability with a YAML database where needed.
-        self.guildId2Db[ctx.guild.id]["Channels"]["RolesChannel"]["ChannelID"] = str(channel.id)
+        guildDb = await self.getGuildDb(ctx.guild.id)
+        guildDb.rolesChannelId = channel.id
         try:
-            # Updating our mongo or yaml DB with our updated dict.
-            # This is the only place that does this, so I haven't made updating this part of the database a separate function.
-            if config.useMongoDb:
-                channels = self.mongoClient[str(ctx.guild.id)]["Channels"]
-                channels.update_one({"_id": "RolesChannel"}, {"$set": {"ChannelID": str(channel.id)}}, upsert=True)
-            else:
-                if not os.path.exists("./databases"):
-                    os.makedirs("./databases")
-                with open(f"./databases/{ctx.guild.id}.yaml", "w") as guildDb:
-                     yaml.safe_dump(self.guildId2Db[ctx.guild.id], guildDb)
+            # Updating our mongo or yaml DB with our updated settings.
+            saved = await self.writeQueue.save(ctx.guild.id, guildDb, Storage.ROLES_CHANNEL)
 
             # Everything worked, set the success embed.
-            responseEmbed = interactions.Embed(title="Success", description=f"Roles channel set to <#{channel.id}> successfully.", color=Utils.EmbedColours.positive)
+            responseEmbed = interactions.Embed(title="Success", description=f"Roles channel set to <#{channel.id}> successfully.{self.getSavedNote(saved)}", color=Utils.EmbedColours.positive)
             self.log.print(f"Roles channel in guild \"{ctx.guild.name}\" (ID: {ctx.guild.id}) successfully set to #{channel.name}")
         except:
             # There was an exception, tell the user in a friendly embed, then output our exception to console.
             responseEmbed = interactions.Embed(title="Error", description="The roles channel could not be set due to an internal error.", color=Utils.EmbedColours.error)
-            self.log.print(f"Could not set roles channel in guild \"{ctx.guild.name}\" (ID: {ctx.guild.id}) to #{channel.name}\n")
-            print(traceback.format_exc() + "\n")
+            self.log.exception(f"Could not set roles channel in guild \"{ctx.guild.name}\" (ID: {ctx.guild.id}) to #{channel.name}")
 
         # Send our response embed.
         await ctx.edit(embed=responseEmbed)
 
 
     @interactions.slash_command(name="sendrolebutton", description="Resend role selection button in your saved roles channel.", default_member_permissions=interactions.Permissions.MANAGE_WEBHOOKS)
+    @Metrics.timed("handler_seconds", handler="sendrolebutton")
     async def sendRoleButton(self, ctx: interactions.SlashContext) -> None:
         # This is for server staff members to send a fresh copy of the "Get roles..." button in their set roles button. Fails if the channel is not set.
         await ctx.send(embed=interactions.Embed(title="Please wait", description="Sending role button...", color=Utils.EmbedColours.neutral), ephemeral=True)
 
         try:
             success = True
-            if ctx.guild.id in list(self.guildId2Db.keys()):
-                if self.guildId2Db[ctx.guild.id]["Channels"]["RolesChannel"]["ChannelID"] != "0":
-                    # Channel ID exists in the database
-                    rolesChannel = ctx.guild.get_channel(int(self.guildId2Db[ctx.guild.id]["Channels"]["RolesChannel"]["ChannelID"]))
-                    if rolesChannel:
-                        # The channel exists, send the RoleButton.
-                        await rolesChannel.send(components=RoleButton(self.getUniqueId(ctx.guild.id, 0)))
-                    else:
-                        # The set channel no longer exists.
-                        success = False
-                else:
-                    # If the channel ID is 0, that's our default value and therefore the server hasn't set a roles channel yet.
-                    success = False
-
-            else: # The guild isn't in the database, this can happen if we disconnect, join a guild while disconnected, and reconnect on the same instance.
-                self.guildId2Db = self.loadDatabaseItems() # Reload our database, then try again.
-                if ctx.guild.id in list(self.guildId2Db.keys()):
-                    if self.guildId2Db[ctx.guild.id]["Channels"]["RolesChannel"]["ChannelID"] != "0":
-                        rolesChannel = ctx.guild.get_channel(int(self.guildId2Db[ctx.guild.id]["Channels"]["RolesChannel"]["ChannelID"]))
-                        await rolesChannel.send(components=RoleButton(self.getUniqueId(ctx.guild.id, 0)))
-                    else:
-                        success = False
+            # The guild is loaded on demand if it isn't cached, this can happen if we disconnect, join a guild while disconnected,
+            # and reconnect on the same instance, so we never need to reload every guild's database here.
+            guildDb = await self.getGuildDb(ctx.guild.id)
+            if guildDb.rolesChannelId:
+                # Channel ID exists in the database
+                rolesChannel = ctx.guild.get_channel(guildDb.rolesChannelId)
+                if rolesChannel:
+                    # The channel exists, send the RoleButton.
+                    await rolesChannel.send(components=RoleButton(self.getUniqueId(ctx.guild.id, 0)))
                 else:
+                    # The set channel no longer exists.
                     success = False
+            else:
+                # If the channel ID is 0, that's our default value and therefore the server hasn't set a roles channel yet.
+                success = False
 
             if success:
                 # Everything was successful, send the success embed.
@@ -353,7 +945,7 @@ class RoleSelection(interactions.Extension):
         except:
             # There was an exception, send the error embed then output the traceback to our console.
             responseEmbed = interactions.Embed(title="Error", description="The role button could not be sent due to an internal error.", color=Utils.EmbedColours.error)
-            print(traceback.format_exc() + "\n")
+            self.log.exception(f"Could not send the role button in guild \"{ctx.guild.name}\" (ID: {ctx.guild.id}).")
 
         await ctx.edit(embed=responseEmbed)
 
@@ -364,29 +956,30 @@ class RoleSelection(interactions.Extension):
                                           "type": interactions.OptionType.ROLE,
                                           "required": True},],
                                 default_member_permissions=interactions.Permissions.MANAGE_WEBHOOKS)
+    @Metrics.timed("handler_seconds", handler="addroletolist")
     async def addRoleToLIst(self, ctx: interactions.SlashContext, role:interactions.models.discord.Role) -> None:
         # This is for server staff members to add a role for users to select on the RoleList.
         await ctx.send(embed=interactions.Embed(title="Please wait", description="Saving your changes...", color=Utils.EmbedColours.neutral), ephemeral=True)
 
+        guildDb = await self.getGuildDb(ctx.guild.id)
 
-        if role.is_assignable and not role.default and str(role.id) not in self.guildId2Db[ctx.guild.id]["Roles"]["RoleSelectionList"]["PublicList"]:
+        if role.is_assignable and not role.default and role.id not in guildDb.roleIds:
             # Checking our role validity, this ensures that it's not above us, it's not the @everyone role, and that it's not already in our list.
 
-            # Add to our dict
-            # We must represent any Discord snowflakes as a string for compatability with a YAML database where needed.
-            self.guildId2Db[ctx.guild.id]["Roles"]["RoleSelectionList"]["PublicList"].append(str(role.id))
+            # Add to our list
+            guildDb.roleIds.add(role.id)
+            self.roleMenus.invalidate(ctx.guild.id)
 
             try:
-                self.refreshRoleSelectionDatabase(ctx.guild.id)
+                saved = await self.refreshRoleSelectionDatabase(ctx.guild.id, guildDb)
 
                 # All was successful, let them know.
-                responseEmbed = interactions.Embed(title="Success", description=f"Added the <@&{role.id}> role to the selection list successfully.", color=Utils.EmbedColours.positive)
+                responseEmbed = interactions.Embed(title="Success", description=f"Added the <@&{role.id}> role to the selection list successfully.{self.getSavedNote(saved)}", color=Utils.EmbedColours.positive)
                 self.log.print(f"Added role \"{role.name}\" (ID: {role.id}) to the selection list in guild \"{ctx.guild.name}\" (ID {ctx.guild.id}) successfully.")
             except:
                 # We encountered an exception, let them know then output the traceback to our console.
                 responseEmbed = interactions.Embed(title="Error", description=f"Could not add the <@&{role.id}> role to the selection list due to an internal error.", color=Utils.EmbedColours.error)
-                self.log.print(f"Failed to add role \"{role.name}\" (ID: {role.id}) to the selection list in guild \"{ctx.guild.name}\" (ID {ctx.guild.id}).")
-                print(traceback.format_exc() + "\n")
+                self.log.exception(f"Failed to add role \"{role.name}\" (ID: {role.id}) to the selection list in guild \"{ctx.guild.name}\" (ID {ctx.guild.id}).")
         else:
             # The role is invalid, it is either above the bot, it's the @everyone role, or it's already on the list for users to select.
             responseEmbed = interactions.Embed(title="Error", description="The role you have specified can't be assigned by this bot or is already in the list.", color=Utils.EmbedColours.error)
@@ -401,31 +994,238 @@ class RoleSelection(interactions.Extension):
                                           "type": interactions.OptionType.ROLE,
                                           "required": True},],
                                 default_member_permissions=interactions.Permissions.MANAGE_WEBHOOKS)
+    @Metrics.timed("handler_seconds", handler="removerolefromlist")
     async def removeRoleFromLIst(self, ctx: interactions.SlashContext, role:interactions.models.discord.Role) -> None:
         # This is for server staff members to remove a role so that users can no longer select it on the RoleList.
         await ctx.send(embed=interactions.Embed(title="Please wait", description="Saving your changes...", color=Utils.EmbedColours.neutral), ephemeral=True)
 
+        guildDb = await self.getGuildDb(ctx.guild.id)
 
-        if str(role.id) in self.guildId2Db[ctx.guild.id]["Roles"]["RoleSelectionList"]["PublicList"]:
+        if role.id in guildDb.roleIds:
 
-            # Remove from our dict
-            self.guildId2Db[ctx.guild.id]["Roles"]["RoleSelectionList"]["PublicList"].pop(
-                self.guildId2Db[ctx.guild.id]["Roles"]["RoleSelectionList"]["PublicList"].index(str(role.id)))
+            # Remove from our list
+            guildDb.roleIds.discard(role.id)
+            self.roleMenus.invalidate(ctx.guild.id)
 
             try:
-                self.refreshRoleSelectionDatabase(ctx.guild.id)
+                saved = await self.refreshRoleSelectionDatabase(ctx.guild.id, guildDb)
 
                 # All was successful, let them know.
-                responseEmbed = interactions.Embed(title="Success", description=f"Removed the <@&{role.id}> role from the selection list successfully.", color=Utils.EmbedColours.positive)
+                responseEmbed = interactions.Embed(title="Success", description=f"Removed the <@&{role.id}> role from the selection list successfully.{self.getSavedNote(saved)}", color=Utils.EmbedColours.positive)
                 self.log.print(f"Removed role \"{role.name}\" (ID: {role.id}) from the selection list in guild \"{ctx.guild.name}\" (ID {ctx.guild.id}) successfully.")
             except:
                 # We encountered an exception, let them know then output the traceback to our console.
                 responseEmbed = interactions.Embed(title="Error", description=f"Could not remove the <@&{role.id}> role from the selection list due to an internal error.", color=Utils.EmbedColours.error)
-                self.log.print(f"Failed to remove role \"{role.name}\" (ID: {role.id}) from the selection list in guild \"{ctx.guild.name}\" (ID {ctx.guild.id}).")
-                print(traceback.format_exc() + "\n")
+                self.log.exception(f"Failed to remove role \"{role.name}\" (ID: {role.id}) from the selection list in guild \"{ctx.guild.name}\" (ID {ctx.guild.id}).")
         else:
             # The role isn't in the selection list for us to remove.
             responseEmbed = interactions.Embed(title="Error", description="The role you have specified isn't in the role selection list.", color=Utils.EmbedColours.error)
 
         # And finally, send our response.
-        await ctx.edit(embed=responseEmbed)
\ No newline at end of file
+        await ctx.edit(embed=responseEmbed)
+
+
+    def findRoles(self, guild:interactions.Guild, roles:str | None, pattern:str | None) -> list:
+        # Resolve a bulk command's roles, given as mentions or IDs in any order, and/or a pattern matched against role
+        # names (case insensitive, * and ? are wildcards). Mentioned roles come first in the order given, then any matches
+        # from the top of the guild's role list down. Roles that don't exist are left out.
+        foundRoles = {}
+        for roleId in ROLE_ID_PATTERN.findall(roles or ""):
+            role = guild.get_role(int(roleId))
+            if role:
+                foundRoles[role.id] = role
+        if pattern:
+            pattern = pattern.lower()
+            for role in sorted(guild.roles, key=lambda role: role.position, reverse=True):
+                if fnmatch.fnmatchcase(role.name.lower(), pattern):
+                    foundRoles.setdefault(role.id, role)
+        return list(foundRoles.values())
+
+
+    async def saveRoleListChanges(self, ctx: interactions.SlashContext, guildDb:Storage.GuildConfig, description:str, *sections:str) -> interactions.Embed:
+        # Save a bulk change to the guild's settings in a single write, and return the embed to respond with.
+        self.roleMenus.invalidate(ctx.guild.id)
+        try:
+            saved = await self.writeQueue.save(ctx.guild.id, guildDb, *(sections or (Storage.ROLE_SELECTION_LIST,)))
+            self.log.print(f"{description} in guild \"{ctx.guild.name}\" (ID {ctx.guild.id}) successfully.")
+            return interactions.Embed(title="Success", description=f"{description} successfully.{self.getSavedNote(saved)}", color=Utils.EmbedColours.positive)
+        except:
+            self.log.exception(f"Failed to save role selection changes in guild \"{ctx.guild.name}\" (ID {ctx.guild.id}).")
+            return interactions.Embed(title="Error", description="Your changes could not be saved due to an internal error.", color=Utils.EmbedColours.error)
+
+
+    @interactions.slash_command(name="addrolestolist", description="Adds several roles to the role channel selection list at once.",
+                                options=[{"name": "roles",
+                                          "description": "The roles to add, as mentions or IDs.",
+                                          "type": interactions.OptionType.STRING,
+                                          "required": False},
+                                         {"name": "pattern",
+                                          "description": "Add every role whose name matches this, * and ? are wildcards (e.g. \"Colour *\").",
+                                          "type": interactions.OptionType.STRING,
+                                          "required": False},],
+                                default_member_permissions=interactions.Permissions.MANAGE_WEBHOOKS)
+    @Metrics.timed("handler_seconds", handler="addrolestolist")
+    async def addRolesToList(self, ctx: interactions.SlashContext, roles:str=None, pattern:str=None) -> None:
+        # The bulk version of /addroletolist, every role is checked and then the list is saved once.
+        await ctx.send(embed=interactions.Embed(title="Please wait", description="Saving your changes...", color=Utils.EmbedColours.neutral), ephemeral=True)
+
+        guildDb = await self.getGuildDb(ctx.guild.id)
+        publicList = guildDb.roleIds
+        addedRoles = []
+        skippedRoles = []
+        for role in self.findRoles(ctx.guild, roles, pattern):
+            if role.id in publicList:
+                continue
+            if role.is_assignable and not role.default:
+                addedRoles.append(role)
+            else:
+                # Either it's above us, or it's the @everyone role.
+                skippedRoles.append(role)
+
+        if addedRoles:
+            for role in addedRoles:
+                publicList.add(role.id)
+            responseEmbed = await self.saveRoleListChanges(ctx, guildDb, f"Added {len(addedRoles)} roles to the selection list")
+        else:
+            responseEmbed = interactions.Embed(title="Error", description="None of the roles you have specified can be added, they either can't be assigned by this bot or are already in the list.", color=Utils.EmbedColours.error)
+        if skippedRoles:
+            responseEmbed.add_field("Skipped (can't be assigned by this bot)", " ".join(f"<@&{role.id}>" for role in skippedRoles)[:1024])
+
+        await ctx.edit(embed=responseEmbed)
+
+
+    @interactions.slash_command(name="removerolesfromlist", description="Removes several roles from the role channel selection list at once.",
+                                options=[{"name": "roles",
+                                          "description": "The roles to remove, as mentions or IDs.",
+                                          "type": interactions.OptionType.STRING,
+                                          "required": False},
+                                         {"name": "pattern",
+                                          "description": "Remove every role whose name matches this, * and ? are wildcards (e.g. \"Colour *\").",
+                                          "type": interactions.OptionType.STRING,
+                                          "required": False},],
+                                default_member_permissions=interactions.Permissions.MANAGE_WEBHOOKS)
+    @Metrics.timed("handler_seconds", handler="removerolesfromlist")
+    async def removeRolesFromList(self, ctx: interactions.SlashContext, roles:str=None, pattern:str=None) -> None:
+        # The bulk version of /removerolefromlist, the list is saved once however many roles are removed.
+        await ctx.send(embed=interactions.Embed(title="Please wait", description="Saving your changes...", color=Utils.EmbedColours.neutral), ephemeral=True)
+
+        guildDb = await self.getGuildDb(ctx.guild.id)
+        publicList = guildDb.roleIds
+        # IDs are taken as they are, so roles that were already deleted can be removed too.
+        roleIds = {int(roleId) for roleId in ROLE_ID_PATTERN.findall(roles or "")}
+        roleIds.update(role.id for role in self.findRoles(ctx.guild, None, pattern))
+        removedRoleIds = [roleId for roleId in roleIds if roleId in publicList]
+
+        if removedRoleIds:
+            for roleId in removedRoleIds:
+                publicList.discard(roleId)
+            responseEmbed = await self.saveRoleListChanges(ctx, guildDb, f"Removed {len(removedRoleIds)} roles from the selection list")
+        else:
+            responseEmbed = interactions.Embed(title="Error", description="None of the roles you have specified are in the role selection list.", color=Utils.EmbedColours.error)
+
+        await ctx.edit(embed=responseEmbed)
+
+
+    @interactions.slash_command(name="reorderrolelist", description="Changes the order of the role channel selection list.",
+                                options=[{"name": "roles",
+                                          "description": "Roles to move to the top of the list, in this order, as mentions or IDs.",
+                                          "type": interactions.OptionType.STRING,
+                                          "required": False},
+                                         {"name": "sortby",
+                                          "description": "Sort the rest of the list.",
+                                          "type": interactions.OptionType.STRING,
+                                          "required": False,
+                                          "choices": [{"name": "Name", "value": "name"},
+                                                      {"name": "Role hierarchy", "value": "position"}]},],
+                                default_member_permissions=interactions.Permissions.MANAGE_WEBHOOKS)
+    @Metrics.timed("handler_seconds", handler="reorderrolelist")
+    async def reorderRoleList(self, ctx: interactions.SlashContext, roles:str=None, sortby:str=None) -> None:
+        # This is for server staff members to choose the order users see the roles in.
+        await ctx.send(embed=interactions.Embed(title="Please wait", description="Saving your changes...", color=Utils.EmbedColours.neutral), ephemeral=True)
+
+        guildDb = await self.getGuildDb(ctx.guild.id)
+        publicList = guildDb.roleIds
+        roleIds = list(publicList)
+        if sortby:
+            # Roles that no longer exist are about to be cleaned up, so where they end up doesn't matter.
+            guildRoles = {roleId: ctx.guild.get_role(roleId) for roleId in roleIds}
+            if sortby == "name":
+                roleIds.sort(key=lambda roleId: guildRoles[roleId].name.lower() if guildRoles[roleId] else "")
+            else:
+                roleIds.sort(key=lambda roleId: guildRoles[roleId].position if guildRoles[roleId] else 0, reverse=True)
+        firstRoleIds = [int(roleId) for roleId in dict.fromkeys(ROLE_ID_PATTERN.findall(roles or "")) if int(roleId) in publicList]
+        roleIds = firstRoleIds + [roleId for roleId in roleIds if roleId not in firstRoleIds]
+
+        if roleIds != list(publicList):
+            # A new list rather than changing the old one in place, so the role menu built from it is rebuilt.
+            guildDb.roleIds = Caching.OrderedRoleSet(roleIds)
+            responseEmbed = await self.saveRoleListChanges(ctx, guildDb, "Reordered the selection list")
+        else:
+            responseEmbed = interactions.Embed(title="Error", description="The role selection list is already in that order.", color=Utils.EmbedColours.error)
+
+        await ctx.edit(embed=responseEmbed)
+
+
+    @interactions.slash_command(name="exportrolelist", description="Exports the roles channel and role selection list as a JSON file.",
+                                default_member_permissions=interactions.Permissions.MANAGE_WEBHOOKS)
+    @Metrics.timed("handler_seconds", handler="exportrolelist")
+    async def exportRoleList(self, ctx: interactions.SlashContext) -> None:
+        # The export is in the same format we store guilds in, minus our own metadata, so it can be edited and imported
+        # into this or any other guild with /importrolelist.
+        guildDb = await self.getGuildDb(ctx.guild.id)
+        storedDb = Storage.toStorageFormat(guildDb)
+        export = {"Channels": storedDb["Channels"], "Roles": storedDb["Roles"]}
+        exportFile = interactions.File(io.BytesIO(json.dumps(export, indent=4).encode()), file_name=f"RoleSelection-{ctx.guild.id}.json")
+        await ctx.send(f"The role selection settings for this server, there are {len(guildDb.roleIds)} roles in the list.", file=exportFile, ephemeral=True)
+
+
+    @interactions.slash_command(name="importrolelist", description="Replaces the roles channel and role selection list with a JSON file from /exportrolelist.",
+                                options=[{"name": "file",
+                                          "description": "The JSON file to import.",
+                                          "type": interactions.OptionType.ATTACHMENT,
+                                          "required": True},],
+                                default_member_permissions=interactions.Permissions.MANAGE_WEBHOOKS)
+    @Metrics.timed("handler_seconds", handler="importrolelist")
+    async def importRoleList(self, ctx: interactions.SlashContext, file:interactions.Attachment) -> None:
+        # Every role is validated the same way /addroletolist does, then the whole import is saved in one write.
+        await ctx.send(embed=interactions.Embed(title="Please wait", description="Importing your settings...", color=Utils.EmbedColours.neutral), ephemeral=True)
+
+        try:
+            if file.size > MAX_IMPORT_SIZE:
+                raise ValueError("File too large")
+            async with aiohttp.ClientSession() as session:
+                async with session.get(file.url) as response:
+                    response.raise_for_status()
+                    sectionValues = Storage.getSectionValues(json.loads(await response.read()))
+            if not sectionValues:
+                raise ValueError("No settings found")
+        except:
+            self.log.exception(f"Could not read the role selection import in guild \"{ctx.guild.name}\" (ID {ctx.guild.id}).")
+            await ctx.edit(embed=interactions.Embed(title="Error", description="That file couldn't be read, please use a file from `/exportrolelist`.", color=Utils.EmbedColours.error))
+            return
+
+        guildDb = await self.getGuildDb(ctx.guild.id)
+        warnings = []
+        if Storage.ROLES_CHANNEL in sectionValues:
+            channelId = sectionValues[Storage.ROLES_CHANNEL]
+            if channelId == 0 or ctx.guild.get_channel(channelId):
+                guildDb.rolesChannelId = channelId
+            else:
+                warnings.append("The roles channel doesn't exist in this server, so it wasn't changed.")
+        if Storage.ROLE_SELECTION_LIST in sectionValues:
+            roleIds = []
+            skippedCount = 0
+            for roleId in dict.fromkeys(sectionValues[Storage.ROLE_SELECTION_LIST]):
+                role = ctx.guild.get_role(roleId)
+                if role and role.is_assignable and not role.default:
+                    roleIds.append(roleId)
+                else:
+                    skippedCount += 1
+            if skippedCount:
+                warnings.append(f"{skippedCount} roles don't exist in this server or can't be assigned by this bot, so they were skipped.")
+            guildDb.roleIds = Caching.OrderedRoleSet(roleIds)
+
+        responseEmbed = await self.saveRoleListChanges(ctx, guildDb, "Imported the role selection settings", *sectionValues)
+        if warnings:
+            responseEmbed.add_field("Warnings", "\n".join(warnings))
+        await ctx.edit(embed=responseEmbed)
@@ -0,0 +1,5 @@
+#!/bin/sh
+# Linux counterpart to start.bat. Rather than re-running a single process, this runs the launcher, which runs a process
+# per group of shards and restarts any that stop (see Launcher.py).
+cd "$(dirname "$0")"
+exec python3 Launcher.py "$@"
@@ -0,0 +1,103 @@
+"""
+Storage Tests
+~~~~~~~~~~~~~
+
+Tests for how our write queue and circuit breaker hold on to changes while storage is unavailable. Run these from the
+repository root with "python -m pytest" or "python -m unittest discover tests".
+"""
+
+import asyncio
+import atexit
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+
+REPO_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# BotGlobals reads Config.json from the working directory (and writes a default one if it's missing), so we import it
+# from a temporary one with a config of our own.
+workDirectory = tempfile.mkdtemp(prefix="StorageTests")
+atexit.register(shutil.rmtree, workDirectory, ignore_errors=True)
+with open(os.path.join(workDirectory, "Config.json"), "w") as configFile:
+    json.dump({"useMongoDb": False, "logLevel": "CRITICAL"}, configFile)
+previousDirectory = os.getcwd()
+os.chdir(workDirectory)
+sys.path.insert(0, REPO_DIRECTORY)
+try:
+    import Storage
+finally:
+    os.chdir(previousDirectory)
+
+
+class UnreliableStorage(Storage.MemoryStorage):
+
+    # Fails every save with error until it's set to None.
+
+
+    def __init__(self, error:Exception | None) -> None:
+        super().__init__()
+        self.error = error
+        self.attempts = 0
+
+
+    async def saveSections(self, guildId:int, guildDb:Storage.GuildConfig, sections:set) -> int:
+        self.attempts += 1
+        if self.error is not None:
+            raise self.error
+        return await super().saveSections(guildId, guildDb, sections)
+
+
+class WriteBehindQueueTests(unittest.IsolatedAsyncioTestCase):
+
+
+    async def waitFor(self, condition, timeout:float=2.0) -> None:
+        for _ in range(int(timeout / 0.01)):
+            if condition():
+                return
+            await asyncio.sleep(0.01)
+        self.fail("Timed out waiting for the write queue.")
+
+
+    async def testOutageOutlastingMaxFailuresKeepsChanges(self) -> None:
+        # An outage longer than maxFailures reset periods must not drop anything, however many half-open probes fail.
+        backend = UnreliableStorage(ConnectionError("Storage is down."))
+        breaker = Storage.CircuitBreakerStorage(backend, failureThreshold=5, resetTimeout=0.01)
+        queue = Storage.WriteBehindQueue(breaker, 0, maxFailures=5)
+        queue.retryDelay = 0.005
+        guildDb = Storage.GuildConfig()
+        guildDb.rolesChannelId = 1234
+
+        self.assertFalse(await queue.save(42, guildDb, Storage.ROLES_CHANNEL))
+        await self.waitFor(lambda: backend.attempts > queue.maxFailures * 3)
+        await asyncio.sleep(queue.maxFailures * breaker.resetTimeout * 3)
+        self.assertIs(queue.getPending(42), guildDb)
+
+        backend.error = None
+        await self.waitFor(lambda: 42 in backend.guildDbs)
+        self.assertEqual(backend.guildDbs[42]["Channels"]["RolesChannel"]["ChannelID"], "1234")
+        self.assertIsNone(queue.getPending(42))
+        await queue.close()
+
+
+    async def testRepeatedRejectionIsDropped(self) -> None:
+        # Storage could be reached but keeps rejecting the save, so it's given up on after maxFailures attempts.
+        backend = UnreliableStorage(ValueError("Rejected."))
+        breaker = Storage.CircuitBreakerStorage(backend, failureThreshold=5, resetTimeout=0.01)
+        queue = Storage.WriteBehindQueue(breaker, 0.005, maxFailures=3)
+        queue.retryDelay = 0.005
+        guildDb = Storage.GuildConfig()
+
+        self.assertFalse(await queue.save(42, guildDb, Storage.ROLES_CHANNEL))
+        await self.waitFor(lambda: queue.getPending(42) is None and backend.attempts >= queue.maxFailures)
+        await asyncio.sleep(0.05)
+        self.assertEqual(backend.attempts, queue.maxFailures)
+        self.assertIsNone(breaker.openUntil)
+        await queue.close()
+
+
+if __name__ == "__main__":
+    unittest.main()